@@ -1,6 +1,12 @@
 import os
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'notes_project.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
-application = get_asgi_application()
\ No newline at end of file
+application = get_asgi_application()
+
+# Прогрев до первого запроса (NOTES_WARMUP=1). Соединения с БД не открываются:
+# синхронный код под ASGI выполняется в отдельном потоке со своими соединениями
+from notes import warmup  # noqa: E402
+
+warmup.on_load(connect_db=False)
@@ -27,11 +27,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'notes.middleware.MetricsMiddleware',
+    'notes.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'notes.middleware.ShardMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -42,8 +45,14 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Шаблоны проекта — без отступов (notes.loaders), разобранные — в кэше
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'notes.loaders.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -58,12 +67,152 @@ TEMPLATES = [
 WSGI_APPLICATION = 'config.wsgi.application'
 
 # Database
-DATABASES = {
-    'default': {
+# По умолчанию SQLite. NOTES_DB_ENGINE=postgresql включает PostgreSQL
+# (нужен psycopg, см. requirements-postgres.txt): полнотекстовый поиск
+# и trigram-индексы создаются миграциями автоматически.
+NOTES_DB_ENGINE = os.environ.get('NOTES_DB_ENGINE', 'sqlite')
+
+if NOTES_DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'notes'),
+            'USER': os.environ.get('POSTGRES_USER', 'notes'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            # Постоянные соединения: не подключаемся заново на каждый запрос
+            'CONN_MAX_AGE': int(os.environ.get('NOTES_DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            # За pgbouncer в режиме transaction серверные курсоры не работают
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('NOTES_DB_PGBOUNCER') == '1',
+            'OPTIONS': {
+                'connect_timeout': int(os.environ.get('NOTES_DB_CONNECT_TIMEOUT', '5')),
+            },
+        }
+    }
+    INSTALLED_APPS.append('django.contrib.postgres')
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+
+# Шардирование заметок: NOTES_SHARDS отдельных баз (0 — все в default).
+# Для SQLite это файлы db_shard_N.sqlite3, для PostgreSQL — базы <имя>_shard_N
+# на том же сервере. Нужен общий для процессов кэш (NOTES_CACHE_LOCATION).
+# После изменения числа шардов выполните `migrate --database shard_N`
+# и `rebalance_shards`.
+NOTES_SHARDS = int(os.environ.get('NOTES_SHARDS', '0'))
+NOTES_SHARD_DIR = Path(os.environ.get('NOTES_SHARD_DIR', BASE_DIR))
+
+
+def shard_database(index):
+    """Настройки базы шарда shard_<index>"""
+    if NOTES_DB_ENGINE == 'postgresql':
+        return {**DATABASES['default'], 'NAME': f"{DATABASES['default']['NAME']}_shard_{index}"}
+    return {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': NOTES_SHARD_DIR / f'db_shard_{index}.sqlite3',
+    }
+
+
+for index in range(NOTES_SHARDS):
+    DATABASES[f'shard_{index}'] = shard_database(index)
+if NOTES_SHARDS:
+    DATABASE_ROUTERS = ['notes.sharding.ShardRouter']
+
+# Кэш: по умолчанию в памяти процесса. Для нескольких воркеров gunicorn
+# укажите NOTES_CACHE_LOCATION — тогда кэш общий: каталог для файлового
+# кэша или redis://хост:порт/0 (нужен пакет redis)
+if os.environ.get('NOTES_CACHE_LOCATION', '').startswith(('redis://', 'rediss://')):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['NOTES_CACHE_LOCATION'],
+        }
+    }
+elif os.environ.get('NOTES_CACHE_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ['NOTES_CACHE_LOCATION'],
+        }
     }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+# Без общего кэша версии данных хранятся в таблице DataVersion, и процесс
+# помнит прочитанную версию столько секунд (чужие изменения видит с задержкой)
+NOTES_VERSION_LOCAL_TTL = float(os.environ.get('NOTES_VERSION_LOCAL_TTL', '2'))
+
+# Сессии: NOTES_SESSION_BACKEND = db | cached_db | signed_cookies.
+# cached_db читает сессию из кэша и пишет в БД только при изменениях,
+# signed_cookies вообще не обращается к БД.
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
 }
+SESSION_ENGINE = SESSION_ENGINES[os.environ.get('NOTES_SESSION_BACKEND', 'cached_db')]
+SESSION_COOKIE_HTTPONLY = True
+
+# Сообщения хранятся в cookie, а не в сессии — без записи сессии в БД
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
+# Пользователь кэшируется в памяти процесса (сек; 0 — выключить).
+# О смене пароля и прав другие процессы узнают через общий кэш, поэтому
+# без NOTES_CACHE_LOCATION кэш пользователей выключен.
+AUTHENTICATION_BACKENDS = ['notes.auth_backends.CachedModelBackend']
+NOTES_USER_CACHE_TIMEOUT = int(os.environ.get(
+    'NOTES_USER_CACHE_TIMEOUT', '300' if os.environ.get('NOTES_CACHE_LOCATION') else '0'
+))
+
+# Хеширование паролей: NOTES_HASHER_PROFILE = default | tuned | argon2.
+# tuned — PBKDF2 с числом итераций NOTES_PBKDF2_ITERATIONS (старые хеши
+# пересчитываются при входе), argon2 требует пакет argon2-cffi.
+PASSWORD_HASHER_PROFILES = {
+    'default': [
+        'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+        'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+        'django.contrib.auth.hashers.Argon2PasswordHasher',
+        'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+        'django.contrib.auth.hashers.ScryptPasswordHasher',
+    ],
+    'tuned': [
+        'notes.hashers.TunedPBKDF2PasswordHasher',
+        'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+        'django.contrib.auth.hashers.Argon2PasswordHasher',
+    ],
+    'argon2': [
+        'django.contrib.auth.hashers.Argon2PasswordHasher',
+        'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+        'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    ],
+}
+PASSWORD_HASHERS = PASSWORD_HASHER_PROFILES[os.environ.get('NOTES_HASHER_PROFILE', 'default')]
+NOTES_PBKDF2_ITERATIONS = int(os.environ.get('NOTES_PBKDF2_ITERATIONS', '600000'))
+
+# Пул проверки паролей: потоков, мест в очереди и таймаут ожидания (сек).
+# NOTES_HASHER_WORKERS = 0 — хешировать в потоке запроса.
+NOTES_HASHER_WORKERS = int(os.environ.get('NOTES_HASHER_WORKERS', '2'))
+NOTES_HASHER_QUEUE = int(os.environ.get('NOTES_HASHER_QUEUE', '16'))
+NOTES_HASHER_TIMEOUT = 10
+
+# Лимиты попыток (notes.ratelimit): имя -> (попыток, за сколько секунд восстанавливаются).
+# Корзины хранятся в БД (default), лимит общий для всех процессов
+NOTES_RATE_LIMITS = {
+    'login_ip': (20, 60),
+    'login_user': (5, 60),
+    'register_ip': (10, 60 * 60),
+}
+# Заголовок с IP клиента за прокси (например, 'HTTP_X_REAL_IP'); None — REMOTE_ADDR
+NOTES_CLIENT_IP_HEADER = os.environ.get('NOTES_CLIENT_IP_HEADER') or None
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -105,3 +254,54 @@ LOGOUT_REDIRECT_URL = 'login'
 
 # Email settings (для сброса пароля)
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
+
+# Настройки приложения notes
+# Воркеры фонового пула процессов (0 — выполнять синхронно, для тестов и отладки)
+NOTES_PROCESS_WORKERS = int(os.environ.get('NOTES_PROCESS_WORKERS', '2'))
+
+# Заметки, которые не открывали и не меняли столько месяцев, переносятся
+# в архив командой archive_notes (запускать по расписанию)
+NOTES_ARCHIVE_AFTER_MONTHS = int(os.environ.get('NOTES_ARCHIVE_AFTER_MONTHS', '12'))
+
+# Вложения заметок: предельный размер файла в байтах. С NOTES_X_ACCEL_REDIRECT
+# (например, /protected-media/ — internal location nginx с alias на MEDIA_ROOT)
+# файлы после проверки прав отдает nginx
+NOTES_ATTACHMENT_MAX_SIZE = int(os.environ.get('NOTES_ATTACHMENT_MAX_SIZE', str(25 * 1024 * 1024)))
+NOTES_X_ACCEL_REDIRECT = os.environ.get('NOTES_X_ACCEL_REDIRECT', '')
+# Файлы без вложений удаляются не раньше, чем через столько секунд после
+# последней загрузки: загрузка сохраняет файл до создания вложения
+NOTES_ATTACHMENT_GRACE = int(os.environ.get('NOTES_ATTACHMENT_GRACE', '3600'))
+
+# События об изменении заметок (/events/, нужен ASGI: uvicorn config.asgi:application).
+# LocalBroker — в памяти процесса; при нескольких процессах на одной машине
+# укажите notes.events.CacheBroker вместе с NOTES_CACHE_LOCATION
+NOTES_EVENTS_BACKEND = os.environ.get('NOTES_EVENTS_BACKEND', 'notes.events.LocalBroker')
+
+# Метрики /metrics: доступны персоналу или с заголовком Authorization: Bearer <токен>.
+# При нескольких процессах (gunicorn, run_jobs) задайте общий каталог
+# NOTES_METRICS_DIR — процессы сохраняют туда свои счетчики, а счетчики
+# завершившихся процессов сводятся в общий архив
+NOTES_METRICS_TOKEN = os.environ.get('NOTES_METRICS_TOKEN', '')
+NOTES_METRICS_DIR = os.environ.get('NOTES_METRICS_DIR', '')
+
+# Удаление аккаунтов и данных с истекшим сроком (notes.purge, команда purge_data):
+# пачки по NOTES_PURGE_CHUNK_SIZE заметок с паузой NOTES_PURGE_PAUSE секунд.
+# Архив хранится NOTES_ARCHIVE_RETENTION_DAYS дней (0 — бессрочно),
+# завершенные задачи — NOTES_JOB_RETENTION_DAYS дней
+NOTES_PURGE_CHUNK_SIZE = int(os.environ.get('NOTES_PURGE_CHUNK_SIZE', '200'))
+NOTES_PURGE_PAUSE = float(os.environ.get('NOTES_PURGE_PAUSE', '0.05'))
+NOTES_ARCHIVE_RETENTION_DAYS = int(os.environ.get('NOTES_ARCHIVE_RETENTION_DAYS', '0'))
+NOTES_JOB_RETENTION_DAYS = int(os.environ.get('NOTES_JOB_RETENTION_DAYS', '30'))
+
+# Фоновые задачи: задача без пульса (set_progress) дольше стольких секунд
+# возвращается в очередь, а после последней попытки помечается ошибочной
+NOTES_JOBS_STALE_TIMEOUT = int(os.environ.get('NOTES_JOBS_STALE_TIMEOUT', '300'))
+
+# Прогрев процесса при загрузке (импорты, URLconf, шаблоны, соединения с БД).
+# Выключен по умолчанию; с gunicorn.conf.py (preload_app) прогревается мастер
+NOTES_WARMUP = os.environ.get('NOTES_WARMUP') == '1'
+
+# Сжатие ответов (notes.middleware.CompressionMiddleware): brotli, если
+# установлен, иначе gzip; ответы короче NOTES_COMPRESS_MIN_SIZE байт не сжимаются
+NOTES_COMPRESS_MIN_SIZE = int(os.environ.get('NOTES_COMPRESS_MIN_SIZE', '1024'))
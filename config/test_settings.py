@@ -0,0 +1,10 @@
+"""
+Настройки тестов: python manage.py test notes --settings=config.test_settings
+Базы двух шардов создаются и без NOTES_SHARDS — тесты переноса включают
+шардирование через override_settings.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+for index in range(NOTES_SHARDS, 2):  # noqa: F405
+    DATABASES[f'shard_{index}'] = shard_database(index)  # noqa: F405
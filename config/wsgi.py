@@ -1,6 +1,11 @@
 import os
 from django.core.wsgi import get_wsgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'notes_project.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
+
+# Прогрев до первого запроса (NOTES_WARMUP=1); импорт — после настройки Django
+from notes import warmup  # noqa: E402
+
+warmup.on_load()
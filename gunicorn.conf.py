@@ -0,0 +1,38 @@
+# Конфигурация gunicorn: gunicorn config.wsgi:application
+# Приложение загружается один раз в мастере (preload_app), воркеры
+# получают его через fork. С NOTES_WARMUP=1 мастер его еще и прогревает —
+# см. notes/warmup.py
+import multiprocessing
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+# gunicorn 20 загружает приложение (preload_app) до хука on_starting,
+# поэтому флаг выставляется здесь, при чтении конфигурации мастером:
+# прогрев в мастере не должен открывать соединения с БД
+from notes import warmup  # noqa: E402
+
+warmup.FORKING = True
+
+bind = os.environ.get('NOTES_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+preload_app = True
+# Перезапуск воркеров против утечек памяти; разброс — чтобы не все сразу
+max_requests = int(os.environ.get('NOTES_MAX_REQUESTS', '1000'))
+max_requests_jitter = max_requests // 10
+timeout = 30
+
+
+def pre_fork(server, worker):
+    warmup.before_fork()
+
+
+def post_fork(server, worker):
+    warmup.after_fork()
+
+
+def child_exit(server, worker):
+    # Счетчики завершившегося воркера переходят в архив метрик (NOTES_METRICS_DIR)
+    from notes import metrics
+
+    metrics.archive_process(worker.pid)
@@ -1,12 +1,214 @@
-from django.contrib import admin
-from .models import Note
+from django.contrib import admin, messages
+from django.contrib.auth.admin import UserAdmin
+from django.contrib.auth.models import User
+from django.contrib.admin.utils import unquote
+from django.contrib.admin.views.main import PAGE_VAR, SEARCH_VAR
+from django.core.paginator import EmptyPage, Paginator
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Count
+from django.utils.functional import cached_property
+
+from . import purge, sharding
+from .models import Note, Tag
+from .search import SEARCH_CONFIG, search_vector, uses_postgres
+
+# Больше строк — вместо COUNT(*) используется оценка из статистики СУБД,
+# а отфильтрованная выборка считается только до этого предела
+EXACT_COUNT_LIMIT = 10000
+PAGES_AHEAD = 10  # предел растет с номером страницы: листать можно дальше
+
+
+def estimated_count(queryset):
+    """Оценка числа строк таблицы из статистики планировщика или None.
+    На SQLite статистика появляется после ANALYZE."""
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'sqlite':
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+            )
+            if cursor.fetchone() is None:
+                return None
+            # Первое число в stat любого индекса — число строк таблицы
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    return estimate if estimate > 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор без полного COUNT(*) на больших таблицах.
+    Неточное число строк (оценка или предел) помечается в count_label,
+    а страницы за ним остаются доступны."""
+    EXACT = 'exact'
+    ESTIMATE = 'estimate'
+    CAPPED = 'capped'
+
+    def __init__(self, *args, count_limit=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_limit = count_limit or EXACT_COUNT_LIMIT
+        self.count_kind = self.EXACT
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset)
+            if estimate is not None and estimate > self.count_limit:
+                self.count_kind = self.ESTIMATE
+                return estimate
+        # COUNT по подзапросу с LIMIT: строка сверх предела показывает,
+        # что он достигнут
+        count = queryset.order_by()[:self.count_limit + 1].count()
+        if count > self.count_limit:
+            self.count_kind = self.CAPPED
+            return self.count_limit
+        return count
+
+    @property
+    def count_label(self):
+        count = self.count
+        if self.count_kind == self.CAPPED:
+            return f'{count}+'
+        if self.count_kind == self.ESTIMATE:
+            return f'≈{count}'
+        return str(count)
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            # Число строк неточное: за последней страницей могут быть строки
+            if self.count_kind == self.EXACT or int(number) < 1:
+                raise
+            return int(number)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if self.count_kind == self.EXACT:
+            return super().page(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+
+
+def object_db(model, object_id):
+    """База, в которой лежит объект (id заметок и тегов не пересекаются между базами)"""
+    if sharding.is_enabled() and str(object_id).isdigit():
+        for alias in sharding.databases():
+            if model._default_manager.using(alias).filter(pk=object_id).exists():
+                return alias
+    return sharding.current_db()
+
+
+class ShardFilter(admin.SimpleListFilter):
+    """Выбор базы с заметками: список показывает одну базу, а не шард сотрудника"""
+    title = 'База'
+    parameter_name = 'shard'
+
+    def __init__(self, request, params, model, model_admin):
+        super().__init__(request, params, model, model_admin)
+        self.database = model_admin.list_db(request)
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in sharding.databases()]
+
+    def has_output(self):
+        return sharding.is_enabled()
+
+    def choices(self, changelist):
+        # Без «Все»: базы не объединить в одну выборку
+        for alias, title in self.lookup_choices:
+            yield {
+                'selected': alias == self.database,
+                'query_string': changelist.get_query_string({self.parameter_name: alias}),
+                'display': title,
+            }
+
+    def queryset(self, request, queryset):
+        # Выборка привязана к базе и при отрисовке шаблона (date_hierarchy)
+        return queryset.using(self.database) if sharding.is_enabled() else queryset
+
+
+class ShardedAdmin(admin.ModelAdmin):
+    """Админка моделей заметок при шардировании: список — из выбранной базы
+    (по умолчанию из базы выбранного автора или найденного id, иначе default),
+    страницы объекта — из базы, где он лежит"""
+
+    def list_db(self, request):
+        if not sharding.is_enabled():
+            return sharding.current_db()
+        alias = request.GET.get(ShardFilter.parameter_name)
+        if alias in sharding.databases():
+            return alias
+        author = request.GET.get(AuthorFilter.parameter_name, '')
+        if author.isdigit():
+            return sharding.db_for_user(int(author))
+        term = request.GET.get(SEARCH_VAR, '').strip()
+        if term.isdigit():
+            return object_db(self.model, term)
+        return DEFAULT_DB_ALIAS
+
+    def changelist_view(self, request, extra_context=None):
+        with sharding.use_db(self.list_db(request)):
+            return super().changelist_view(request, extra_context)
+
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        if object_id is None:
+            return super().changeform_view(request, object_id, form_url, extra_context)
+        with sharding.use_db(object_db(self.model, unquote(object_id))):
+            return super().changeform_view(request, object_id, form_url, extra_context)
+
+    def delete_view(self, request, object_id, extra_context=None):
+        with sharding.use_db(object_db(self.model, unquote(object_id))):
+            return super().delete_view(request, object_id, extra_context)
+
+    def history_view(self, request, object_id, extra_context=None):
+        with sharding.use_db(object_db(self.model, unquote(object_id))):
+            return super().history_view(request, object_id, extra_context)
+
+
+class AuthorFilter(admin.SimpleListFilter):
+    """Фильтр по автору с автодополнением вместо списка всех пользователей"""
+    title = 'Автор'
+    parameter_name = 'author'
+    template = 'admin/notes/author_filter.html'
+
+    def lookups(self, request, model_admin):
+        # Только выбранный автор — чтобы показать его имя в поле
+        value = self.value()
+        if value and value.isdigit():
+            return list(User.objects.filter(pk=value).values_list('pk', 'username'))
+        return []
+
+    def has_output(self):
+        return True
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if value and value.isdigit():
+            return queryset.filter(author_id=value)
+        return queryset
+
 
 @admin.register(Note)
-class NoteAdmin(admin.ModelAdmin):
+class NoteAdmin(ShardedAdmin):
     list_display = ('title', 'author', 'created_at', 'updated_at')
-    list_filter = ('created_at', 'author')
-    search_fields = ('title', 'content', 'author__username')
+    list_filter = (ShardFilter, AuthorFilter)
+    # Поиск по заголовку; на PostgreSQL — полнотекстовый по GIN-индексу
+    search_fields = ('title',)
+    search_help_text = 'Поиск по заголовку или id; на PostgreSQL — и по тексту'
+    date_hierarchy = 'updated_at'
+    autocomplete_fields = ('author',)
     readonly_fields = ('created_at', 'updated_at')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     fieldsets = (
         ('Основная информация', {
             'fields': ('title', 'content', 'author')
@@ -17,7 +219,87 @@ class NoteAdmin(admin.ModelAdmin):
         }),
     )
 
+    class Media:
+        css = {'all': ('admin/css/vendor/select2/select2.css', 'admin/css/autocomplete.css')}
+        js = (
+            'admin/js/vendor/jquery/jquery.js',
+            'admin/js/vendor/select2/select2.full.js',
+            'admin/js/jquery.init.js',
+            'admin/js/autocomplete.js',
+            'js/admin_filters.js',
+        )
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        page = request.GET.get(PAGE_VAR, '')
+        page = int(page) if page.isdigit() else 1
+        return self.paginator(
+            queryset, per_page, orphans, allow_empty_first_page,
+            count_limit=max(EXACT_COUNT_LIMIT, (page + PAGES_AHEAD) * per_page),
+        )
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if sharding.is_enabled():
+            # Пользователи в другой базе — join невозможен
+            queryset = queryset.prefetch_related('author')
+        return queryset
+
+    def get_list_select_related(self, request):
+        return () if sharding.is_enabled() else ('author',)
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if search_term.isdigit():
+            return queryset.filter(pk=search_term), False
+        if search_term and uses_postgres(queryset):
+            from django.contrib.postgres.search import SearchQuery
+
+            query = SearchQuery(search_term, config=SEARCH_CONFIG, search_type='websearch')
+            return queryset.annotate(search=search_vector()).filter(search=query), False
+        return super().get_search_results(request, queryset, search_term)
+
     def save_model(self, request, obj, form, change):
         if not obj.author_id:
             obj.author = request.user
-        super().save_model(request, obj, form, change)
\ No newline at end of file
+        super().save_model(request, obj, form, change)
+
+
+@admin.register(Tag)
+class TagAdmin(ShardedAdmin):
+    list_display = ('name', 'note_count')
+    list_filter = (ShardFilter,)
+    search_fields = ('name',)
+
+    def get_queryset(self, request):
+        # Число заметок — в том же запросе, что и список тегов
+        return super().get_queryset(request).annotate(note_count=Count('notes'))
+
+    @admin.display(description='Заметок', ordering='note_count')
+    def note_count(self, obj):
+        return obj.note_count
+
+
+admin.site.unregister(User)
+
+
+@admin.register(User)
+class AccountAdmin(UserAdmin):
+    """Пользователи удаляются только в фоне, пачками (notes.purge):
+    обычное каскадное удаление блокирует базу на время удаления всех заметок"""
+    actions = ['schedule_deletion']
+
+    def has_delete_permission(self, request, obj=None):
+        # Ни страницы удаления, ни delete_selected — только schedule_deletion
+        return False
+
+    @admin.action(description='Удалить аккаунты вместе с заметками (в фоне)', permissions=['change'])
+    def schedule_deletion(self, request, queryset):
+        users = queryset.exclude(pk=request.user.pk)
+        for user in users:
+            purge.schedule_account_deletion(user)
+        self.message_user(
+            request,
+            f'Аккаунтов поставлено в очередь на удаление: {len(users)}. '
+            'Они заблокированы; данные удалит воркер run_jobs или команда purge_data.',
+            messages.SUCCESS,
+        )
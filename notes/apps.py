@@ -7,7 +7,9 @@ class NotesConfig(AppConfig):
     def ready(self):
         """Инициализация приложения"""
         try:
+            import notes.checks
             import notes.signals
+            import notes.tasks
             import notes.context_processors
         except ImportError:
             pass
\ No newline at end of file
@@ -0,0 +1,110 @@
+"""
+Холодный архив заметок.
+Заметки, которые давно не открывали и не редактировали, переносятся из
+notes_note в отдельную таблицу ArchivedNote со сжатым текстом. Так рабочий
+набор списка, поиска и производных индексов остается небольшим. При
+открытии архивная заметка восстанавливается с тем же id.
+"""
+
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from . import sharding
+from .models import ArchivedNote, Note, Tag
+
+ARCHIVE_AFTER_MONTHS = 12
+CHUNK_SIZE = 500
+VIEW_TOUCH_INTERVAL = timedelta(days=1)  # не чаще раза в сутки пишем дату просмотра
+
+
+def compress(text):
+    return zlib.compress(text.encode('utf-8'), 9)
+
+
+def decompress(data):
+    return zlib.decompress(bytes(data)).decode('utf-8')
+
+
+def archive_after_months():
+    return getattr(settings, 'NOTES_ARCHIVE_AFTER_MONTHS', ARCHIVE_AFTER_MONTHS)
+
+
+def stale_notes(months=None, now=None):
+    """Заметки, которые не открывали и не меняли больше months месяцев"""
+    months = archive_after_months() if months is None else months
+    cutoff = (now or timezone.now()) - timedelta(days=30 * months)
+    return Note.objects.filter(
+        Q(last_viewed_at__isnull=True) | Q(last_viewed_at__lt=cutoff),
+        updated_at__lt=cutoff,
+    )
+
+
+def _archive_chunk(ids):
+    notes = list(Note.objects.filter(pk__in=ids).prefetch_related('tags'))
+    with sharding.atomic():
+        ArchivedNote.objects.bulk_create([
+            ArchivedNote(
+                id=note.pk,
+                author_id=note.author_id,
+                title=note.title,
+                content_compressed=compress(note.content),
+                tag_names=[tag.name for tag in note.tags.all()],
+                created_at=note.created_at,
+                updated_at=note.updated_at,
+            )
+            for note in notes
+        ], ignore_conflicts=True)
+        Note.objects.filter(pk__in=[note.pk for note in notes]).delete()
+    return len(notes)
+
+
+def archive_notes(notes, progress=None):
+    """Переносит заметки в архив пачками по CHUNK_SIZE. Возвращает их число.
+    Заметки с вложениями пропускаются: в архиве вложений нет."""
+    notes = notes.exclude(attachments__isnull=False)
+    ids = list(notes.order_by('pk').values_list('pk', flat=True))
+    archived = 0
+    for start in range(0, len(ids), CHUNK_SIZE):
+        archived += _archive_chunk(ids[start:start + CHUNK_SIZE])
+        if progress is not None:
+            progress(archived, len(ids))
+    return archived
+
+
+def restore(pk, user):
+    """Возвращает архивную заметку пользователя в рабочую таблицу.
+    Возвращает заметку или None, если в архиве ее нет."""
+    with sharding.atomic():
+        archived = ArchivedNote.objects.select_for_update().filter(pk=pk, author=user).first()
+        if archived is None:
+            return None
+        note = Note(
+            pk=archived.pk,
+            author_id=archived.author_id,
+            title=archived.title,
+            content=decompress(archived.content_compressed),
+            last_viewed_at=timezone.now(),
+        )
+        note.save(force_insert=True)
+        # auto_now/auto_now_add перезаписали даты — возвращаем исходные
+        Note.objects.filter(pk=note.pk).update(
+            created_at=archived.created_at, updated_at=archived.updated_at
+        )
+        if archived.tag_names:
+            tags = [Tag.objects.get_or_create(name=name)[0] for name in archived.tag_names]
+            note.tags.add(*tags)
+        archived.delete()
+    note.refresh_from_db()
+    return note
+
+
+def mark_viewed(note):
+    """Запоминает дату просмотра (без изменения updated_at и сигналов)"""
+    now = timezone.now()
+    if note.last_viewed_at is None or note.last_viewed_at < now - VIEW_TOUCH_INTERVAL:
+        Note.objects.filter(pk=note.pk).update(last_viewed_at=now)
+        note.last_viewed_at = now
@@ -0,0 +1,307 @@
+"""
+Вложения заметок.
+Файлы принимаются потоково: обработчик загрузки пишет их кусками во
+временный файл и сразу считает SHA-256, поэтому память не зависит от
+размера файла. Содержимое хранится по хешу (media/blobs/ab/cd/<sha256>):
+одинаковые файлы лежат на диске один раз. Миниатюры картинок делаются в
+пуле процессов в фоне. Отдача поддерживает Range-запросы и читает файл
+кусками (или передается nginx через X-Accel-Redirect).
+"""
+
+import hashlib
+import importlib.util
+import os
+import re
+import shutil
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+from django.db import IntegrityError, transaction
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+
+from . import background, sharding
+from .models import Attachment, Blob
+
+BLOB_DIR = 'blobs'
+THUMB_DIR = 'thumbs'
+MAX_SIZE = 25 * 1024 * 1024  # байт на файл
+THUMB_SIZE = 320  # пикселей по большей стороне
+STREAM_CHUNK = 64 * 1024
+GRACE = 60 * 60  # секунд: столько файл без вложений не удаляется после загрузки
+
+# Тип определяется по сигнатуре файла, а не по заголовку от клиента
+SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'%PDF-', 'application/pdf'),
+]
+
+HAS_PILLOW = importlib.util.find_spec('PIL') is not None
+
+
+class UploadError(Exception):
+    pass
+
+
+def max_size():
+    return getattr(settings, 'NOTES_ATTACHMENT_MAX_SIZE', MAX_SIZE)
+
+
+def grace_period():
+    return timedelta(seconds=getattr(settings, 'NOTES_ATTACHMENT_GRACE', GRACE))
+
+
+class HashingFileUploadHandler(TemporaryFileUploadHandler):
+    """Пишет файл во временный файл кусками и считает SHA-256 по ходу.
+    Слишком большие файлы пропускаются, не дочитываясь до конца."""
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.too_large = []
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size > max_size():
+            self.too_large.append(self.file_name)
+            self.file.close()
+            raise SkipFile()
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        uploaded.sha256 = self.sha256.hexdigest()
+        return uploaded
+
+
+def blob_path(sha256):
+    return Path(settings.MEDIA_ROOT) / BLOB_DIR / sha256[:2] / sha256[2:4] / sha256
+
+
+def thumbnail_path(sha256):
+    return Path(settings.MEDIA_ROOT) / THUMB_DIR / sha256[:2] / f'{sha256}.jpg'
+
+
+def sniff_type(path):
+    with open(path, 'rb') as source:
+        head = source.read(16)
+    for signature, content_type in SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def store(uploaded):
+    """Сохраняет загруженный файл по хешу. Возвращает Blob.
+    Сначала создается или обновляется строка Blob (last_used_at), затем
+    файл: сборка мусора удаляет только строки, давно не обновлявшиеся."""
+    source = uploaded.temporary_file_path()
+    content_type = sniff_type(source)
+    if content_type is None:
+        raise UploadError(f'{uploaded.name}: поддерживаются только изображения и PDF')
+
+    sha256 = uploaded.sha256
+    now = timezone.now()
+    try:
+        blob, created = Blob.objects.get_or_create(
+            sha256=sha256,
+            defaults={'size': uploaded.size, 'content_type': content_type, 'last_used_at': now},
+        )
+    except IntegrityError:
+        # Тот же файл одновременно загрузил кто-то еще
+        blob, created = Blob.objects.get(sha256=sha256), False
+    if not created:
+        Blob.objects.filter(sha256=sha256).update(last_used_at=now)
+
+    path = blob_path(sha256)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Временный файл переносится целиком, без чтения в память
+        # Имя уникально для потока: тот же новый файл могут загружать параллельно
+        partial = f'{path}.{uuid.uuid4().hex}.part'
+        shutil.move(source, partial)
+        os.replace(partial, path)
+    if blob.is_image and not blob.has_thumbnail and HAS_PILLOW:
+        background.run_in_background(generate_thumbnail, sha256)
+    return blob
+
+
+def attach(note, uploaded):
+    blob = store(uploaded)
+    return Attachment.objects.create(
+        note=note, author_id=note.author_id, blob=blob, filename=uploaded.name[:255]
+    )
+
+
+# ============= МИНИАТЮРЫ =============
+
+def make_thumbnail(source, target, size=THUMB_SIZE):
+    """Уменьшенная копия картинки в JPEG. Выполняется в пуле процессов."""
+    from PIL import Image
+
+    with Image.open(source) as image:
+        image.draft('RGB', (size, size))  # JPEG декодируется сразу уменьшенным
+        image.thumbnail((size, size))
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        Path(target).parent.mkdir(parents=True, exist_ok=True)
+        partial = f'{target}.{uuid.uuid4().hex}.part'
+        image.save(partial, 'JPEG', quality=80, optimize=True)
+    os.replace(partial, target)
+    return True
+
+
+def generate_thumbnail(sha256):
+    background.compute(make_thumbnail, str(blob_path(sha256)), str(thumbnail_path(sha256)))
+    Blob.objects.filter(sha256=sha256).update(has_thumbnail=True)
+
+
+# ============= УДАЛЕНИЕ =============
+
+def is_referenced(sha256):
+    """Есть ли вложения с этим файлом в какой-нибудь базе заметок"""
+    return any(
+        Attachment.objects.using(alias).filter(blob_id=sha256).exists()
+        for alias in sharding.databases()
+    )
+
+
+def release(sha256):
+    """Удаляет файл, если на него больше никто не ссылается и его не
+    загружали в течение grace_period(). Файл сначала переименовывается,
+    строка Blob удаляется только если store() не обновил ее за это время;
+    иначе файл возвращается на место."""
+    stale = Blob.objects.filter(sha256=sha256, last_used_at__lt=timezone.now() - grace_period())
+    if is_referenced(sha256) or not stale.exists():
+        return False
+    path = blob_path(sha256)
+    trash = Path(f'{path}.{uuid.uuid4().hex}.deleted')
+    try:
+        os.replace(path, trash)
+    except FileNotFoundError:
+        trash = None
+    if not stale.delete()[0]:
+        if trash is not None:
+            os.replace(trash, path)
+        return False
+    if trash is not None:
+        trash.unlink()
+    thumbnail_path(sha256).unlink(missing_ok=True)
+    return True
+
+
+def note_blobs(notes):
+    """Хеши файлов вложений заметок — собираются до удаления заметок"""
+    return set(Attachment.objects.filter(note__in=notes).values_list('blob_id', flat=True))
+
+
+def release_on_commit(hashes):
+    """release() для файлов после фиксации транзакции удаления в текущей
+    базе заметок (вне транзакции — сразу)"""
+    hashes = set(hashes)
+    if hashes:
+        transaction.on_commit(
+            lambda: [release(sha256) for sha256 in hashes], using=sharding.current_db()
+        )
+
+
+def collect_garbage():
+    """Удаляет файлы без вложений (например, после удаления заметок)"""
+    removed = 0
+    for sha256 in Blob.objects.values_list('sha256', flat=True).iterator():
+        removed += release(sha256)
+    return removed
+
+
+# ============= ОТДАЧА =============
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """(начало, конец включительно) для одного диапазона, None без заголовка,
+    ValueError для недопустимого диапазона"""
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None  # несколько диапазонов и прочее — отдаем файл целиком
+    first, last = match.groups()
+    if first == '':
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size or first > last:
+        raise ValueError(header)
+    return first, last
+
+
+def _read_range(path, first, last):
+    with open(path, 'rb') as source:
+        source.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = source.read(min(STREAM_CHUNK, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def file_response(request, path, content_type, filename, etag, inline=False):
+    """Ответ с файлом: 304 по ETag, 206 для Range, иначе FileResponse
+    (использует sendfile сервера, если он есть)"""
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': f'"{etag}"',
+        # Содержимое по хешу не меняется
+        'Cache-Control': 'private, max-age=31536000, immutable',
+        'X-Content-Type-Options': 'nosniff',
+        'Content-Disposition': content_disposition_header(not inline, filename),
+    }
+    if request.headers.get('If-None-Match') == headers['ETag']:
+        return HttpResponse(status=304, headers=headers)
+
+    accel = getattr(settings, 'NOTES_X_ACCEL_REDIRECT', '')
+    if accel:
+        # nginx сам отдаст файл и обработает Range
+        relative = Path(path).relative_to(settings.MEDIA_ROOT).as_posix()
+        response = HttpResponse(content_type=content_type, headers=headers)
+        response['X-Accel-Redirect'] = f'{accel.rstrip("/")}/{relative}'
+        return response
+
+    size = os.path.getsize(path)
+    try:
+        byte_range = parse_range(request.headers.get('Range'), size)
+    except ValueError:
+        return HttpResponse(status=416, headers={**headers, 'Content-Range': f'bytes */{size}'})
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    first, last = byte_range
+    response = StreamingHttpResponse(
+        _read_range(path, first, last), status=206, content_type=content_type, headers=headers
+    )
+    response['Content-Range'] = f'bytes {first}-{last}/{size}'
+    response['Content-Length'] = str(last - first + 1)
+    return response
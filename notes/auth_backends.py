@@ -0,0 +1,135 @@
+"""
+Бэкенд аутентификации с кэшем пользователей в памяти процесса.
+Проверка пароля выполняется в ограниченном пуле (см. notes.hashing).
+На каждый запрос Django загружает пользователя из auth_user; здесь объект
+берется из локального кэша. Запись сбрасывается сигналами при сохранении
+пользователя (смена пароля) и при изменении его прав, а версия в общем
+кэше Django сообщает об этом остальным процессам. Без общего кэша
+(LocMemCache) другой воркер не узнал бы о смене пароля или блокировке,
+поэтому кэш пользователей выключен (см. notes.checks).
+"""
+
+import copy
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import (
+    check_password, get_hasher, identify_hasher, make_password,
+)
+
+from . import hashing, metrics
+from .versions import USER_SCOPE, bump_version, cache_is_shared, get_version
+
+USER_CACHE_TIMEOUT = 300  # секунд
+
+ALL_USERS = 'all'  # версия, общая для всех пользователей (права групп)
+
+_users = {}  # user_id -> (версия, истекает, пользователь)
+_lock = threading.Lock()
+
+
+def _version(user_id):
+    return get_version(USER_SCOPE, user_id), get_version(USER_SCOPE, ALL_USERS)
+
+
+def _timeout():
+    if not cache_is_shared():
+        return 0
+    return getattr(settings, 'NOTES_USER_CACHE_TIMEOUT', USER_CACHE_TIMEOUT)
+
+
+def _clone(user):
+    # Каждый запрос получает свою копию, чтобы изменения в одном потоке
+    # не проявлялись в других
+    clone = copy.copy(user)
+    clone._state = copy.copy(user._state)
+    clone._state.fields_cache = {}
+    return clone
+
+
+def get_cached_user(user_id, version=None):
+    version = version or _version(user_id)
+    with _lock:
+        cached = _users.get(user_id)
+    if cached is None:
+        return None
+    cached_version, expires, user = cached
+    if cached_version != version or expires < time.monotonic():
+        return None
+    return _clone(user)
+
+
+def cache_user(user, version=None):
+    """Кэширует пользователя. Версию нужно прочитать до загрузки из БД,
+    иначе можно закэшировать устаревший объект с новой версией."""
+    timeout = _timeout()
+    if timeout <= 0:
+        return
+    version = version or _version(user.pk)
+    with _lock:
+        _users[user.pk] = (version, time.monotonic() + timeout, _clone(user))
+
+
+def invalidate_user(user_id):
+    """Сбрасывает кэш пользователя во всех процессах"""
+    with _lock:
+        _users.pop(user_id, None)
+    if _timeout() > 0:
+        bump_version(USER_SCOPE, user_id)
+
+
+def invalidate_all():
+    """Сбрасывает кэш всех пользователей (например, при изменении прав группы)"""
+    with _lock:
+        _users.clear()
+    if _timeout() > 0:
+        bump_version(USER_SCOPE, ALL_USERS)
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend, который не обращается к БД за уже загруженным пользователем
+    и не хеширует пароли в потоке обработки запроса"""
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # Хешируем впустую, чтобы время ответа не выдавало наличие пользователя
+            hashing.run(make_password, password)
+            return None
+
+        if not hashing.run(check_password, password, user.password):
+            return None
+        if self._must_update(user.password):
+            user.password = hashing.run(make_password, password)
+            user.save(update_fields=['password'])
+        return user if self.user_can_authenticate(user) else None
+
+    @staticmethod
+    def _must_update(encoded):
+        try:
+            hasher = identify_hasher(encoded)
+        except ValueError:
+            return False
+        preferred = get_hasher('default')
+        return hasher.algorithm != preferred.algorithm or preferred.must_update(encoded)
+
+    def get_user(self, user_id):
+        if _timeout() <= 0:
+            return super().get_user(user_id)
+        version = _version(user_id)
+        user = get_cached_user(user_id, version)
+        metrics.cache_access('user', user is not None)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache_user(user, version)
+        return user
@@ -0,0 +1,84 @@
+"""
+Фоновое выполнение тяжелых операций вне цикла запрос/ответ.
+Пулы создаются лениво, то есть уже после fork воркера gunicorn.
+При NOTES_PROCESS_WORKERS = 0 всё выполняется синхронно (тесты, отладка).
+"""
+
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_process_pool = None
+_thread_pool = None
+_lock = threading.Lock()
+
+
+def process_workers():
+    return getattr(settings, 'NOTES_PROCESS_WORKERS', 2)
+
+
+def is_synchronous():
+    return process_workers() <= 0
+
+
+def get_process_pool():
+    """Общий пул процессов для вычислений, нагружающих CPU"""
+    global _process_pool
+    with _lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=process_workers())
+        return _process_pool
+
+
+def _get_thread_pool():
+    global _thread_pool
+    with _lock:
+        if _thread_pool is None:
+            _thread_pool = ThreadPoolExecutor(
+                max_workers=process_workers(),
+                thread_name_prefix='notes-background',
+            )
+        return _thread_pool
+
+
+def compute(func, *args):
+    """Выполняет чистую функцию в пуле процессов и ждет результат.
+    Вызывать только из фоновых задач, не из обработчика запроса."""
+    if is_synchronous():
+        return func(*args)
+    return get_process_pool().submit(func, *args).result()
+
+
+def _run_task(func, args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Ошибка фоновой задачи %s', getattr(func, '__name__', func))
+    finally:
+        # У фонового потока свои соединения с БД — закрываем их сами
+        connections.close_all()
+
+
+def run_in_background(func, *args):
+    """Запускает func в фоновом потоке, не блокируя обработку запроса"""
+    if is_synchronous():
+        func(*args)
+        return None
+    return _get_thread_pool().submit(_run_task, func, args)
+
+
+def shutdown():
+    """Останавливает пулы (например, перед fork или при завершении процесса)"""
+    global _process_pool, _thread_pool
+    with _lock:
+        if _thread_pool is not None:
+            _thread_pool.shutdown(wait=False)
+            _thread_pool = None
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False)
+            _process_pool = None
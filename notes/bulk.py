@@ -0,0 +1,89 @@
+"""
+Массовые действия над заметками.
+Каждое действие — один запрос над множеством (delete/update, вставка
+в промежуточную таблицу тегов) в одной транзакции. Большие выборки
+обрабатываются в фоне пачками, чтобы не держать блокировку SQLite долго.
+"""
+
+from . import archive, attachments, events, sharding, trigrams
+from .models import Note, Tag
+from .versions import NOTES_SCOPE, bump_version
+
+ACTION_DELETE = 'delete'
+ACTION_ADD_TAG = 'add_tag'
+ACTION_REMOVE_TAG = 'remove_tag'
+ACTION_ARCHIVE = 'archive'
+ACTIONS = {
+    ACTION_DELETE: 'Удалить',
+    ACTION_ADD_TAG: 'Добавить тег',
+    ACTION_REMOVE_TAG: 'Убрать тег',
+    ACTION_ARCHIVE: 'В архив',
+}
+TAG_ACTIONS = (ACTION_ADD_TAG, ACTION_REMOVE_TAG)
+
+SYNC_LIMIT = 500  # больше заметок — обработка в фоновой задаче
+CHUNK_SIZE = 500  # заметок в одной транзакции при фоновой обработке
+
+
+def resolve_tag(action, tag_name):
+    """id тега для действий с тегами (тег создается при добавлении)"""
+    if action not in TAG_ACTIONS:
+        return None
+    tag_name = tag_name.strip()[:50]
+    if not tag_name:
+        raise ValueError('Укажите тег')
+    if action == ACTION_ADD_TAG:
+        return Tag.objects.get_or_create(name=tag_name)[0].pk
+    tag = Tag.objects.filter(name=tag_name).first()
+    return tag.pk if tag else None
+
+
+def apply(action, user_id, ids, tag_id=None):
+    """Применяет действие к заметкам пользователя с данными id.
+    Возвращает число затронутых заметок."""
+    if action not in ACTIONS:
+        raise ValueError(f'Неизвестное действие: {action}')
+    notes = Note.objects.filter(author_id=user_id, pk__in=ids)
+    through = Note.tags.through
+
+    with sharding.atomic():
+        if action == ACTION_DELETE:
+            hashes = attachments.note_blobs(notes)
+            _, deleted = notes.delete()
+            count = deleted.get(Note._meta.label, 0)
+            attachments.release_on_commit(hashes)
+        elif action == ACTION_ARCHIVE:
+            count = archive.archive_notes(notes)
+        elif action == ACTION_ADD_TAG:
+            note_ids = list(notes.values_list('pk', flat=True))
+            through.objects.bulk_create(
+                [through(note_id=pk, tag_id=tag_id) for pk in note_ids],
+                ignore_conflicts=True,
+            )
+            count = len(note_ids)
+            trigrams.reindex(note_ids)
+        else:
+            note_ids = list(
+                through.objects.filter(note__in=notes, tag_id=tag_id).values_list('note_id', flat=True)
+            )
+            count, _ = through.objects.filter(note_id__in=note_ids, tag_id=tag_id).delete()
+            trigrams.reindex(note_ids)
+
+    # update() и bulk_create() не отправляют сигналы
+    bump_version(NOTES_SCOPE, user_id)
+    events.publish_reload(user_id)
+    return count
+
+
+def apply_in_chunks(action, user_id, ids, tag_id=None, progress=None):
+    """То же, что apply, но каждая пачка в своей короткой транзакции"""
+    total = len(ids)
+    done = 0
+    count = 0
+    for start in range(0, total, CHUNK_SIZE):
+        chunk = ids[start:start + CHUNK_SIZE]
+        count += apply(action, user_id, chunk, tag_id)
+        done += len(chunk)
+        if progress is not None:
+            progress(done, total)
+    return count
@@ -0,0 +1,39 @@
+"""
+Проверки настроек (manage.py check, runserver, migrate).
+Кэши в памяти процесса и версии данных согласуются между воркерами
+только через общий кэш Django.
+"""
+
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+from .versions import cache_is_shared
+
+
+@register(Tags.caches, Tags.security)
+def check_user_cache(app_configs, **kwargs):
+    """Кэш пользователей без общего кэша: смена пароля, блокировка и права
+    применялись бы в других воркерах только через NOTES_USER_CACHE_TIMEOUT"""
+    if getattr(settings, 'NOTES_USER_CACHE_TIMEOUT', 0) > 0 and not cache_is_shared():
+        return [Error(
+            'NOTES_USER_CACHE_TIMEOUT включает кэш пользователей, '
+            'но кэш Django не общий для процессов.',
+            hint='Задайте NOTES_CACHE_LOCATION или NOTES_USER_CACHE_TIMEOUT=0.',
+            id='notes.E001',
+        )]
+    return []
+
+
+
+@register(Tags.caches, Tags.database)
+def check_shard_versions(app_configs, **kwargs):
+    """Шарды без общего кэша: версии данных всех шардов пишутся в одну
+    таблицу базы default, и каждое изменение заметок ждет ее блокировки"""
+    if getattr(settings, 'NOTES_SHARDS', 0) > 0 and not cache_is_shared():
+        return [Warning(
+            'NOTES_SHARDS включает шарды, но кэш Django не общий для процессов: '
+            'версии данных хранятся в таблице DataVersion базы default.',
+            hint='Задайте NOTES_CACHE_LOCATION.',
+            id='notes.W002',
+        )]
+    return []
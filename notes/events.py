@@ -0,0 +1,243 @@
+"""
+События об изменении заметок для открытых вкладок (Server-Sent Events).
+Сигналы публикуют событие после фиксации транзакции, поток /events/
+(асинхронное представление, нужен ASGI) доставляет его всем вкладкам
+пользователя, а скрипт страницы правит список на месте.
+
+Брокер задается настройкой NOTES_EVENTS_BACKEND:
+- LocalBroker (по умолчанию) — очереди в памяти процесса, без внешних служб;
+- CacheBroker — через общий кэш Django, когда процессов несколько
+  (воркеры gunicorn, run_jobs) на одной машине с файловым кэшем.
+"""
+
+import asyncio
+import itertools
+import json
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+from django.utils.module_loading import import_string
+
+from . import sharding
+
+DEFAULT_BACKEND = 'notes.events.LocalBroker'
+QUEUE_SIZE = 100  # событий на подписчика; при переполнении — одно reload
+HEARTBEAT = 15  # секунд между комментариями-пингами
+STREAM_LIFETIME = 300  # секунд; затем браузер переподключается сам
+
+CREATED = 'created'
+UPDATED = 'updated'
+DELETED = 'deleted'
+RELOAD = 'reload'  # изменилось много заметок сразу — список нужно обновить
+
+
+class Subscription:
+    """Очередь событий одного подключения"""
+
+    def __init__(self, broker, user_id):
+        self.broker = broker
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+
+    def put(self, event):
+        # Вызывается в потоке цикла событий
+        if self.queue.full():
+            # Медленный клиент: не копим события, а просим обновить список
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = {'type': RELOAD}
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout):
+        """Следующее событие или None по таймауту"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def __aenter__(self):
+        await self.broker.attach(self)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.broker.detach(self)
+
+
+class LocalBroker:
+    """Подписчики в памяти процесса. Публиковать можно из любого потока."""
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def wants(self, user_id):
+        """Есть ли кому доставлять — иначе событие не собирается вовсе"""
+        with self._lock:
+            return bool(self._subscribers.get(user_id))
+
+    def publish(self, user_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                pass  # цикл событий уже закрыт
+
+    def subscribe(self, user_id):
+        return Subscription(self, user_id)
+
+    async def attach(self, subscription):
+        with self._lock:
+            self._subscribers[subscription.user_id].add(subscription)
+
+    async def detach(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+
+class CacheBroker(LocalBroker):
+    """События передаются между процессами через общий кэш Django.
+    Каждое событие лежит под своим номером; процесс опрашивает номер
+    последнего события только для пользователей со своими подписчиками и
+    раздает новые события локально. Доставка — по возможности: в файловом
+    кэше incr не атомарен, и при гонке событие может потеряться."""
+
+    POLL_INTERVAL = 1  # секунд
+    EVENT_TIMEOUT = 60  # секунд хранения события в кэше
+
+    def __init__(self):
+        super().__init__()
+        self._cursors = {}  # user_id -> номер последнего доставленного события
+        self._poller = None
+
+    def wants(self, user_id):
+        return True  # подписчики могут быть в других процессах
+
+    @staticmethod
+    def _key(user_id, number=None):
+        suffix = 'last' if number is None else number
+        return f'notes:events:{user_id}:{suffix}'
+
+    def publish(self, user_id, event):
+        key = self._key(user_id)
+        cache.add(key, 0, None)
+        number = cache.incr(key)
+        cache.set(self._key(user_id, number), event, self.EVENT_TIMEOUT)
+
+    async def attach(self, subscription):
+        user_id = subscription.user_id
+        if user_id not in self._cursors:
+            self._cursors[user_id] = await asyncio.to_thread(cache.get, self._key(user_id), 0)
+        await super().attach(subscription)
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.get_running_loop().create_task(self._poll())
+
+    async def detach(self, subscription):
+        await super().detach(subscription)
+        if not super().wants(subscription.user_id):
+            self._cursors.pop(subscription.user_id, None)
+
+    def _fetch(self, user_ids):
+        fresh = {}
+        for user_id in user_ids:
+            last = cache.get(self._key(user_id), 0)
+            cursor = self._cursors.get(user_id, last)
+            if last > cursor:
+                keys = [self._key(user_id, number) for number in range(cursor + 1, last + 1)]
+                found = cache.get_many(keys)
+                fresh[user_id] = (last, [found[key] for key in keys if key in found])
+        return fresh
+
+    async def _poll(self):
+        while self._cursors:
+            await asyncio.sleep(self.POLL_INTERVAL)
+            fresh = await asyncio.to_thread(self._fetch, list(self._cursors))
+            for user_id, (last, found) in fresh.items():
+                if user_id in self._cursors:
+                    self._cursors[user_id] = last
+                    for event in found:
+                        super().publish(user_id, event)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+_ids = itertools.count(1)
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            path = getattr(settings, 'NOTES_EVENTS_BACKEND', DEFAULT_BACKEND)
+            _broker = import_string(path)()
+        return _broker
+
+
+@receiver(setting_changed)
+def _reset_broker(setting, **kwargs):
+    global _broker
+    if setting == 'NOTES_EVENTS_BACKEND':
+        with _broker_lock:
+            _broker = None
+
+
+def note_event(kind, note):
+    """Событие об изменении заметки; для новых и измененных — с готовой карточкой"""
+    event = {'type': kind, 'id': note.pk}
+    if kind != DELETED:
+        event['html'] = render_to_string('notes/_note_card.html', {'note': note})
+    return event
+
+
+def _publish_on_commit(user_id, event):
+    # Вкладки не должны увидеть изменения, которые еще могут откатиться
+    broker = get_broker()
+    transaction.on_commit(
+        lambda: broker.publish(user_id, event), using=sharding.current_db()
+    )
+
+
+def publish_note(kind, note):
+    """Событие собирается сразу: после удаления у заметки уже нет id"""
+    if get_broker().wants(note.author_id):
+        _publish_on_commit(note.author_id, note_event(kind, note))
+
+
+def publish_reload(user_id):
+    if get_broker().wants(user_id):
+        _publish_on_commit(user_id, {'type': RELOAD})
+
+
+def format_event(event):
+    """Событие в формате text/event-stream"""
+    data = json.dumps(event, ensure_ascii=False)
+    return f'id: {next(_ids)}\nevent: note\ndata: {data}\n\n'
+
+
+async def stream(user_id, heartbeat=None, lifetime=None):
+    """Поток событий пользователя. Пинги не дают прокси закрыть соединение
+    и выявляют отключившихся клиентов; ограниченное время жизни освобождает
+    подписки, если отключение не было замечено."""
+    heartbeat = heartbeat or HEARTBEAT
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + (lifetime or STREAM_LIFETIME)
+    async with get_broker().subscribe(user_id) as subscription:
+        yield 'retry: 3000\n: connected\n\n'
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            event = await subscription.get(min(heartbeat, remaining))
+            yield format_event(event) if event is not None else ': ping\n\n'
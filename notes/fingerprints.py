@@ -0,0 +1,285 @@
+"""
+Поиск почти-дубликатов заметок.
+Для каждой заметки хранится 64-битный SimHash. Он разбит на 4 полосы по
+16 бит: если отпечатки отличаются не более чем в 3 битах, хотя бы одна
+полоса совпадает (принцип Дирихле). Поэтому кандидаты находятся
+группировкой по полосам, без сравнения всех пар.
+Группы для всех заметок пользователя считаются в фоновой задаче
+fingerprint_notes, страница дубликатов показывает ее результат.
+"""
+
+import hashlib
+
+import numpy as np
+from django.db.models import Q
+
+from . import attachments, jobs, sharding, trigrams
+from .models import Job, Note, NoteFingerprint
+from .text import words
+from .versions import NOTES_SCOPE, get_version
+
+BITS = 64
+BANDS = 4
+BAND_BITS = BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+MAX_DISTANCE = 3  # расстояние Хэмминга, при котором заметки считаются дубликатами
+BATCH_SIZE = 1000
+BAND_FIELDS = [f'band_{i}' for i in range(BANDS)]
+# Корзины до этого размера сравниваются попарно целиком, большие — блоками
+# по MAX_BUCKET_SIZE строк, чтобы матрица пар не росла квадратично
+MAX_BUCKET_SIZE = 200
+MAX_STORED_GROUPS = 500  # сколько групп сохраняется в результате задачи
+JOB_KIND = 'fingerprint_notes'
+
+
+def _features(text):
+    """Слова и пары соседних слов текста"""
+    tokens = words(text)
+    return tokens + [f'{a} {b}' for a, b in zip(tokens, tokens[1:])]
+
+
+def simhash(text):
+    """64-битный SimHash текста (беззнаковое целое)"""
+    features = _features(text)
+    if not features:
+        return 0
+    digests = b''.join(
+        hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+        for feature in features
+    )
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8)).reshape(-1, BITS)
+    # Голосование по каждому биту: +1, если бит установлен, иначе -1
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 - len(features)
+    value = 0
+    for bit in votes > 0:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def to_signed(value):
+    """Беззнаковое 64-битное число -> знаковое (для BigIntegerField)"""
+    return value - (1 << BITS) if value >= 1 << (BITS - 1) else value
+
+
+def to_unsigned(value):
+    return value & ((1 << BITS) - 1)
+
+
+def bands(value):
+    return [(value >> (BAND_BITS * i)) & BAND_MASK for i in range(BANDS)]
+
+
+def distance(a, b):
+    """Расстояние Хэмминга между отпечатками"""
+    return bin(to_unsigned(a) ^ to_unsigned(b)).count('1')
+
+
+def note_text(title, content):
+    return f'{title}\n{content}'
+
+
+def make_fingerprint(note):
+    value = simhash(note_text(note.title, note.content))
+    return NoteFingerprint(
+        note_id=note.pk,
+        author_id=note.author_id,
+        simhash=to_signed(value),
+        **dict(zip(BAND_FIELDS, bands(value))),
+    )
+
+
+def update_fingerprint(note):
+    """Пересчитывает отпечаток заметки (вызывается при сохранении)"""
+    fingerprint = make_fingerprint(note)
+    NoteFingerprint.objects.update_or_create(
+        note_id=note.pk,
+        defaults={
+            field.attname: getattr(fingerprint, field.attname)
+            for field in NoteFingerprint._meta.concrete_fields
+            if not field.primary_key
+        },
+    )
+
+
+def backfill(queryset=None, batch_size=BATCH_SIZE, progress=None):
+    """Создает недостающие отпечатки пачками. Возвращает число созданных.
+    progress(создано) вызывается после каждой пачки."""
+    if queryset is None:
+        queryset = Note.objects.all()
+    notes = (
+        queryset.filter(fingerprint__isnull=True)
+        .order_by()
+        .only('pk', 'title', 'content', 'author_id')
+    )
+    created = 0
+    batch = []
+    for note in notes.iterator(chunk_size=batch_size):
+        batch.append(make_fingerprint(note))
+        if len(batch) >= batch_size:
+            NoteFingerprint.objects.bulk_create(batch, ignore_conflicts=True)
+            created += len(batch)
+            batch = []
+            if progress is not None:
+                progress(created)
+    if batch:
+        NoteFingerprint.objects.bulk_create(batch, ignore_conflicts=True)
+        created += len(batch)
+    return created
+
+
+def candidates(note):
+    """Отпечатки заметок автора, совпадающие с данной хотя бы в одной полосе"""
+    try:
+        fingerprint = note.fingerprint
+    except NoteFingerprint.DoesNotExist:
+        return NoteFingerprint.objects.none()
+    lookup = Q()
+    for field in BAND_FIELDS:
+        lookup |= Q(**{field: getattr(fingerprint, field)})
+    return (
+        NoteFingerprint.objects
+        .filter(lookup, author_id=note.author_id)
+        .exclude(note_id=note.pk)
+    )
+
+
+def find_duplicates(note, max_distance=MAX_DISTANCE):
+    """id заметок, почти совпадающих с данной"""
+    simhash_value = note.fingerprint.simhash
+    return [
+        fingerprint.note_id for fingerprint in candidates(note)
+        if distance(fingerprint.simhash, simhash_value) <= max_distance
+    ]
+
+
+class _DisjointSet:
+    """Объединение по размеру и сжатие путей, без рекурсии"""
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def find(self, item):
+        root = self.parent.setdefault(item, item)
+        while root != self.parent[root]:
+            root = self.parent[root]
+        while item != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if self.size.get(a, 1) < self.size.get(b, 1):
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] = self.size.get(a, 1) + self.size.pop(b, 1)
+
+
+def _popcount(values):
+    """Число единичных битов в каждом элементе массива uint64"""
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def _close_pairs(hashes, members, max_distance):
+    """Пары позиций из большой корзины, сравниваемые блоками строк"""
+    pairs = []
+    for offset in range(0, len(members), MAX_BUCKET_SIZE):
+        block, rest = members[offset:offset + MAX_BUCKET_SIZE], members[offset:]
+        xor = hashes[block][:, None] ^ hashes[rest][None, :]
+        close = (_popcount(xor.ravel()) <= max_distance).reshape(xor.shape)
+        # Строка r блока — это позиция r в rest: берем только пары правее диагонали
+        rows, cols = np.nonzero(np.triu(close, 1))
+        pairs.append((block[rows], rest[cols]))
+    return pairs
+
+
+def duplicate_groups(user_id, max_distance=MAX_DISTANCE):
+    """Группы id почти-дубликатов среди заметок пользователя.
+    Отпечатки читаются из БД один раз. Точные копии (равный SimHash)
+    объединяются сразу, дальше сравниваются только разные отпечатки из
+    общих корзин LSH: корзины одного размера — одной операцией numpy,
+    большие — блоками."""
+    rows = list(
+        NoteFingerprint.objects.filter(author_id=user_id)
+        .order_by().values_list('note_id', 'simhash')
+    )
+    if len(rows) < 2:
+        return []
+    note_ids = np.array([note_id for note_id, _ in rows], dtype=np.int64)
+    hashes, first, inverse = np.unique(
+        np.array([to_unsigned(value) for _, value in rows], dtype=np.uint64),
+        return_index=True, return_inverse=True,
+    )
+    groups = _DisjointSet()
+    for index in np.flatnonzero(first[inverse] != np.arange(len(rows))):
+        groups.union(int(note_ids[index]), int(note_ids[first[inverse[index]]]))
+    # Дальше каждая группа копий представлена первой заметкой
+    note_ids = note_ids[first]
+
+    for band in range(BANDS):
+        keys = (hashes >> np.uint64(BAND_BITS * band)) & np.uint64(BAND_MASK)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        sizes = np.diff(np.r_[starts, len(keys)])
+        pairs = []
+        for size in np.unique(sizes[(sizes > 1) & (sizes <= MAX_BUCKET_SIZE)]):
+            # Строка матрицы — позиции заметок одной корзины
+            members = order[starts[sizes == size][:, None] + np.arange(size)]
+            row, column = np.triu_indices(size, 1)
+            left, right = members[:, row].ravel(), members[:, column].ravel()
+            close = _popcount(hashes[left] ^ hashes[right]) <= max_distance
+            pairs.append((left[close], right[close]))
+        for start, size in zip(starts[sizes > MAX_BUCKET_SIZE], sizes[sizes > MAX_BUCKET_SIZE]):
+            pairs.extend(_close_pairs(hashes, order[start:start + size], max_distance))
+        for left, right in pairs:
+            for a, b in zip(note_ids[left], note_ids[right]):
+                groups.union(int(a), int(b))
+
+    result = {}
+    for note_id in groups.parent:
+        result.setdefault(groups.find(note_id), []).append(note_id)
+    return sorted(sorted(group) for group in result.values() if len(group) > 1)
+
+
+def latest_groups(user):
+    """Группы из последнего расчета в фоне и признак, что они актуальны.
+    Если заметки менялись после расчета, ставит в очередь новый."""
+    version = get_version(NOTES_SCOPE, user.pk)
+    finished = (
+        Job.objects.filter(user=user, kind=JOB_KIND, status=Job.STATUS_DONE)
+        .order_by('-created_at').values_list('result', flat=True).first()
+    ) or {}
+    groups = finished.get('groups')
+    current = isinstance(groups, list) and finished.get('version') == version
+    queued = Job.objects.filter(
+        user=user, kind=JOB_KIND, status__in=(Job.STATUS_PENDING, Job.STATUS_RUNNING)
+    ).exists()
+    if not current and not queued:
+        jobs.enqueue(JOB_KIND, user=user, user_id=user.pk)
+    return (groups if isinstance(groups, list) else []), current
+
+
+def merge_notes(keep, others):
+    """Объединяет дубликаты с заметкой keep: теги переносятся, дубликаты удаляются"""
+    through = Note.tags.through
+    others = list(others)
+    with sharding.atomic():
+        tag_ids = set(
+            through.objects.filter(note__in=others).values_list('tag_id', flat=True)
+        )
+        through.objects.bulk_create(
+            [through(note_id=keep.pk, tag_id=tag_id) for tag_id in tag_ids],
+            ignore_conflicts=True,
+        )
+        duplicates = Note.objects.filter(
+            pk__in=[note.pk for note in others], author_id=keep.author_id
+        )
+        hashes = attachments.note_blobs(duplicates)
+        # delete() считает и каскадные строки (теги, триграммы, отпечатки)
+        _, deleted = duplicates.delete()
+        attachments.release_on_commit(hashes)
+        trigrams.update_note(keep)
+    return deleted.get(Note._meta.label, 0)
@@ -1,5 +1,9 @@
 from django import forms
+from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
+from django.contrib.auth.hashers import make_password
 from .models import Note
+from . import hashing
+from .ratelimit import TokenBucket, client_ip
 
 class NoteForm(forms.ModelForm):
     """Форма для создания и редактирования заметок"""
@@ -28,7 +32,7 @@ class NoteForm(forms.ModelForm):
 
         help_texts = {
             'title': 'Краткое название вашей заметки',
-            'content': 'Основной текст заметки',
+            'content': 'Основной текст заметки. Поддерживается Markdown',
         }
 
     def clean_title(self):
@@ -45,4 +49,74 @@ class NoteForm(forms.ModelForm):
         content = self.cleaned_data.get('content', '').strip()
         if len(content) < 10:
             raise forms.ValidationError('Заметка должна содержать минимум 10 символов')
-        return content
\ No newline at end of file
+        return content
+
+
+class NoteImportForm(forms.Form):
+    """Форма загрузки файла экспорта для импорта заметок"""
+    MAX_SIZE = 20 * 1024 * 1024
+
+    file = forms.FileField(
+        label='Файл экспорта (JSON)',
+        widget=forms.ClearableFileInput(attrs={
+            'class': 'form-control',
+            'accept': '.json,application/json',
+        }),
+    )
+
+    def clean_file(self):
+        """Валидация файла"""
+        file = self.cleaned_data['file']
+        if not file.name.lower().endswith('.json'):
+            raise forms.ValidationError('Нужен файл в формате JSON')
+        if file.size > self.MAX_SIZE:
+            raise forms.ValidationError('Файл не может быть больше 20 МБ')
+        return file
+
+
+class RateLimitedAuthenticationForm(AuthenticationForm):
+    """Форма входа с ограничением неудачных попыток по IP и по имени пользователя"""
+    error_messages = {
+        **AuthenticationForm.error_messages,
+        'rate_limited': 'Слишком много попыток входа. Попробуйте позже.',
+        'overloaded': 'Сервер перегружен, попробуйте войти через минуту.',
+    }
+
+    def clean(self):
+        username = (self.cleaned_data.get('username') or '').lower()
+        ip = client_ip(self.request) if self.request else ''
+        limits = [(TokenBucket.named('login_ip'), ip), (TokenBucket.named('login_user'), username)]
+
+        # Попытка учитывается до проверки пароля, а удачный вход ее возвращает:
+        # параллельные запросы не успевают проверить пароль сверх лимита
+        allowed = [limit.hit(key) for limit, key in limits]
+        if not all(allowed):
+            raise forms.ValidationError(
+                self.error_messages['rate_limited'], code='rate_limited'
+            )
+        try:
+            cleaned_data = super().clean()
+        except hashing.AuthOverloaded:
+            self._undo(limits)
+            raise forms.ValidationError(
+                self.error_messages['overloaded'], code='overloaded'
+            )
+        self._undo(limits)
+        return cleaned_data
+
+    @staticmethod
+    def _undo(limits):
+        for limit, key in limits:
+            limit.undo(key)
+
+
+class RegistrationForm(UserCreationForm):
+    """Регистрация: пароль хешируется в ограниченном пуле (notes.hashing)"""
+
+    def save(self, commit=True):
+        user = forms.ModelForm.save(self, commit=False)
+        user.password = hashing.run(make_password, self.cleaned_data['password1'])
+        if commit:
+            user.save()
+            self.save_m2m()
+        return user
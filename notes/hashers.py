@@ -0,0 +1,16 @@
+"""
+Хешеры паролей с настраиваемой стоимостью.
+"""
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """PBKDF2 с числом итераций из NOTES_PBKDF2_ITERATIONS.
+    Алгоритм тот же (pbkdf2_sha256), поэтому старые хеши проверяются,
+    а при входе пересчитываются с новым числом итераций."""
+
+    @property
+    def iterations(self):
+        return getattr(settings, 'NOTES_PBKDF2_ITERATIONS', PBKDF2PasswordHasher.iterations)
@@ -0,0 +1,58 @@
+"""
+Хеширование паролей в ограниченном пуле потоков.
+PBKDF2 в hashlib отпускает GIL, поэтому при всплеске входов и регистраций
+хеширование занимает не больше NOTES_HASHER_WORKERS ядер, а остальные
+потоки продолжают обслуживать заметки. Если очередь переполнена,
+запрос сразу получает отказ AuthOverloaded, а не ждет.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from django.conf import settings
+
+HASHER_WORKERS = 2
+HASHER_QUEUE = 16  # сколько хеширований может ждать в очереди
+HASHER_TIMEOUT = 10  # секунд
+
+_executor = None
+_slots = None
+_lock = threading.Lock()
+
+
+class AuthOverloaded(Exception):
+    """Пул хеширования перегружен"""
+
+
+def _workers():
+    return getattr(settings, 'NOTES_HASHER_WORKERS', HASHER_WORKERS)
+
+
+def _pool():
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            workers = _workers()
+            queue = getattr(settings, 'NOTES_HASHER_QUEUE', HASHER_QUEUE)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='notes-hasher')
+            _slots = threading.BoundedSemaphore(workers + queue)
+        return _executor, _slots
+
+
+def run(func, *args):
+    """Выполняет func (хеширование или проверку пароля) в пуле и ждет результат"""
+    if _workers() <= 0:
+        return func(*args)
+    executor, slots = _pool()
+    if not slots.acquire(blocking=False):
+        raise AuthOverloaded('Слишком много одновременных проверок паролей')
+    try:
+        future = executor.submit(func, *args)
+    except BaseException:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: slots.release())
+    try:
+        return future.result(timeout=getattr(settings, 'NOTES_HASHER_TIMEOUT', HASHER_TIMEOUT))
+    except TimeoutError:
+        raise AuthOverloaded('Проверка пароля не уложилась в отведенное время')
@@ -0,0 +1,250 @@
+"""
+Очередь фоновых задач на основе БД.
+Задачи ставятся в очередь из представлений (enqueue) и выполняются
+воркерами команды `python manage.py run_jobs`. Внешний брокер не нужен:
+задача захватывается атомарным UPDATE ... WHERE status = 'pending',
+что работает и на SQLite. Пока задача выполняется, set_progress обновляет
+locked_at (пульс); задачу без пульса дольше stale_timeout() воркеры
+возвращают в очередь, а прежний исполнитель при следующем пульсе
+узнает, что задача у него отобрана (JobLost).
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics, sharding
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}  # тип задачи -> функция
+
+RETRY_DELAY = 30  # секунд до повтора после первой ошибки, дальше удваивается
+STALE_TIMEOUT = 5 * 60  # секунд без пульса, после которых задача считается зависшей
+STALE_CHECK_INTERVAL = 60  # как часто воркер ищет зависшие задачи, сек
+
+_stale_lock = threading.Lock()
+_next_stale_check = 0.0
+
+
+class JobLost(Exception):
+    """Задача возвращена в очередь или отдана другому воркеру"""
+
+
+def stale_timeout():
+    return getattr(settings, 'NOTES_JOBS_STALE_TIMEOUT', STALE_TIMEOUT)
+
+
+def task(kind):
+    """Декоратор регистрации задачи. Функция получает job и параметры из payload
+    и возвращает результат, сериализуемый в JSON."""
+    def decorator(func):
+        TASKS[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, user=None, priority=0, max_attempts=3, **payload):
+    """Ставит задачу в очередь"""
+    if kind not in TASKS:
+        raise ValueError(f'Неизвестный тип задачи: {kind}')
+    return Job.objects.create(
+        kind=kind,
+        user=user,
+        payload=payload,
+        priority=priority,
+        max_attempts=max_attempts,
+    )
+
+
+def _owned(job):
+    """Задача, пока она захвачена этим исполнителем"""
+    return Job.objects.filter(pk=job.pk, status=Job.STATUS_RUNNING, locked_by=job.locked_by)
+
+
+def set_progress(job, progress, message=''):
+    """Сохраняет прогресс выполнения (0-100) и сообщение для страницы статуса.
+    Заодно это пульс: долгие задачи вызывают его чаще, чем stale_timeout()."""
+    job.progress = max(0, min(int(progress), 100))
+    job.message = message[:255]
+    now = timezone.now()
+    if not _owned(job).update(
+        progress=job.progress, message=job.message, locked_at=now, updated_at=now
+    ):
+        raise JobLost(f'Задача {job.pk} больше не захвачена {job.locked_by}')
+
+
+def worker_name(suffix=''):
+    name = f'{socket.gethostname()}:{os.getpid()}'
+    return f'{name}:{suffix}' if suffix else name
+
+
+def claim(worker, kinds=None):
+    """Захватывает следующую задачу: сначала по приоритету, затем по времени.
+    kinds ограничивает типы задач."""
+    for _ in range(5):
+        now = timezone.now()
+        pending = Job.objects.filter(status=Job.STATUS_PENDING, run_after__lte=now)
+        if kinds is not None:
+            pending = pending.filter(kind__in=kinds)
+        candidate = (
+            pending
+            .order_by('-priority', 'run_after', 'pk')
+            .values_list('pk', flat=True)
+            .first()
+        )
+        if candidate is None:
+            return None
+        claimed = Job.objects.filter(pk=candidate, status=Job.STATUS_PENDING).update(
+            status=Job.STATUS_RUNNING,
+            locked_by=worker,
+            locked_at=now,
+            attempts=F('attempts') + 1,
+            updated_at=now,
+        )
+        if claimed:
+            return Job.objects.get(pk=candidate)
+        # Задачу перехватил другой воркер — пробуем следующую
+    return None
+
+
+def run(job):
+    """Выполняет захваченную задачу, при ошибке планирует повтор"""
+    func = TASKS.get(job.kind)
+    now = timezone.now()
+    user_id = job.payload.get('user_id', job.user_id)
+    if sharding.is_moving(user_id):
+        # Данные пользователя переносятся в другой шард — откладываем без попытки
+        delay = getattr(settings, 'NOTES_JOBS_RETRY_DELAY', RETRY_DELAY)
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.STATUS_PENDING, attempts=F('attempts') - 1,
+            run_after=now + timedelta(seconds=delay), locked_by='', locked_at=None,
+        )
+        job.refresh_from_db()
+        return job
+    start = time.perf_counter()
+    try:
+        if func is None:
+            raise LookupError(f'Неизвестный тип задачи: {job.kind}')
+        with sharding.for_user(user_id):
+            result = func(job, **job.payload)
+    except JobLost:
+        logger.warning('Задача %s отобрана у воркера %s', job, job.locked_by)
+        return job
+    except Exception:
+        logger.exception('Задача %s завершилась с ошибкой', job)
+        job.error = traceback.format_exc()
+        if func is not None and job.attempts < job.max_attempts:
+            delay = getattr(settings, 'NOTES_JOBS_RETRY_DELAY', RETRY_DELAY)
+            job.status = Job.STATUS_PENDING
+            job.run_after = now + timedelta(seconds=delay * 2 ** (job.attempts - 1))
+        else:
+            job.status = Job.STATUS_FAILED
+    else:
+        job.status = Job.STATUS_DONE
+        job.progress = 100
+        job.result = result
+        job.error = ''
+    # Задачу, возвращенную в очередь без пульса, не перезаписываем
+    if not _owned(job).update(
+        status=job.status, progress=job.progress, result=job.result, error=job.error,
+        run_after=job.run_after, locked_by='', locked_at=None, updated_at=timezone.now(),
+    ):
+        logger.warning('Задача %s отобрана у воркера %s', job, job.locked_by)
+        return job
+    job.locked_by = ''
+    job.locked_at = None
+    metrics.JOBS.inc(job.kind, job.status)
+    metrics.JOB_DURATION.observe(time.perf_counter() - start, job.kind)
+    return job
+
+
+def requeue_stale(timeout=None):
+    """Возвращает в очередь задачи без пульса дольше timeout секунд
+    (воркер, по-видимому, упал); исчерпавшие попытки помечаются ошибочными.
+    Возвращает (возвращено, завершено с ошибкой)."""
+    now = timezone.now()
+    deadline = now - timedelta(seconds=stale_timeout() if timeout is None else timeout)
+    stale = Job.objects.filter(status=Job.STATUS_RUNNING, locked_at__lt=deadline)
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.STATUS_FAILED, error='Воркер перестал отвечать',
+        locked_by='', locked_at=None, updated_at=now,
+    )
+    requeued = stale.update(
+        status=Job.STATUS_PENDING, locked_by='', locked_at=None, updated_at=now,
+    )
+    if requeued or failed:
+        logger.warning('Зависшие задачи: возвращено %s, завершено с ошибкой %s', requeued, failed)
+    return requeued, failed
+
+
+def maybe_requeue_stale():
+    """requeue_stale не чаще раза в STALE_CHECK_INTERVAL секунд на процесс"""
+    global _next_stale_check
+    with _stale_lock:
+        now = time.monotonic()
+        if now < _next_stale_check:
+            return
+        _next_stale_check = now + STALE_CHECK_INTERVAL
+    requeue_stale()
+
+
+def run_pending(worker=None, limit=None):
+    """Выполняет задачи из очереди, пока они есть. Возвращает число выполненных."""
+    worker = worker or worker_name()
+    done = 0
+    while limit is None or done < limit:
+        job = claim(worker)
+        if job is None:
+            break
+        run(job)
+        done += 1
+    return done
+
+
+def work(worker, stop_event, poll_interval=1.0, once=False):
+    """Цикл воркера: берет задачи, пока не будет установлен stop_event"""
+    while not stop_event.is_set():
+        close_old_connections()
+        maybe_requeue_stale()
+        job = claim(worker)
+        if job is not None:
+            run(job)
+            metrics.maybe_flush()
+            continue
+        if once:
+            break
+        stop_event.wait(poll_interval)
+    close_old_connections()
+
+
+def start_threads(count, poll_interval=1.0, once=False):
+    """Запускает count потоков-воркеров. Возвращает (потоки, stop_event)."""
+    stop_event = threading.Event()
+    threads = [
+        threading.Thread(
+            target=work,
+            args=(worker_name(f't{i}'), stop_event, poll_interval, once),
+            name=f'notes-jobs-{i}',
+            daemon=True,
+        )
+        for i in range(count)
+    ]
+    for thread in threads:
+        thread.start()
+    return threads, stop_event
+
+
+def pending_count():
+    """Глубина очереди"""
+    return Job.objects.filter(status=Job.STATUS_PENDING).count()
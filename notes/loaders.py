@@ -0,0 +1,28 @@
+"""
+Загрузчик шаблонов проекта без отступов.
+Отступы и пустые строки исходника убираются один раз, при загрузке
+шаблона (результат кэширует cached.Loader), а не при каждом рендеринге,
+как {% spaceless %}. Перевод строки сохраняется: для HTML он равен
+пробелу, а в <script> не меняет смысл кода. Содержимое <pre> и
+<textarea> не трогается.
+"""
+
+import re
+
+from django.template.loaders import filesystem
+
+PRESERVED = re.compile(r'(<(pre|textarea)\b.*?</\2>)', re.DOTALL | re.IGNORECASE)
+INDENT = re.compile(r'[ \t]*\n\s*')
+
+
+def collapse_whitespace(source):
+    parts = PRESERVED.split(source)
+    # split с двумя группами: текст, блок, имя тега, текст, ...
+    for index in range(0, len(parts), 3):
+        parts[index] = INDENT.sub('\n', parts[index])
+    return ''.join(part for index, part in enumerate(parts) if index % 3 != 2)
+
+
+class Loader(filesystem.Loader):
+    def get_contents(self, origin):
+        return collapse_whitespace(super().get_contents(origin))
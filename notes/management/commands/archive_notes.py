@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from notes import archive, sharding
+
+
+class Command(BaseCommand):
+    help = 'Переносит давно не открытые заметки в архив'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=None,
+                            help='Сколько месяцев заметку не открывали и не меняли '
+                                 '(по умолчанию NOTES_ARCHIVE_AFTER_MONTHS)')
+        parser.add_argument('--user', type=int, help='id пользователя (по умолчанию все)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только посчитать заметки')
+
+    def handle(self, *args, **options):
+        count = 0
+        for alias in sharding.databases():
+            with sharding.use_db(alias):
+                notes = archive.stale_notes(options['months'])
+                if options['user']:
+                    notes = notes.filter(author_id=options['user'])
+                if options['dry_run']:
+                    count += notes.count()
+                else:
+                    count += archive.archive_notes(notes)
+
+        if options['dry_run']:
+            self.stdout.write(f'Будет перенесено в архив: {count}')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Перенесено в архив: {count}'))
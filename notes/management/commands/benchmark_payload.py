@@ -0,0 +1,98 @@
+import time
+from contextlib import ExitStack
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client
+from django.urls import reverse
+from django.utils.text import compress_string
+
+from notes import middleware, sharding
+from notes.models import Note
+from notes.views import NoteListView
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Размер списка заметок (HTML, gzip, brotli) и время CPU сервера '
+            'на 1-ю и 2-ю страницы из 10/50/100 карточек и на страницы поиска. '
+            'Данные создаются во временной транзакции')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cards', type=int, nargs='+', default=[10, 50, 100],
+                            help='Число карточек на странице')
+        parser.add_argument('--repeat', type=int, default=20, help='Повторов на замер')
+
+    def measure(self, client, url, params, repeat):
+        client.get(url, params)  # первый запрос прогревает шаблоны
+        start = time.process_time()
+        for _ in range(repeat):
+            response = client.get(url, params)
+        render = (time.process_time() - start) / repeat
+        if response.status_code != 200:
+            raise CommandError(f'{url} ответил {response.status_code}')
+        html = response.content
+
+        start = time.process_time()
+        for _ in range(repeat):
+            gzipped = compress_string(html, max_random_bytes=middleware.GZIP_RANDOM_BYTES)
+        gzip_time = (time.process_time() - start) / repeat
+
+        row = {'html': len(html), 'gzip': len(gzipped), 'render': render, 'gzip_time': gzip_time}
+        if middleware.HAS_BROTLI:
+            start = time.process_time()
+            for _ in range(repeat):
+                compressed = middleware.brotli.compress(html, quality=middleware.BROTLI_QUALITY)
+            row['br'] = len(compressed)
+            row['br_time'] = (time.process_time() - start) / repeat
+        return row
+
+    def handle(self, *args, **options):
+        cards = sorted(options['cards'])
+        rows = {}
+        paginate_by = NoteListView.paginate_by
+        try:
+            with ExitStack() as stack:
+                for alias in sharding.databases():
+                    stack.enter_context(transaction.atomic(using=alias))
+                user = User.objects.create_user(username='payload-benchmark')
+                with sharding.for_user(user.pk):
+                    Note.objects.bulk_create([
+                        Note(
+                            title=f'Заметка {i}',
+                            content=f'Текст заметки {i} для проверки размера страницы. ' * 5,
+                            author=user,
+                        )
+                        for i in range(cards[-1] * 2)  # хватит на вторую страницу
+                    ])
+                client = Client(HTTP_HOST='localhost')
+                client.force_login(user)
+                repeat = options['repeat']
+                for count in cards:
+                    NoteListView.paginate_by = count
+                    for page in (1, 2):
+                        label = f'{count:>4} карточек' + (f', стр. {page}' if page > 1 else '')
+                        rows[label] = self.measure(client, reverse('note_list'), {'page': page}, repeat)
+                for page in (1, 2):
+                    rows[f'поиск, стр. {page}'] = self.measure(
+                        client, reverse('note_search'), {'q': 'Заметка', 'page': page}, repeat
+                    )
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            NoteListView.paginate_by = paginate_by
+
+        if not middleware.HAS_BROTLI:
+            self.stdout.write('brotli не установлен — только gzip')
+        for label, row in rows.items():
+            line = (f'{label}: HTML {row["html"] / 1024:.1f} КБ, '
+                    f'gzip {row["gzip"] / 1024:.1f} КБ ({row["gzip_time"] * 1000:.2f} мс)')
+            if 'br' in row:
+                line += f', brotli {row["br"] / 1024:.1f} КБ ({row["br_time"] * 1000:.2f} мс)'
+            line += f'; CPU на страницу {row["render"] * 1000:.1f} мс'
+            self.stdout.write(line)
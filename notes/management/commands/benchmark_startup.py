@@ -0,0 +1,83 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Выполняется в новом интерпретаторе: холодный старт, как у нового воркера
+SCRIPT = '''
+import json, sys, time
+
+start = time.perf_counter()
+from config.wsgi import application
+loaded = time.perf_counter() - start
+
+from django.test import RequestFactory
+
+
+def request(path):
+    environ = RequestFactory(HTTP_HOST='localhost').get(path).environ
+    statuses = []
+    start = time.perf_counter()
+    b''.join(application(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+    return time.perf_counter() - start, statuses[0]
+
+
+first, status = request(sys.argv[1])
+second, _ = request(sys.argv[1])
+print(json.dumps({'load': loaded, 'first': first, 'second': second, 'status': status}))
+'''
+
+METRICS = (
+    ('load', 'загрузка приложения'),
+    ('first', 'первый запрос'),
+    ('second', 'второй запрос'),
+    ('total', 'до первого ответа'),
+)
+
+
+class Command(BaseCommand):
+    help = ('Измеряет время загрузки WSGI-приложения и первого ответа '
+            'в новом процессе, без прогрева и с прогревом (NOTES_WARMUP)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/login/', help='Запрашиваемый адрес')
+        parser.add_argument('--runs', type=int, default=5, help='Число запусков (берется медиана)')
+        parser.add_argument('--imports', type=int, default=0, metavar='N',
+                            help='Показать N самых долгих импортов (python -X importtime)')
+
+    def run_once(self, path, warmup, importtime=False):
+        env = dict(os.environ, NOTES_WARMUP='1' if warmup else '0')
+        command = [sys.executable, *(['-X', 'importtime'] if importtime else []), '-c', SCRIPT, path]
+        result = subprocess.run(
+            command, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise CommandError(result.stderr.strip().splitlines()[-1] if result.stderr else 'ошибка')
+        data = json.loads(result.stdout.strip().splitlines()[-1])
+        data['total'] = data['load'] + data['first']
+        return data, result.stderr
+
+    def handle(self, *args, **options):
+        for warmup in (False, True):
+            runs = [self.run_once(options['path'], warmup)[0] for _ in range(options['runs'])]
+            self.stdout.write(f'{"С прогревом" if warmup else "Без прогрева"} '
+                              f'({options["path"]}, ответ {runs[0]["status"]}):')
+            for key, label in METRICS:
+                median = statistics.median(run[key] for run in runs)
+                self.stdout.write(f'  {label}: {median * 1000:.1f} мс')
+
+        if options['imports']:
+            _, log = self.run_once(options['path'], warmup=False, importtime=True)
+            # Строки вида "import time: self [us] | cumulative | module"
+            rows = []
+            for line in log.splitlines():
+                parts = line.removeprefix('import time:').split('|')
+                if len(parts) == 3 and parts[1].strip().isdigit():
+                    rows.append((int(parts[1]), parts[2].strip()))
+            self.stdout.write('Самые долгие импорты (с вложенными):')
+            for cumulative, module in sorted(rows, reverse=True)[:options['imports']]:
+                self.stdout.write(f'  {cumulative / 1000:8.1f} мс  {module}')
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from notes import fingerprints, sharding
+from notes.models import Note, NoteFingerprint
+
+
+class Command(BaseCommand):
+    help = 'Создает SimHash-отпечатки для заметок, у которых их еще нет'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='id пользователя (по умолчанию все)')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Пересчитать отпечатки заново')
+        parser.add_argument('--batch-size', type=int, default=fingerprints.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        created = 0
+        for alias in sharding.databases():
+            with sharding.use_db(alias):
+                notes = Note.objects.all()
+                if options['user']:
+                    notes = notes.filter(author_id=options['user'])
+                if options['rebuild']:
+                    NoteFingerprint.objects.filter(note__in=notes).delete()
+                created += fingerprints.backfill(notes, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Создано отпечатков: {created}'))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from notes import attachments
+from notes.models import Blob
+
+
+class Command(BaseCommand):
+    help = 'Удаляет файлы вложений, на которые не ссылается ни одна заметка'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--thumbnails', action='store_true',
+                            help='Также создать недостающие миниатюры (нужен Pillow)')
+
+    def handle(self, *args, **options):
+        removed = attachments.collect_garbage()
+        self.stdout.write(self.style.SUCCESS(f'Удалено файлов: {removed}'))
+
+        if options['thumbnails']:
+            if not attachments.HAS_PILLOW:
+                self.stderr.write('Pillow не установлен, миниатюры не создаются')
+                return
+            missing = Blob.objects.filter(
+                content_type__startswith='image/', has_thumbnail=False
+            ).values_list('sha256', flat=True)
+            created = 0
+            for sha256 in missing.iterator():
+                attachments.generate_thumbnail(sha256)
+                created += 1
+            self.stdout.write(self.style.SUCCESS(f'Создано миниатюр: {created}'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from notes import sharding, trigrams
+from notes.models import Note
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает триграммный индекс заголовков и тегов для нечеткого поиска'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='id пользователя (по умолчанию все)')
+        parser.add_argument('--batch-size', type=int, default=trigrams.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        indexed = 0
+        for alias in sharding.databases():
+            with sharding.use_db(alias):
+                notes = Note.objects.all()
+                if options['user']:
+                    notes = notes.filter(author_id=options['user'])
+                indexed += trigrams.backfill(notes, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано заметок: {indexed}'))
@@ -0,0 +1,55 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from notes import jobs, purge
+from notes.models import Job
+
+
+class Command(BaseCommand):
+    help = ('Удаляет аккаунты пачками (возобновляя прерванные удаления) '
+            'и данные с истекшим сроком хранения')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', default=[],
+                            help='id пользователя, аккаунт которого нужно удалить '
+                                 '(можно указать несколько раз)')
+        parser.add_argument('--retention', action='store_true',
+                            help='Также удалить старые завершенные задачи и, если задан срок, '
+                                 'архивные заметки')
+        parser.add_argument('--archive-days', type=int, default=None,
+                            help='Срок хранения архива в днях '
+                                 '(по умолчанию NOTES_ARCHIVE_RETENTION_DAYS)')
+
+    def handle(self, *args, **options):
+        users = list(User.objects.filter(pk__in=options['user']))
+        missing = set(options['user']) - {user.pk for user in users}
+        if missing:
+            raise CommandError(f'Нет пользователей: {", ".join(map(str, sorted(missing)))}')
+        for user in users:
+            purge.schedule_account_deletion(user)
+
+        resumed = purge.resume_account_deletions()
+        if resumed:
+            self.stdout.write(f'Возобновлено удалений: {resumed}')
+
+        # Удаления выполняются здесь же, через очередь: прогресс виден на странице задачи
+        worker = jobs.worker_name('purge')
+        deleted = 0
+        while True:
+            job = jobs.claim(worker, kinds=['delete_account'])
+            if job is None:
+                break
+            job = jobs.run(job)
+            if job.status == Job.STATUS_DONE:
+                deleted += 1
+            else:
+                error = job.error.strip().splitlines()[-1] if job.error else ''
+                self.stderr.write(f'Не удалось удалить аккаунт {job.payload.get("user_id")}: {error}')
+        self.stdout.write(self.style.SUCCESS(f'Удалено аккаунтов: {deleted}'))
+
+        if options['retention']:
+            removed = purge.purge_expired(archive_days=options['archive_days'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Удалено архивных заметок: {removed["archived_notes"]}, '
+                f'задач: {removed["jobs"]}, корзин лимитов попыток: {removed["rate_limits"]}'
+            ))
@@ -0,0 +1,52 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from notes import sharding
+from notes.versions import cache_is_shared
+
+
+class Command(BaseCommand):
+    help = 'Переносит заметки пользователей между шардами без остановки сервиса'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='id пользователя (по умолчанию все)')
+        parser.add_argument('--to', help='База назначения (по умолчанию шард по хешу id)')
+        parser.add_argument('--batch-size', type=int, default=sharding.BATCH_SIZE)
+        parser.add_argument('--grace', type=float, default=sharding.MOVE_GRACE,
+                            help='Секунд ожидания после запрета изменений')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать, кого нужно перенести')
+
+    def handle(self, *args, **options):
+        if not sharding.is_enabled():
+            raise CommandError('Шардирование выключено (NOTES_SHARDS=0)')
+        if not cache_is_shared():
+            # Воркеры берут шард пользователя из своего кэша и не узнали бы
+            # о заморозке записи: изменения попали бы в старую базу и пропали
+            raise CommandError('Перенос требует общего кэша: задайте NOTES_CACHE_LOCATION')
+        target = options['to']
+        if target and target not in sharding.databases():
+            raise CommandError(f'Неизвестная база: {target}')
+        if target and not options['user']:
+            raise CommandError('--to можно указать только вместе с --user')
+
+        users = User.objects.order_by('pk').values_list('pk', flat=True)
+        if options['user']:
+            users = users.filter(pk=options['user'])
+
+        moved = 0
+        for user_id in users.iterator():
+            destination = target or sharding.hash_shard(user_id)
+            source, moving_to = sharding.placement(user_id)
+            if source == destination and not moving_to:
+                continue
+            self.stdout.write(f'Пользователь {user_id}: {source} → {destination}')
+            if options['dry_run']:
+                continue
+            count = sharding.move_user(
+                user_id, destination,
+                batch_size=options['batch_size'], grace=options['grace'],
+            )
+            self.stdout.write(f'  перенесено записей: {count}')
+            moved += 1
+        self.stdout.write(self.style.SUCCESS(f'Перенесено пользователей: {moved}'))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from notes import markup, sharding
+from notes.models import Note
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает HTML заметок, отрендеренный старой версией рендерера'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='id пользователя (по умолчанию все)')
+        parser.add_argument('--force', action='store_true',
+                            help='Рендерить заново все заметки')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        rendered = 0
+        for alias in sharding.databases():
+            with sharding.use_db(alias):
+                rendered += self.rerender(options)
+        self.stdout.write(self.style.SUCCESS(f'Отрендерено заметок: {rendered}'))
+
+    def rerender(self, options):
+        notes = Note.objects.order_by('pk').only('pk', 'content', 'content_hash')
+        if options['user']:
+            notes = notes.filter(author_id=options['user'])
+
+        rendered = 0
+        batch = []
+        for note in notes.iterator(chunk_size=options['batch_size']):
+            if options['force']:
+                note.content_hash = ''
+            if markup.prepare(note):
+                batch.append(note)
+            if len(batch) >= options['batch_size']:
+                Note.objects.bulk_update(batch, ['content_html', 'content_hash'])
+                rendered += len(batch)
+                batch = []
+        if batch:
+            Note.objects.bulk_update(batch, ['content_html', 'content_hash'])
+            rendered += len(batch)
+        return rendered
@@ -0,0 +1,78 @@
+import multiprocessing
+import signal
+
+from django.core.management.base import BaseCommand
+
+from notes import jobs
+
+
+def _process_main(index, threads, poll_interval, once):
+    """Точка входа дочернего процесса (контекст spawn: настраиваем Django заново)"""
+    import django
+    django.setup()
+
+    from notes import jobs as process_jobs
+    workers, stop_event = process_jobs.start_threads(threads, poll_interval, once)
+    signal.signal(signal.SIGTERM, lambda *args: stop_event.set())
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        stop_event.set()
+
+
+class Command(BaseCommand):
+    help = 'Запускает воркеры очереди фоновых задач'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=2,
+                            help='Потоков-воркеров в каждом процессе')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Число процессов (больше 1 — для задач, нагружающих CPU)')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Пауза между опросами пустой очереди, сек')
+        parser.add_argument('--once', action='store_true',
+                            help='Выполнить задачи из очереди и завершиться')
+        parser.add_argument('--stale-timeout', type=int, default=None,
+                            help='Через сколько секунд без пульса вернуть задачу в очередь '
+                                 '(по умолчанию NOTES_JOBS_STALE_TIMEOUT)')
+
+    def handle(self, *args, **options):
+        # Дальше воркеры проверяют зависшие задачи сами, с NOTES_JOBS_STALE_TIMEOUT
+        requeued, failed = jobs.requeue_stale(options['stale_timeout'])
+        if requeued or failed:
+            self.stdout.write(f'Зависших задач: возвращено в очередь {requeued}, '
+                              f'завершено с ошибкой {failed}')
+
+        threads = max(1, options['threads'])
+        processes = max(1, options['processes'])
+        self.stdout.write(f'Воркеры: процессов {processes}, потоков в каждом {threads}')
+
+        if processes == 1:
+            workers, stop_event = jobs.start_threads(
+                threads, options['poll_interval'], options['once']
+            )
+            try:
+                for worker in workers:
+                    worker.join()
+            except KeyboardInterrupt:
+                stop_event.set()
+            return
+
+        context = multiprocessing.get_context('spawn')
+        children = [
+            context.Process(
+                target=_process_main,
+                args=(i, threads, options['poll_interval'], options['once']),
+                name=f'notes-jobs-process-{i}',
+            )
+            for i in range(processes)
+        ]
+        for child in children:
+            child.start()
+        try:
+            for child in children:
+                child.join()
+        except KeyboardInterrupt:
+            for child in children:
+                child.terminate()
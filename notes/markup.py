@@ -0,0 +1,88 @@
+"""
+Markdown в заметках.
+HTML рендерится один раз и хранится в Note.content_html вместе с хешем
+исходного текста: при сохранении (сигнал pre_save) или при первом
+просмотре, если заметка создана в обход save (импорт). Повторные
+просмотры отдают готовый HTML. Хеш включает RENDERER_VERSION — после
+изменения рендерера достаточно увеличить версию и выполнить
+`python manage.py rerender_notes`.
+
+Безопасность: сырой HTML в тексте не интерпретируется (Markdown
+экранирует его как текст), а результат дополнительно чистится nh3.
+"""
+
+import hashlib
+import threading
+
+import markdown
+import nh3
+
+RENDERER_VERSION = 1
+
+EXTENSIONS = ['fenced_code', 'tables', 'sane_lists', 'nl2br']
+
+ALLOWED_TAGS = {
+    'p', 'br', 'hr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'strong', 'em', 'del', 'code', 'pre', 'blockquote',
+    'ul', 'ol', 'li', 'a', 'img',
+    'table', 'thead', 'tbody', 'tr', 'th', 'td',
+}
+ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'title'},
+    'img': {'src', 'alt', 'title'},
+    'th': {'align'},
+    'td': {'align'},
+}
+URL_SCHEMES = {'http', 'https', 'mailto'}
+
+_local = threading.local()
+
+
+def _markdown():
+    # Экземпляр Markdown не потокобезопасен — у каждого потока свой
+    md = getattr(_local, 'md', None)
+    if md is None:
+        md = markdown.Markdown(extensions=EXTENSIONS, output_format='html')
+        # Без обработки сырого HTML: теги в тексте выводятся как текст
+        md.preprocessors.deregister('html_block')
+        md.inlinePatterns.deregister('html')
+        _local.md = md
+    return md.reset()
+
+
+def content_hash(text):
+    data = f'{RENDERER_VERSION}\n{text}'.encode('utf-8')
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def render(text):
+    """Markdown -> безопасный HTML"""
+    html = _markdown().convert(text)
+    return nh3.clean(
+        html,
+        tags=ALLOWED_TAGS,
+        attributes=ALLOWED_ATTRIBUTES,
+        url_schemes=URL_SCHEMES,
+        link_rel='noopener noreferrer nofollow',
+    )
+
+
+def prepare(note):
+    """Рендерит HTML заметки, если текст изменился. Возвращает True, если рендерил."""
+    digest = content_hash(note.content)
+    if note.content_hash == digest:
+        return False
+    note.content_html = render(note.content)
+    note.content_hash = digest
+    return True
+
+
+def rendered_html(note):
+    """HTML заметки для просмотра; при отсутствии рендерит и сохраняет"""
+    from .models import Note
+
+    if prepare(note):
+        Note.objects.filter(pk=note.pk).update(
+            content_html=note.content_html, content_hash=note.content_hash
+        )
+    return note.content_html
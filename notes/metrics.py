@@ -0,0 +1,363 @@
+"""
+Метрики приложения в формате Prometheus (/metrics).
+Счетчики и гистограммы живут в памяти процесса: запись — прибавление под
+блокировкой, без обращений к диску или сети. Если задан NOTES_METRICS_DIR,
+каждый процесс (воркеры gunicorn, run_jobs) раз в FLUSH_INTERVAL секунд
+сохраняет свой срез в файл metrics_<pid>_<время запуска>.json, а /metrics
+складывает срезы всех процессов. Срезы завершившихся процессов
+вливаются в archive.json (при выходе процесса и из хука child_exit
+gunicorn), поэтому суммы не убывают и файлы не копятся.
+Показатели, которые дешевле посчитать при опросе (глубина очереди),
+задаются функцией и вычисляются только в процессе, отвечающем на /metrics.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: без блокировки, один процесс
+    fcntl = None
+
+FLUSH_INTERVAL = 5  # секунд между сохранениями среза процесса
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_lock = threading.Lock()
+_registry = {}  # имя -> метрика
+_last_flush = 0.0
+ARCHIVE_FILE = 'archive.json'
+LOCK_FILE = 'archive.lock'
+
+
+def _process_file():
+    # Время запуска отличает процесс от прежнего с тем же pid
+    return f'metrics_{os.getpid()}_{int(time.time() * 1000)}.json'
+
+
+_file_name = _process_file()
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = defaultdict(float)
+        _registry[name] = self
+
+    def inc(self, *labels, amount=1):
+        with _lock:
+            self.values[labels] += amount
+
+    def snapshot(self):
+        return [[list(labels), value] for labels, value in self.values.items()]
+
+    @staticmethod
+    def merge(total, sample):
+        return (total or 0) + sample
+
+    def samples(self, labels, value):
+        yield self.name, labels, value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [число в каждой корзине..., сумма, количество]
+        self.values = {}
+        _registry[name] = self
+
+    def observe(self, value, *labels):
+        with _lock:
+            data = self.values.get(labels)
+            if data is None:
+                data = self.values[labels] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[index] += 1
+                    break
+            data[-2] += value
+            data[-1] += 1
+
+    def snapshot(self):
+        return [[list(labels), list(data)] for labels, data in self.values.items()]
+
+    @staticmethod
+    def merge(total, sample):
+        return list(sample) if total is None else [a + b for a, b in zip(total, sample)]
+
+    def samples(self, labels, data):
+        cumulative = 0
+        for bound, count in zip(self.buckets, data):
+            cumulative += count
+            yield f'{self.name}_bucket', labels + (('le', _format_value(bound)),), cumulative
+        yield f'{self.name}_bucket', labels + (('le', '+Inf'),), data[-1]
+        yield f'{self.name}_sum', labels, data[-2]
+        yield f'{self.name}_count', labels, data[-1]
+
+
+class Gauge:
+    """Значение, вычисляемое функцией при опросе: {метки: значение}"""
+    type = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        _registry[name] = self
+
+    def samples(self, labels, value):
+        yield self.name, labels, value
+
+
+def counter(name, help, labelnames=()):
+    return _registry.get(name) or Counter(name, help, labelnames)
+
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _registry.get(name) or Histogram(name, help, labelnames, buckets)
+
+
+def gauge(name, help, labelnames=(), collect=None):
+    return _registry.get(name) or Gauge(name, help, labelnames, collect)
+
+
+class timer:
+    """with metrics.timer(HISTOGRAM, метки...): — время блока в гистограмму"""
+
+    def __init__(self, metric, *labels):
+        self.metric = metric
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metric.observe(time.perf_counter() - self.start, *self.labels)
+
+
+# ============= МНОГОПРОЦЕССНЫЙ РЕЖИМ =============
+
+def metrics_dir():
+    path = getattr(settings, 'NOTES_METRICS_DIR', '')
+    return Path(path) if path else None
+
+
+def snapshot():
+    """Срез метрик процесса (без вычисляемых)"""
+    with _lock:
+        return {
+            name: metric.snapshot()
+            for name, metric in _registry.items() if metric.type != 'gauge'
+        }
+
+
+@contextmanager
+def _locked(directory, exclusive=False):
+    """Блокировка каталога: архивирование не пересекается с чтением срезов"""
+    if fcntl is None:
+        yield
+        return
+    with open(directory / LOCK_FILE, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _write_json(path, data):
+    partial = path.with_suffix('.part')
+    partial.write_text(json.dumps(data))
+    os.replace(partial, path)
+
+
+def flush():
+    """Сохраняет срез процесса в NOTES_METRICS_DIR"""
+    global _last_flush
+    directory = metrics_dir()
+    if directory is None:
+        return
+    directory.mkdir(parents=True, exist_ok=True)
+    _write_json(directory / _file_name, snapshot())
+    _last_flush = time.monotonic()
+
+
+def maybe_flush():
+    """flush не чаще раза в FLUSH_INTERVAL секунд"""
+    if metrics_dir() is not None and time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+        flush()
+
+
+def _add(total, sample):
+    """Сумма значений счетчика (число) или гистограммы (список)"""
+    if total is None:
+        return sample
+    if isinstance(sample, list):
+        return [a + b for a, b in zip(total, sample)]
+    return total + sample
+
+
+def _read(path):
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None  # файл процесса заменяется прямо сейчас
+
+
+def archive_process(pid):
+    """Вливает срезы завершившегося процесса pid в archive.json и удаляет их"""
+    directory = metrics_dir()
+    if directory is None or not directory.exists():
+        return 0
+    with _locked(directory, exclusive=True):
+        paths = list(directory.glob(f'metrics_{pid}_*.json'))
+        if not paths:
+            return 0
+        archive = directory / ARCHIVE_FILE
+        totals = defaultdict(dict)
+        for data in filter(None, [_read(archive), *map(_read, paths)]):
+            for name, samples in data.items():
+                for labels, value in samples:
+                    key = tuple(labels)
+                    totals[name][key] = _add(totals[name].get(key), value)
+        _write_json(archive, {
+            name: [[list(key), value] for key, value in values.items()]
+            for name, values in totals.items()
+        })
+        for path in paths:
+            path.unlink()
+    return len(paths)
+
+
+def _exit():
+    if metrics_dir() is not None:
+        flush()
+        archive_process(os.getpid())
+
+
+def _after_fork():
+    """Дочерний процесс (воркер gunicorn) считает с нуля в своем файле"""
+    global _lock, _last_flush, _file_name
+    _lock = threading.Lock()
+    for metric in _registry.values():
+        if metric.type != 'gauge':
+            metric.values.clear()
+    _last_flush = 0.0
+    _file_name = _process_file()
+
+
+atexit.register(_exit)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def _load_snapshots():
+    directory = metrics_dir()
+    if directory is None:
+        return [snapshot()]
+    flush()  # свой срез — самый свежий
+    with _locked(directory):
+        paths = [directory / ARCHIVE_FILE, *directory.glob('metrics_*.json')]
+        return list(filter(None, map(_read, paths)))
+
+
+# ============= ВЫВОД =============
+
+def _format_value(value):
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else repr(value)
+    return str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus"""
+    totals = defaultdict(dict)  # имя -> {метки: значение}
+    for data in _load_snapshots():
+        for name, samples in data.items():
+            metric = _registry.get(name)
+            if metric is None:
+                continue
+            for labels, value in samples:
+                key = tuple(labels)
+                totals[name][key] = metric.merge(totals[name].get(key), value)
+
+    lines = []
+    for name, metric in sorted(_registry.items()):
+        values = metric.collect() if metric.type == 'gauge' else totals.get(name, {})
+        lines.append(f'# HELP {name} {metric.help}')
+        lines.append(f'# TYPE {name} {metric.type}')
+        for key, value in sorted(values.items()):
+            labels = tuple(zip(metric.labelnames, key))
+            for sample, sample_labels, sample_value in metric.samples(labels, value):
+                lines.append(f'{sample}{_format_labels(sample_labels)} {_format_value(sample_value)}')
+    return '\n'.join(lines) + '\n'
+
+
+# ============= МЕТРИКИ ПРИЛОЖЕНИЯ =============
+
+def _queue_depth():
+    from django.db.models import Count
+
+    from .models import Job
+
+    rows = (
+        Job.objects.filter(status__in=[Job.STATUS_PENDING, Job.STATUS_RUNNING])
+        .values_list('status').annotate(count=Count('pk')).order_by()
+    )
+    depth = {(Job.STATUS_PENDING,): 0, (Job.STATUS_RUNNING,): 0}
+    depth.update({(status,): count for status, count in rows})
+    return depth
+
+
+REQUEST_DURATION = histogram(
+    'notes_http_request_duration_seconds', 'Время обработки запроса', ('view', 'method')
+)
+REQUESTS = counter(
+    'notes_http_requests_total', 'Запросы по представлениям и кодам ответа',
+    ('view', 'method', 'status'),
+)
+DB_QUERIES = counter('notes_db_queries_total', 'Запросы к БД', ('view',))
+DB_DURATION = counter('notes_db_query_seconds_total', 'Время запросов к БД', ('view',))
+CACHE_REQUESTS = counter(
+    'notes_cache_requests_total', 'Обращения к кэшам приложения', ('cache', 'result')
+)
+SEARCH_DURATION = histogram('notes_search_duration_seconds', 'Время поиска', ('kind',))
+NOTE_CHANGES = counter('notes_note_changes_total', 'Созданные, измененные и удаленные заметки', ('action',))
+JOBS = counter('notes_jobs_total', 'Выполненные фоновые задачи', ('kind', 'status'))
+JOB_DURATION = histogram(
+    'notes_job_duration_seconds', 'Время выполнения фоновой задачи', ('kind',),
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900),
+)
+QUEUE_DEPTH = gauge('notes_job_queue_depth', 'Задачи в очереди', ('status',), collect=_queue_depth)
+
+
+def cache_access(name, hit):
+    CACHE_REQUESTS.inc(name, 'hit' if hit else 'miss')
@@ -0,0 +1,139 @@
+"""
+Middleware приложения notes.
+"""
+
+import re
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+from . import metrics, sharding
+
+try:
+    import brotli
+    HAS_BROTLI = True
+except ImportError:  # сжатие только gzip
+    brotli = None
+    HAS_BROTLI = False
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+COMPRESS_MIN_SIZE = 1024  # байт: меньшие ответы сжатие почти не уменьшает
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+BROTLI_QUALITY = 5  # баланс размера и CPU для динамических страниц
+GZIP_RANDOM_BYTES = 100  # случайная длина заголовка gzip (как в GZipMiddleware)
+
+
+class ShardMiddleware:
+    """Направляет запросы к заметкам в базу шарда текущего пользователя.
+    Должен стоять после AuthenticationMiddleware."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        user = getattr(request, 'user', None)
+        if not sharding.is_enabled() or user is None or not user.is_authenticated:
+            return self.get_response(request)
+
+        alias, moving_to = sharding.placement(user.pk)
+        if moving_to and request.method not in SAFE_METHODS:
+            return HttpResponse(
+                'Заметки переносятся на другой сервер, повторите через минуту.',
+                status=503,
+                headers={'Retry-After': '30'},
+            )
+        with sharding.use_db(alias):
+            return self.get_response(request)
+
+
+class MetricsMiddleware:
+    """Время обработки, коды ответов и запросы к БД по представлениям.
+    Должен стоять первым, чтобы учитывать остальные middleware."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._local = threading.local()
+
+    def _count_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            stats = self._local.stats
+            stats[0] += 1
+            stats[1] += time.perf_counter() - start
+
+    def __call__(self, request):
+        self._local.stats = stats = [0, 0.0]
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self._count_query))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        metrics.REQUEST_DURATION.observe(duration, view, request.method)
+        metrics.REQUESTS.inc(view, request.method, str(response.status_code))
+        metrics.DB_QUERIES.inc(view, amount=stats[0])
+        metrics.DB_DURATION.inc(view, amount=stats[1])
+        metrics.maybe_flush()
+        return response
+
+
+class CompressionMiddleware:
+    """Сжатие ответов brotli (если установлен) или gzip.
+    Не сжимаются потоковые ответы (SSE, файлы), короткие и несжимаемые.
+    BREACH: CSRF-токен Django маскирует заново в каждом ответе, так что
+    страницы с формой и с отраженным вводом (поиск, ?page=2) сжимаются.
+    Представление, которое выводит рядом с вводом немаскированный секрет,
+    отключает сжатие заголовком Cache-Control: no-transform.
+    Должен стоять выше middleware, меняющих тело ответа."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    @staticmethod
+    def _accepts(request, coding):
+        return re.search(rf'\b{coding}\b', request.META.get('HTTP_ACCEPT_ENCODING', '')) is not None
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        min_size = getattr(settings, 'NOTES_COMPRESS_MIN_SIZE', COMPRESS_MIN_SIZE)
+        if (
+            response.streaming
+            or response.has_header('Content-Encoding')
+            or len(response.content) < min_size
+            or not response.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES)
+            or 'no-transform' in response.get('Cache-Control', '')
+        ):
+            return response
+
+        if HAS_BROTLI and self._accepts(request, 'br'):
+            encoding = 'br'
+            compressed = brotli.compress(response.content, quality=BROTLI_QUALITY)
+        elif self._accepts(request, 'gzip'):
+            encoding = 'gzip'
+            compressed = compress_string(response.content, max_random_bytes=GZIP_RANDOM_BYTES)
+        else:
+            return response
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+        response.headers['Content-Encoding'] = encoding
+        # Сжатое тело отличается от исходного байт в байт
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        return response
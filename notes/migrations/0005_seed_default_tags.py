@@ -7,13 +7,14 @@ DEFAULT_TAGS = ["учеба", "работа", "продукты"]
 
 def seed_tags(apps, schema_editor):
     Tag = apps.get_model("notes", "Tag")
+    db_alias = schema_editor.connection.alias
     for name in DEFAULT_TAGS:
-        Tag.objects.get_or_create(name=name)
+        Tag.objects.using(db_alias).get_or_create(name=name)
 
 
 def unseed_tags(apps, schema_editor):
     Tag = apps.get_model("notes", "Tag")
-    Tag.objects.filter(name__in=DEFAULT_TAGS).delete()
+    Tag.objects.using(schema_editor.connection.alias).filter(name__in=DEFAULT_TAGS).delete()
 
 
 class Migration(migrations.Migration):
@@ -0,0 +1,48 @@
+# Generated by Django 4.2 on 2026-10-19 14:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notes', '0005_seed_default_tags'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoteFingerprint',
+            fields=[
+                ('note', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='fingerprint', serialize=False, to='notes.note', verbose_name='Заметка')),
+                ('simhash', models.BigIntegerField(verbose_name='SimHash')),
+                ('band_0', models.IntegerField()),
+                ('band_1', models.IntegerField()),
+                ('band_2', models.IntegerField()),
+                ('band_3', models.IntegerField()),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+            ],
+            options={
+                'verbose_name': 'Отпечаток заметки',
+                'verbose_name_plural': 'Отпечатки заметок',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='notefingerprint',
+            index=models.Index(fields=['author', 'band_0'], name='notes_fp_band0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notefingerprint',
+            index=models.Index(fields=['author', 'band_1'], name='notes_fp_band1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notefingerprint',
+            index=models.Index(fields=['author', 'band_2'], name='notes_fp_band2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notefingerprint',
+            index=models.Index(fields=['author', 'band_3'], name='notes_fp_band3_idx'),
+        ),
+    ]
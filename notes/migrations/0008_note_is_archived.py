@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-19 14:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0007_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='is_archived',
+            field=models.BooleanField(db_index=True, default=False, verbose_name='В архиве'),
+        ),
+    ]
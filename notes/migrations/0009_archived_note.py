@@ -0,0 +1,70 @@
+# Generated by Django 4.2 on 2026-10-19 15:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import zlib
+
+
+def move_archived_notes(apps, schema_editor):
+    """Заметки с флагом is_archived переезжают в таблицу архива"""
+    Note = apps.get_model('notes', 'Note')
+    ArchivedNote = apps.get_model('notes', 'ArchivedNote')
+    db_alias = schema_editor.connection.alias
+    archived = Note.objects.using(db_alias).filter(is_archived=True).prefetch_related('tags')
+    ArchivedNote.objects.using(db_alias).bulk_create([
+        ArchivedNote(
+            id=note.pk,
+            author_id=note.author_id,
+            title=note.title,
+            content_compressed=zlib.compress(note.content.encode('utf-8'), 9),
+            tag_names=[tag.name for tag in note.tags.all()],
+            created_at=note.created_at,
+            updated_at=note.updated_at,
+        )
+        for note in archived
+    ])
+    archived.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notes', '0008_note_is_archived'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='last_viewed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Последний просмотр'),
+        ),
+        migrations.CreateModel(
+            name='ArchivedNote',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('title', models.CharField(max_length=200, verbose_name='Заголовок')),
+                ('content_compressed', models.BinaryField(verbose_name='Содержание (zlib)')),
+                ('tag_names', models.JSONField(blank=True, default=list, verbose_name='Теги')),
+                ('created_at', models.DateTimeField(verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(verbose_name='Дата обновления')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата архивации')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_notes', to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+            ],
+            options={
+                'verbose_name': 'Архивная заметка',
+                'verbose_name_plural': 'Архивные заметки',
+                'ordering': ['-archived_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivednote',
+            index=models.Index(fields=['author', '-archived_at'], name='notes_archive_author_idx'),
+        ),
+        migrations.RunPython(move_archived_notes, reverse_code=migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='note',
+            name='is_archived',
+        ),
+    ]
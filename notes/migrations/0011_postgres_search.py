@@ -0,0 +1,54 @@
+"""
+Индексы поиска для PostgreSQL. На других СУБД миграция ничего не делает.
+Выражение GIN-индекса должно совпадать с search.search_vector(),
+иначе планировщик его не использует.
+"""
+
+from django.db import migrations
+
+CREATE_SQL = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    """
+    CREATE INDEX IF NOT EXISTS notes_note_search_idx ON notes_note USING gin ((
+        setweight(to_tsvector('russian'::regconfig, COALESCE(title, '')), 'A') ||
+        setweight(to_tsvector('russian'::regconfig, COALESCE(content, '')), 'B')
+    ))
+    """,
+    # Нечеткое совпадение заголовка (операторы %, %>) и title__icontains
+    'CREATE INDEX IF NOT EXISTS notes_note_title_trgm_idx ON notes_note '
+    'USING gin (title gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS notes_note_title_upper_trgm_idx ON notes_note '
+    'USING gin ((UPPER(title::text)) gin_trgm_ops)',
+]
+
+DROP_SQL = [
+    'DROP INDEX IF EXISTS notes_note_title_upper_trgm_idx',
+    'DROP INDEX IF EXISTS notes_note_title_trgm_idx',
+    'DROP INDEX IF EXISTS notes_note_search_idx',
+]
+
+
+def _execute(schema_editor, statements):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+def create_indexes(apps, schema_editor):
+    _execute(schema_editor, CREATE_SQL)
+
+
+def drop_indexes(apps, schema_editor):
+    _execute(schema_editor, DROP_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0010_shards'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, reverse_code=drop_indexes, hints={'model_name': 'note'}),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2 on 2026-10-19 15:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from notes.text import trigrams
+
+
+def index_notes(apps, schema_editor):
+    """Триграммы для уже существующих заметок"""
+    Note = apps.get_model('notes', 'Note')
+    TrigramPosting = apps.get_model('notes', 'TrigramPosting')
+    db_alias = schema_editor.connection.alias
+    postings = []
+    for note in Note.objects.using(db_alias).prefetch_related('tags').iterator(chunk_size=500):
+        grams = trigrams(' '.join([note.title, *(tag.name for tag in note.tags.all())]))
+        postings.extend(
+            TrigramPosting(note_id=note.pk, author_id=note.author_id, trigram=gram, size=len(grams))
+            for gram in grams
+        )
+        if len(postings) >= 5000:
+            TrigramPosting.objects.using(db_alias).bulk_create(postings, batch_size=500)
+            postings = []
+    TrigramPosting.objects.using(db_alias).bulk_create(postings, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notes', '0011_postgres_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrigramPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3, verbose_name='Триграмма')),
+                ('size', models.PositiveSmallIntegerField(verbose_name='Триграмм у заметки')),
+                ('author', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+                ('note', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='notes.note', verbose_name='Заметка')),
+            ],
+            options={
+                'verbose_name': 'Триграмма',
+                'verbose_name_plural': 'Триграммы',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='trigramposting',
+            index=models.Index(fields=['author', 'trigram', 'note', 'size'], name='notes_trigram_lookup_idx'),
+        ),
+        migrations.RunPython(index_notes, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-19 15:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0014_attachments'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['updated_at'], name='notes_note_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2 on 2026-10-19 18:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0016_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='last_used_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Последняя загрузка'),
+        ),
+    ]
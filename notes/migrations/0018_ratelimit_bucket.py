@@ -0,0 +1,25 @@
+# Generated by Django 4.2 on 2026-10-19 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0017_blob_last_used_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateLimitBucket',
+            fields=[
+                ('key', models.CharField(max_length=255, primary_key=True, serialize=False, verbose_name='Ключ')),
+                ('tokens', models.FloatField(verbose_name='Попыток в запасе')),
+                ('updated', models.FloatField(verbose_name='Пополнена (unix-время)')),
+            ],
+            options={
+                'verbose_name': 'Лимит попыток',
+                'verbose_name_plural': 'Лимиты попыток',
+            },
+        ),
+    ]
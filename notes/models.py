@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.utils import timezone
 
 class Tag(models.Model):
     name = models.CharField(max_length=50, unique=True, verbose_name="Тег")
@@ -24,6 +25,8 @@ class Note(models.Model):
         User,
         on_delete=models.CASCADE,
         related_name='notes',
+        # Пользователи хранятся в default, заметки — возможно, в шарде
+        db_constraint=False,
         verbose_name="Автор"
     )
 
@@ -33,11 +36,19 @@ class Note(models.Model):
         related_name="notes",
         verbose_name="Теги",
     )
+    last_viewed_at = models.DateTimeField(null=True, blank=True, verbose_name="Последний просмотр")
+    # Готовый HTML из Markdown и хеш текста, по которому он получен (notes.markup)
+    content_html = models.TextField(blank=True, default='', editable=False, verbose_name="HTML")
+    content_hash = models.CharField(max_length=32, blank=True, default='', editable=False, verbose_name="Хеш текста")
 
     class Meta:
         verbose_name = "Заметка"
         verbose_name_plural = "Заметки"
         ordering = ['-updated_at']
+        indexes = [
+            # Сортировка и иерархия дат в админке по всем заметкам
+            models.Index(fields=['updated_at'], name='notes_note_updated_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -48,4 +59,281 @@ class Note(models.Model):
     def get_short_content(self, length=100):
         if len(self.content) > length:
             return self.content[:length] + "..."
-        return self.content
\ No newline at end of file
+        return self.content
+
+
+class ArchivedNote(models.Model):
+    """Заметка в холодном архиве.
+    Отдельная таблица без индексов поиска; текст хранится сжатым.
+    id совпадает с id исходной заметки, поэтому ссылки на нее не ломаются."""
+    id = models.BigIntegerField(primary_key=True)
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='archived_notes',
+        # Пользователи хранятся в default, заметки — возможно, в шарде
+        db_constraint=False,
+        verbose_name="Автор"
+    )
+    title = models.CharField(max_length=200, verbose_name="Заголовок")
+    content_compressed = models.BinaryField(verbose_name="Содержание (zlib)")
+    tag_names = models.JSONField(default=list, blank=True, verbose_name="Теги")
+    created_at = models.DateTimeField(verbose_name="Дата создания")
+    updated_at = models.DateTimeField(verbose_name="Дата обновления")
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата архивации")
+
+    class Meta:
+        verbose_name = "Архивная заметка"
+        verbose_name_plural = "Архивные заметки"
+        ordering = ['-archived_at']
+        indexes = [
+            models.Index(fields=['author', '-archived_at'], name='notes_archive_author_idx'),
+        ]
+
+    def __str__(self):
+        return self.title
+
+    def get_absolute_url(self):
+        # Открытие заметки восстанавливает ее из архива
+        return reverse('note_detail', kwargs={'pk': self.pk})
+
+
+class NoteFingerprint(models.Model):
+    """SimHash заметки для поиска почти-дубликатов.
+    64-битный отпечаток разбит на полосы (LSH): у близких отпечатков
+    хотя бы одна полоса совпадает, поэтому кандидаты ищутся по индексу."""
+    note = models.OneToOneField(
+        Note,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='fingerprint',
+        verbose_name="Заметка"
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        # Пользователи хранятся в default, заметки — возможно, в шарде
+        db_constraint=False,
+        verbose_name="Автор"
+    )
+    simhash = models.BigIntegerField(verbose_name="SimHash")
+    band_0 = models.IntegerField()
+    band_1 = models.IntegerField()
+    band_2 = models.IntegerField()
+    band_3 = models.IntegerField()
+
+    class Meta:
+        verbose_name = "Отпечаток заметки"
+        verbose_name_plural = "Отпечатки заметок"
+        indexes = [
+            models.Index(fields=['author', 'band_0'], name='notes_fp_band0_idx'),
+            models.Index(fields=['author', 'band_1'], name='notes_fp_band1_idx'),
+            models.Index(fields=['author', 'band_2'], name='notes_fp_band2_idx'),
+            models.Index(fields=['author', 'band_3'], name='notes_fp_band3_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.note_id}: {self.simhash & 0xFFFFFFFFFFFFFFFF:016x}'
+
+
+class TrigramPosting(models.Model):
+    """Триграмма заголовка или тега заметки — индекс нечеткого поиска.
+    size — сколько всего триграмм у заметки (для ранжирования)."""
+    note = models.ForeignKey(
+        Note,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name="Заметка"
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        db_constraint=False,
+        verbose_name="Автор"
+    )
+    trigram = models.CharField(max_length=3, verbose_name="Триграмма")
+    size = models.PositiveSmallIntegerField(verbose_name="Триграмм у заметки")
+
+    class Meta:
+        verbose_name = "Триграмма"
+        verbose_name_plural = "Триграммы"
+        indexes = [
+            # Поиск идет только по индексу: автор + триграмма -> заметки
+            models.Index(fields=['author', 'trigram', 'note', 'size'], name='notes_trigram_lookup_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.note_id}: {self.trigram!r}'
+
+
+class Blob(models.Model):
+    """Содержимое загруженного файла, адресуемое SHA-256.
+    Одинаковые файлы хранятся на диске один раз. Таблица общая (default)."""
+    sha256 = models.CharField(max_length=64, primary_key=True, verbose_name="SHA-256")
+    size = models.BigIntegerField(verbose_name="Размер")
+    content_type = models.CharField(max_length=100, verbose_name="Тип")
+    has_thumbnail = models.BooleanField(default=False, verbose_name="Есть миниатюра")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата загрузки")
+    # Обновляется при каждой загрузке того же файла: недавно использованные
+    # файлы сборка мусора не трогает, пока к ним создается вложение
+    last_used_at = models.DateTimeField(default=timezone.now, verbose_name="Последняя загрузка")
+
+    class Meta:
+        verbose_name = "Файл"
+        verbose_name_plural = "Файлы"
+
+    def __str__(self):
+        return self.sha256
+
+    @property
+    def is_image(self):
+        return self.content_type.startswith('image/')
+
+
+class Attachment(models.Model):
+    """Вложение заметки: имя файла и ссылка на его содержимое"""
+    note = models.ForeignKey(
+        Note,
+        on_delete=models.CASCADE,
+        related_name='attachments',
+        verbose_name="Заметка"
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        db_constraint=False,
+        verbose_name="Автор"
+    )
+    blob = models.ForeignKey(
+        Blob,
+        on_delete=models.PROTECT,
+        related_name='+',
+        # Blob лежит в default, вложение — в базе заметки
+        db_constraint=False,
+        verbose_name="Файл"
+    )
+    filename = models.CharField(max_length=255, verbose_name="Имя файла")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата загрузки")
+
+    class Meta:
+        verbose_name = "Вложение"
+        verbose_name_plural = "Вложения"
+        ordering = ['created_at', 'pk']
+
+    def __str__(self):
+        return self.filename
+
+
+class Job(models.Model):
+    """Фоновая задача в очереди на основе БД (без внешнего брокера)"""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Готово'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    kind = models.CharField(max_length=50, verbose_name="Тип задачи")
+    user = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='jobs',
+        verbose_name="Пользователь"
+    )
+    payload = models.JSONField(default=dict, blank=True, verbose_name="Параметры")
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING,
+        verbose_name="Статус"
+    )
+    priority = models.SmallIntegerField(default=0, verbose_name="Приоритет")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Попыток")
+    max_attempts = models.PositiveSmallIntegerField(default=3, verbose_name="Максимум попыток")
+    progress = models.PositiveSmallIntegerField(default=0, verbose_name="Прогресс, %")
+    message = models.CharField(max_length=255, blank=True, verbose_name="Сообщение")
+    result = models.JSONField(null=True, blank=True, verbose_name="Результат")
+    error = models.TextField(blank=True, verbose_name="Ошибка")
+    run_after = models.DateTimeField(default=timezone.now, verbose_name="Не раньше")
+    locked_by = models.CharField(max_length=100, blank=True, verbose_name="Воркер")
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name="Захвачена")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+
+    class Meta:
+        verbose_name = "Фоновая задача"
+        verbose_name_plural = "Фоновые задачи"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', '-priority', 'run_after'], name='notes_job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} #{self.pk} ({self.get_status_display()})'
+
+    def get_absolute_url(self):
+        return reverse('job_detail', kwargs={'pk': self.pk})
+
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_DONE, self.STATUS_FAILED)
+
+
+class ShardAssignment(models.Model):
+    """В какой базе лежат заметки пользователя (см. notes.sharding).
+    Хранится в default. Пока moving_to не пусто, данные переносятся и
+    изменения заметок пользователя временно запрещены."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='shard_assignment',
+        verbose_name="Пользователь"
+    )
+    alias = models.CharField(max_length=50, verbose_name="База")
+    moving_to = models.CharField(max_length=50, blank=True, verbose_name="Переносится в")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+
+    class Meta:
+        verbose_name = "Шард пользователя"
+        verbose_name_plural = "Шарды пользователей"
+
+    def __str__(self):
+        return f'{self.user_id} → {self.alias}'
+
+
+class RateLimitBucket(models.Model):
+    """Корзина ограничения попыток (см. notes.ratelimit). Хранится в default."""
+    key = models.CharField(max_length=255, primary_key=True, verbose_name="Ключ")
+    tokens = models.FloatField(verbose_name="Попыток в запасе")
+    updated = models.FloatField(verbose_name="Пополнена (unix-время)")
+
+    class Meta:
+        verbose_name = "Лимит попыток"
+        verbose_name_plural = "Лимиты попыток"
+
+    def __str__(self):
+        return self.key
+
+
+class DataVersion(models.Model):
+    """Счетчик версии данных (см. notes.versions), если кэш Django
+    не общий для процессов. Хранится в default."""
+    key = models.CharField(max_length=100, primary_key=True, verbose_name="Ключ")
+    version = models.BigIntegerField(verbose_name="Версия")
+
+    class Meta:
+        verbose_name = "Версия данных"
+        verbose_name_plural = "Версии данных"
+
+    def __str__(self):
+        return f'{self.key} = {self.version}'
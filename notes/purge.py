@@ -0,0 +1,167 @@
+"""
+Удаление аккаунтов и данных с истекшим сроком хранения.
+Каскадное удаление пользователя — одна транзакция на все его заметки,
+теги, триграммы и вложения; на SQLite она блокирует запись для всех на
+десятки секунд. Здесь данные удаляются пачками по NOTES_PURGE_CHUNK_SIZE
+в коротких транзакциях с паузой NOTES_PURGE_PAUSE между ними.
+
+Каждый шаг удаляет «следующую пачку из оставшегося», поэтому прерванное
+удаление продолжается с места остановки: задача delete_account
+повторяется очередью, а команда purge_data возобновляет упавшие задачи.
+"""
+
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from . import attachments, jobs, ratelimit, sharding
+from .models import ArchivedNote, Attachment, Job, Note
+
+CHUNK_SIZE = 200
+PAUSE = 0.05  # секунд между пачками: другие запросы успевают взять блокировку
+JOB_RETENTION_DAYS = 30
+
+
+def chunk_size():
+    return getattr(settings, 'NOTES_PURGE_CHUNK_SIZE', CHUNK_SIZE)
+
+
+def pause():
+    delay = getattr(settings, 'NOTES_PURGE_PAUSE', PAUSE)
+    if delay:
+        time.sleep(delay)
+
+
+def _delete_notes_chunk(ids):
+    """Заметки с тегами, отпечатками, триграммами и вложениями — одной транзакцией"""
+    hashes = set(
+        Attachment.objects.filter(note_id__in=ids).values_list('blob_id', flat=True)
+    )
+    with sharding.atomic():
+        Note.objects.filter(pk__in=ids).delete()
+    # Файлы — после фиксации: на них могут ссылаться другие заметки
+    for sha256 in hashes:
+        attachments.release(sha256)
+
+
+def delete_in_chunks(queryset, progress=None):
+    """Удаляет выборку пачками по возрастанию pk. Возвращает число удаленных."""
+    delete = _delete_notes_chunk if queryset.model is Note else None
+    deleted = 0
+    while True:
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:chunk_size()])
+        if not ids:
+            return deleted
+        if delete is not None:
+            delete(ids)
+        else:
+            with transaction.atomic(using=queryset.db):
+                queryset.model._default_manager.using(queryset.db).filter(pk__in=ids).delete()
+        deleted += len(ids)
+        if progress is not None:
+            progress(deleted)
+        pause()
+
+
+# ============= АККАУНТЫ =============
+
+def schedule_account_deletion(user):
+    """Блокирует аккаунт и ставит удаление его данных в очередь (однократно)"""
+    user.is_active = False
+    user.save(update_fields=['is_active'])
+    scheduled = Job.objects.filter(
+        kind='delete_account', payload__user_id=user.pk,
+        status__in=[Job.STATUS_PENDING, Job.STATUS_RUNNING, Job.STATUS_FAILED],
+    ).first()
+    if scheduled is not None:
+        return scheduled
+    return jobs.enqueue('delete_account', user=user, priority=-1, user_id=user.pk)
+
+
+def delete_account(user_id, progress=None):
+    """Удаляет данные пользователя во всех базах, затем самого пользователя.
+    progress(удалено, всего) вызывается после каждой пачки."""
+    rows = [
+        (alias, model.objects.using(alias).filter(author_id=user_id))
+        # Данные могут остаться в default (до шардирования) или в двух шардах (перенос)
+        for alias in sharding.databases()
+        for model in (Note, ArchivedNote)
+    ]
+    total = sum(queryset.count() for _, queryset in rows)
+
+    done = 0
+    for alias, queryset in rows:
+        offset = done
+
+        def report(deleted):
+            if progress is not None:
+                progress(offset + deleted, total)
+
+        with sharding.use_db(alias):
+            done += delete_in_chunks(queryset, report)
+
+    finished = Job.objects.filter(
+        user_id=user_id, status__in=[Job.STATUS_DONE, Job.STATUS_FAILED]
+    )
+    delete_jobs(finished)
+    # Заметок уже нет — каскад по пользователю затрагивает единицы строк
+    User.objects.filter(pk=user_id).delete()
+    return done
+
+
+def resume_account_deletions():
+    """Возвращает в очередь прерванные удаления аккаунтов.
+    Упавшие задачи получают новые попытки, зависшие — возвращаются воркерам."""
+    jobs.requeue_stale()
+    return Job.objects.filter(kind='delete_account', status=Job.STATUS_FAILED).update(
+        status=Job.STATUS_PENDING, attempts=0, run_after=timezone.now(),
+    )
+
+
+# ============= СРОК ХРАНЕНИЯ =============
+
+def delete_jobs(queryset):
+    """Удаляет завершенные задачи вместе с файлами выгрузки"""
+    from .tasks import media_path
+
+    for result in queryset.filter(kind='export_notes').values_list('result', flat=True):
+        if result and result.get('file'):
+            media_path(result['file']).unlink(missing_ok=True)
+    return delete_in_chunks(queryset)
+
+
+def expired_archive(days, now=None):
+    """Архивные заметки, пролежавшие в архиве больше days дней"""
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    return ArchivedNote.objects.filter(archived_at__lt=cutoff)
+
+
+def expired_jobs(days=None, now=None):
+    """Завершенные задачи старше days дней"""
+    if days is None:
+        days = getattr(settings, 'NOTES_JOB_RETENTION_DAYS', JOB_RETENTION_DAYS)
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    return Job.objects.filter(
+        status__in=[Job.STATUS_DONE, Job.STATUS_FAILED], updated_at__lt=cutoff
+    )
+
+
+def purge_expired(archive_days=None, job_days=None, now=None):
+    """Удаляет данные с истекшим сроком хранения. Возвращает {что: сколько}.
+    Архив чистится, только если задан срок (NOTES_ARCHIVE_RETENTION_DAYS)."""
+    if archive_days is None:
+        archive_days = getattr(settings, 'NOTES_ARCHIVE_RETENTION_DAYS', None)
+    archived = 0
+    if archive_days:
+        for alias in sharding.databases():
+            with sharding.use_db(alias):
+                archived += delete_in_chunks(expired_archive(archive_days, now))
+    return {
+        'archived_notes': archived,
+        'jobs': delete_jobs(expired_jobs(job_days, now)),
+        'rate_limits': ratelimit.purge_full(now.timestamp() if now else None),
+    }
@@ -0,0 +1,79 @@
+"""
+Ограничение частоты запросов (token bucket).
+Корзина на N попыток пополняется равномерно за T секунд, поэтому на
+границе периода не бывает двойного всплеска, как у счетчика по окнам.
+Состояние корзин (запас и время пополнения) хранится в таблице
+RateLimitBucket в default: попытка расходуется одним UPDATE ... WHERE
+запас >= 1 (как захват задачи в notes.jobs), поэтому лимит общий для всех
+процессов и параллельные запросы не проходят его между проверкой и
+записью. Лимиты задаются в settings.NOTES_RATE_LIMITS.
+"""
+
+import time
+
+from django.conf import settings
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Least
+from django.db.models.lookups import GreaterThanOrEqual
+
+from .models import RateLimitBucket
+
+
+def client_ip(request):
+    """IP клиента. За прокси задайте NOTES_CLIENT_IP_HEADER (например, HTTP_X_REAL_IP)."""
+    header = getattr(settings, 'NOTES_CLIENT_IP_HEADER', None)
+    value = request.META.get(header) if header else None
+    if value:
+        return value.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+class TokenBucket:
+    """Корзина на capacity попыток, пополняется равномерно за period секунд"""
+
+    def __init__(self, name, capacity, period):
+        self.name = name
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.period = period
+
+    @classmethod
+    def named(cls, name):
+        return cls(name, *settings.NOTES_RATE_LIMITS[name])
+
+    def _key(self, key):
+        return f'{self.name}:{key}'[:255]
+
+    def _refilled(self, now):
+        """Запас с учетом пополнения с момента updated (выражение SQL)"""
+        return Least(
+            Value(float(self.capacity)),
+            F('tokens') + (Value(now) - F('updated')) * Value(self.rate),
+            output_field=FloatField(),
+        )
+
+    def hit(self, key):
+        """Расходует попытку. Возвращает False, если попыток не осталось."""
+        now = time.time()
+        RateLimitBucket.objects.get_or_create(
+            key=self._key(key), defaults={'tokens': self.capacity, 'updated': now}
+        )
+        refilled = self._refilled(now)
+        return bool(
+            RateLimitBucket.objects
+            .filter(GreaterThanOrEqual(refilled, 1), key=self._key(key))
+            .update(tokens=refilled - 1, updated=now)
+        )
+
+    def undo(self, key):
+        """Возвращает попытку, израсходованную hit (например, после удачного входа)"""
+        RateLimitBucket.objects.filter(key=self._key(key)).update(
+            tokens=Least(Value(float(self.capacity)), F('tokens') + 1, output_field=FloatField())
+        )
+
+
+def purge_full(now=None):
+    """Удаляет корзины, которые уже наполнились: они равны отсутствующим"""
+    periods = [period for _, period in getattr(settings, 'NOTES_RATE_LIMITS', {}).values()]
+    cutoff = (now or time.time()) - max(periods, default=0)
+    return RateLimitBucket.objects.filter(updated__lt=cutoff).delete()[0]
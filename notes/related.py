@@ -0,0 +1,254 @@
+"""
+Похожие заметки.
+Для каждого пользователя строится TF-IDF индекс по заголовкам и текстам
+заметок (хешированный мешок слов, разреженная матрица в формате CSR на
+NumPy). Косинусная близость ко всем заметкам считается одним векторным
+проходом. Индекс кэшируется в памяти процесса и обновляется после
+изменений заметок в фоне — обработчик запроса никогда его не ждет.
+Обновление заменяет только строки измененных заметок (по updated_at)
+и удаленных; полностью индекс строится заново, когда заменено больше
+REBUILD_RATIO строк.
+"""
+
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import timedelta
+from functools import cached_property
+
+import numpy as np
+from django.db.models import Q
+
+from . import background, metrics, sharding
+from .text import words
+from .versions import NOTES_SCOPE, get_version
+
+N_FEATURES = 1 << 18  # размер пространства хешей слов
+MIN_WORD_LENGTH = 3
+MIN_SCORE = 0.05  # заметки с меньшей близостью не считаем похожими
+DEFAULT_LIMIT = 5
+MAX_CACHED_INDEXES = 128
+# Доля замененных строк, после которой индекс строится заново (с новым idf)
+REBUILD_RATIO = 0.2
+# Изменения, зафиксированные позже чтения, ищем с таким запасом по updated_at
+CHANGE_SLACK = timedelta(minutes=1)
+
+
+def hash_terms(text):
+    """Номера признаков для слов текста (crc32 стабилен между процессами)"""
+    terms = [word for word in words(text) if len(word) >= MIN_WORD_LENGTH]
+    return np.fromiter(
+        (zlib.crc32(term.encode('utf-8')) % N_FEATURES for term in terms),
+        dtype=np.int64,
+        count=len(terms),
+    )
+
+
+def _lookup(keys, query):
+    """Позиции элементов query в отсортированном keys и маска найденных"""
+    if not len(keys):
+        return np.zeros(len(query), np.int64), np.zeros(len(query), bool)
+    positions = np.minimum(np.searchsorted(keys, query), len(keys) - 1)
+    return positions, keys[positions] == query
+
+
+def _tokenize(documents):
+    """id, число признаков в строке, признаки и их tf для пар (id, текст)"""
+    ids, lengths, cols, counts = [], [], [], []
+    for pk, text in documents:
+        terms, tf = np.unique(hash_terms(text), return_counts=True)
+        ids.append(pk)
+        lengths.append(len(terms))
+        cols.append(terms)
+        counts.append(tf)
+    if not ids:
+        return ids, np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.int64)
+    return ids, np.asarray(lengths, np.int64), np.concatenate(cols), np.concatenate(counts)
+
+
+def _indptr(lengths):
+    return np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+
+def _weights(lengths, cols, tf, idf):
+    """Сублинейный tf * idf с L2-нормировкой строк"""
+    terms, values, n_docs = idf
+    positions, found = _lookup(terms, cols)
+    # Признаки, которых не было при расчете idf, считаем редкими (df = 0)
+    term_idf = np.full(len(cols), np.log(1 + n_docs) + 1, dtype=np.float32)
+    term_idf[found] = values[positions[found]]
+    data = ((1 + np.log(tf)) * term_idf).astype(np.float32)
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    norms = np.sqrt(np.bincount(rows, weights=data * data, minlength=len(lengths)))
+    norms[norms == 0] = 1
+    data /= norms[rows].astype(np.float32)
+    return data
+
+
+class RelatedIndex:
+    """TF-IDF матрица заметок одного пользователя в формате CSR.
+    idf фиксируется при полной перестройке; при изменении заметок
+    заменяются только их строки (updated)."""
+
+    def __init__(self, ids, indptr, cols, data, idf, changes=0):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.indptr = indptr
+        self.cols = cols
+        self.data = data
+        self.idf = idf  # (признаки по возрастанию, их idf, число заметок)
+        self.changes = changes  # строк заменено после полной перестройки
+        # Номер строки для каждого ненулевого элемента — нужен для bincount
+        self.rows = np.repeat(np.arange(len(self.ids)), np.diff(indptr))
+        self.positions = {int(pk): row for row, pk in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @cached_property
+    def by_term(self):
+        """Ненулевые элементы (признак, строка, вес), упорядоченные по признаку"""
+        order = np.argsort(self.cols, kind='stable')
+        return self.cols[order], self.rows[order], self.data[order]
+
+    @classmethod
+    def build(cls, documents):
+        """Строит индекс по парам (id, текст). Выполняется в пуле процессов."""
+        ids, lengths, cols, tf = _tokenize(documents)
+        # Сглаженный idf; в строке признаки уникальны, поэтому частота
+        # признака по всем строкам — его документная частота
+        terms, df = np.unique(cols, return_counts=True)
+        idf = (terms, (np.log((1 + len(ids)) / (1 + df)) + 1).astype(np.float32), len(ids))
+        return cls(ids, _indptr(lengths), cols, _weights(lengths, cols, tf, idf), idf)
+
+    def updated(self, documents, removed=()):
+        """Новый индекс, где строки заметок documents заменены или добавлены,
+        а строки removed удалены. Остальные строки не пересчитываются."""
+        ids, lengths, cols, tf = _tokenize(documents)
+        replaced = np.asarray([*ids, *removed], dtype=np.int64)
+        keep = ~np.isin(self.ids, replaced)
+        kept = keep[self.rows]
+        return RelatedIndex(
+            np.concatenate([self.ids[keep], np.asarray(ids, np.int64)]),
+            _indptr(np.concatenate([np.diff(self.indptr)[keep], lengths])),
+            np.concatenate([self.cols[kept], cols]),
+            np.concatenate([self.data[kept], _weights(lengths, cols, tf, self.idf)]),
+            self.idf,
+            changes=self.changes + len(replaced),
+        )
+
+    def needs_rebuild(self):
+        return self.changes > REBUILD_RATIO * len(self)
+
+    def similar(self, pk, limit=DEFAULT_LIMIT):
+        """Пары (id, близость) самых похожих заметок, по убыванию близости"""
+        row = self.positions.get(pk)
+        if row is None or len(self) < 2:
+            return []
+        start, end = self.indptr[row], self.indptr[row + 1]
+        # Разреженный вектор запроса: только признаки строки и их веса.
+        # Для каждого берем отрезок элементов с этим признаком в by_term.
+        cols, rows, data = self.by_term
+        first = np.searchsorted(cols, self.cols[start:end], 'left')
+        counts = np.searchsorted(cols, self.cols[start:end], 'right') - first
+        found = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        weights = data[found] * np.repeat(self.data[start:end], counts)
+
+        # Скалярные произведения со всеми строками за один проход
+        scores = np.bincount(rows[found], weights=weights, minlength=len(self))
+        scores[row] = 0
+
+        limit = min(limit, len(self) - 1)
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (int(self.ids[i]), float(scores[i]))
+            for i in top if scores[i] >= MIN_SCORE
+        ]
+
+
+_indexes = OrderedDict()  # user_id -> (версия, RelatedIndex, последний updated_at)
+_pending = set()  # пользователи, чей индекс сейчас перестраивается
+_lock = threading.Lock()
+
+
+def _documents(notes):
+    """Пары (id, текст) и последний updated_at среди заметок"""
+    documents = []
+    watermark = None
+    for pk, title, content, updated_at in notes.values_list(
+        'pk', 'title', 'content', 'updated_at'
+    ).iterator():
+        documents.append((pk, f'{title}\n{content}'))
+        watermark = max(watermark or updated_at, updated_at)
+    return documents, watermark
+
+
+def _load_changes(user_id, index, since):
+    """Заметки, измененные или добавленные после построения индекса, и id удаленных"""
+    from .models import Note
+
+    notes = Note.objects.filter(author_id=user_id)
+    current = set(notes.values_list('pk', flat=True))
+    # Новые id ищем и без updated_at: восстановленные из архива сохраняют дату
+    condition = Q(pk__in=current - index.positions.keys())
+    if since is not None:
+        condition |= Q(updated_at__gte=since - CHANGE_SLACK)
+    documents, watermark = _documents(notes.filter(condition))
+    removed = index.positions.keys() - current
+    return documents, removed, max(filter(None, (since, watermark)), default=None)
+
+
+def _rebuild(user_id, version):
+    try:
+        with _lock:
+            cached = _indexes.get(user_id)
+        with sharding.for_user(user_id):
+            if cached is None or cached[1].needs_rebuild():
+                from .models import Note
+
+                documents, watermark = _documents(Note.objects.filter(author_id=user_id))
+                index = background.compute(RelatedIndex.build, documents)
+            else:
+                _, index, since = cached
+                documents, removed, watermark = _load_changes(user_id, index, since)
+                index = index.updated(documents, removed)
+        index.by_term  # noqa: B018 — упорядочиваем здесь, а не в запросе
+        with _lock:
+            _indexes[user_id] = (version, index, watermark)
+            _indexes.move_to_end(user_id)
+            while len(_indexes) > MAX_CACHED_INDEXES:
+                _indexes.popitem(last=False)
+    finally:
+        with _lock:
+            _pending.discard(user_id)
+
+
+def schedule_rebuild(user_id, version):
+    """Ставит обновление индекса в фон, если оно еще не запущено"""
+    with _lock:
+        if user_id in _pending:
+            return
+        _pending.add(user_id)
+    background.run_in_background(_rebuild, user_id, version)
+
+
+def get_index(user_id):
+    """Текущий индекс пользователя или None, если он еще не построен.
+    Устаревший индекс возвращается, пока в фоне строится новый."""
+    version = get_version(NOTES_SCOPE, user_id)
+    with _lock:
+        cached = _indexes.get(user_id)
+    metrics.cache_access('related', cached is not None and cached[0] == version)
+    if cached is None or cached[0] != version:
+        schedule_rebuild(user_id, version)
+        with _lock:
+            cached = _indexes.get(user_id)
+    return cached[1] if cached is not None else None
+
+
+def related_note_ids(note, limit=DEFAULT_LIMIT):
+    """id заметок автора, похожих на данную"""
+    index = get_index(note.author_id)
+    if index is None:
+        return []
+    return [pk for pk, score in index.similar(note.pk, limit)]
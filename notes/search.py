@@ -0,0 +1,119 @@
+"""
+Поиск заметок.
+Общий для страницы поиска и массовых действий «все найденные».
+На PostgreSQL используется полнотекстовый поиск (GIN-индекс по tsvector)
+и нечеткое совпадение заголовка через pg_trgm, на SQLite — icontains.
+Если точных совпадений мало, добавляются похожие заметки из триграммного
+индекса заголовков и тегов (notes.trigrams) — он работает на любой СУБД.
+Страница поиска показывает не больше RESULT_LIMIT результатов: стоимость
+запроса ограничена, даже если под него подходят все заметки.
+"""
+
+import time
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+
+from . import metrics, trigrams
+from .models import Note
+
+SEARCH_CONFIG = 'russian'
+FUZZY_MIN_RESULTS = 3  # меньше точных совпадений — ищем с опечатками
+FUZZY_LIMIT = 20
+RESULT_LIMIT = 1000  # больше результатов не показываем («1000+»)
+PAGE_SIZE = 10  # как в списке заметок
+
+
+def user_notes(user):
+    """Рабочие заметки пользователя (архивные лежат в ArchivedNote).
+    Готовый HTML нужен только на странице заметки — в списках не загружаем."""
+    return Note.objects.filter(author=user).defer('content_html')
+
+
+def uses_postgres(queryset):
+    return connections[queryset.db].vendor == 'postgresql'
+
+
+def search_vector():
+    """Совпадает с выражением индекса notes_note_search_idx (миграция 0011)"""
+    from django.contrib.postgres.search import SearchVector
+
+    return (
+        SearchVector('title', config=SEARCH_CONFIG, weight='A') +
+        SearchVector('content', config=SEARCH_CONFIG, weight='B')
+    )
+
+
+def _postgres_search(notes, query):
+    from django.contrib.postgres.search import SearchQuery, SearchRank
+
+    vector = search_vector()
+    search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+    return (
+        notes.annotate(search=vector, rank=SearchRank(vector, search_query))
+        .filter(Q(search=search_query) | Q(title__trigram_word_similar=query))
+        .order_by('-rank', '-updated_at')
+    )
+
+
+def search_notes(user, query):
+    """Заметки пользователя, подходящие под запрос (пустой запрос — все)"""
+    notes = user_notes(user)
+    if not query:
+        return notes
+    if uses_postgres(notes):
+        return _postgres_search(notes, query)
+    return notes.filter(
+        Q(title__icontains=query) |
+        Q(content__icontains=query)
+    )
+
+
+def fuzzy_ids(user, query, exact_ids):
+    """id похожих заметок (по убыванию сходства), если точных совпадений мало"""
+    if not query or len(exact_ids) >= FUZZY_MIN_RESULTS:
+        return []
+    exclude = set(exact_ids)
+    return [
+        pk for pk, _ in trigrams.search(user.pk, query, FUZZY_LIMIT + len(exclude))
+        if pk not in exclude
+    ][:FUZZY_LIMIT]
+
+
+def find_notes(user, query):
+    """Заметки для страницы поиска: сначала точные совпадения, затем похожие.
+    Возвращает (список заметок, сколько из них найдено нечетко)."""
+    notes = list(search_notes(user, query))
+    ids = fuzzy_ids(user, query, [note.pk for note in notes])
+    similar = user_notes(user).in_bulk(ids)
+    fuzzy = [similar[pk] for pk in ids if pk in similar]
+    return notes + fuzzy, len(fuzzy)
+
+
+def search_page(user, query, page_number=None, per_page=PAGE_SIZE):
+    """Страница результатов поиска.
+    Возвращает (страница, сколько на ней найдено нечетко, обрезаны ли результаты).
+    Число результатов считается не дальше RESULT_LIMIT + 1."""
+    start = time.perf_counter()
+    notes = search_notes(user, query)
+    total = notes[:RESULT_LIMIT + 1].count()
+    if total < FUZZY_MIN_RESULTS:
+        # Точных совпадений мало — список вместе с похожими короткий
+        results, fuzzy_count = find_notes(user, query)
+        page = Paginator(results, per_page).get_page(page_number)
+        metrics.SEARCH_DURATION.observe(time.perf_counter() - start, 'fuzzy')
+        return page, fuzzy_count, False
+
+    paginator = Paginator(notes[:RESULT_LIMIT], per_page)
+    paginator.count = min(total, RESULT_LIMIT)  # второй COUNT не нужен
+    page = paginator.get_page(page_number)
+    page.object_list = list(page.object_list)  # в замер входит и выборка
+    metrics.SEARCH_DURATION.observe(time.perf_counter() - start, 'exact')
+    return page, 0, total > RESULT_LIMIT
+
+
+def find_note_ids(user, query):
+    """id тех же заметок, что показывает find_notes (для «все найденные»)"""
+    ids = list(search_notes(user, query).order_by('pk').values_list('pk', flat=True))
+    return ids + fuzzy_ids(user, query, ids)
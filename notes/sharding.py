@@ -0,0 +1,300 @@
+"""
+Шардирование заметок по пользователям.
+Заметки, теги, отпечатки и архив пользователя лежат в одной из NOTES_SHARDS
+баз (shard_0, shard_1, ...), выбранной по стабильному хешу id.
+У каждой базы своя блокировка записи, поэтому активный пользователь не
+тормозит остальных. Пользователи, сессии и очередь задач остаются в default.
+
+Текущая база задается для потока: middleware (по пользователю запроса),
+jobs.run (по пользователю задачи) и use_db в командах. ShardRouter
+направляет туда запросы к моделям заметок.
+"""
+
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from . import metrics, trigrams
+from .versions import NOTES_SCOPE, bump_version
+
+SHARD_PREFIX = 'shard_'
+TENANT_MODELS = {
+    'note', 'note_tags', 'tag', 'notefingerprint', 'archivednote', 'trigramposting',
+    'attachment',
+}
+ID_RANGE = 10 ** 12  # id в шарде i начинаются с (i + 1) * ID_RANGE
+CACHE_TIMEOUT = 300  # секунд
+BATCH_SIZE = 500
+MOVE_GRACE = 5  # секунд на завершение запросов, начатых до заморозки
+
+_local = threading.local()
+
+
+def shard_count():
+    return getattr(settings, 'NOTES_SHARDS', 0)
+
+
+def is_enabled():
+    return shard_count() > 0
+
+
+def shard_aliases():
+    return [f'{SHARD_PREFIX}{index}' for index in range(shard_count())]
+
+
+def databases():
+    """Все базы, в которых могут лежать заметки"""
+    return [DEFAULT_DB_ALIAS, *shard_aliases()]
+
+
+def hash_shard(user_id):
+    """Шард по стабильному хешу (crc32 одинаков во всех процессах, hash() — нет)"""
+    return f'{SHARD_PREFIX}{zlib.crc32(str(user_id).encode()) % shard_count()}'
+
+
+def _cache_key(user_id):
+    return f'notes:shard:{user_id}'
+
+
+def placement(user_id):
+    """(база с данными пользователя, база, куда они переносятся, или '')"""
+    if not is_enabled() or user_id is None:
+        return DEFAULT_DB_ALIAS, ''
+    key = _cache_key(user_id)
+    cached = cache.get(key)
+    metrics.cache_access('shard', cached is not None)
+    if cached is None:
+        from .models import ShardAssignment
+
+        row = (
+            ShardAssignment.objects.filter(user_id=user_id)
+            .values_list('alias', 'moving_to')
+            .first()
+        )
+        # Без назначения — пользователь создан до включения шардов
+        cached = row or (DEFAULT_DB_ALIAS, '')
+        cache.set(key, cached, CACHE_TIMEOUT)
+    return tuple(cached)
+
+
+def db_for_user(user_id):
+    return placement(user_id)[0]
+
+
+def is_moving(user_id):
+    return bool(placement(user_id)[1])
+
+
+def assign(user_id, alias, moving_to=''):
+    from .models import ShardAssignment
+
+    ShardAssignment.objects.update_or_create(
+        user_id=user_id, defaults={'alias': alias, 'moving_to': moving_to}
+    )
+    cache.delete(_cache_key(user_id))
+
+
+def current_db():
+    return getattr(_local, 'db', None) or DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def use_db(alias):
+    """Направляет запросы к заметкам в данном потоке в базу alias"""
+    previous = getattr(_local, 'db', None)
+    _local.db = alias
+    try:
+        yield alias
+    finally:
+        _local.db = previous
+
+
+def for_user(user_id):
+    return use_db(db_for_user(user_id))
+
+
+def atomic():
+    """transaction.atomic для текущей базы заметок"""
+    return transaction.atomic(using=current_db())
+
+
+class ShardRouter:
+    """Роутер: модели заметок — в базу пользователя, остальное — в default"""
+
+    @staticmethod
+    def is_tenant(model):
+        return model._meta.app_label == 'notes' and model._meta.model_name in TENANT_MODELS
+
+    def _db(self, model, **hints):
+        if not self.is_tenant(model):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None:
+            # __class__, а не type(): request.user — SimpleLazyObject
+            if self.is_tenant(instance.__class__):
+                if instance._state.db:
+                    return instance._state.db
+                if getattr(instance, 'author_id', None):
+                    return db_for_user(instance.author_id)
+            elif isinstance(instance, get_user_model()):
+                # user.notes, user.archived_notes
+                return db_for_user(instance.pk)
+        return current_db()
+
+    db_for_read = _db
+    db_for_write = _db
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Связи заметок с пользователями из default разрешены (без ограничений в БД)
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not db.startswith(SHARD_PREFIX):
+            return None
+        return app_label == 'notes' and (model_name is None or model_name in TENANT_MODELS)
+
+
+def reserve_id_range(alias):
+    """Сдвигает автоинкремент таблиц шарда в его диапазон id, чтобы id
+    заметок не пересекались между базами и сохранялись при переносе"""
+    from .models import Attachment, Note, Tag
+
+    if not alias.startswith(SHARD_PREFIX):
+        return
+    connection = connections[alias]
+    start = (int(alias[len(SHARD_PREFIX):]) + 1) * ID_RANGE
+    tables = [
+        Note._meta.db_table, Tag._meta.db_table, Note.tags.through._meta.db_table,
+        Attachment._meta.db_table,
+    ]
+    with connection.cursor() as cursor:
+        for table in tables:
+            if connection.vendor == 'postgresql':
+                cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+                sequence = cursor.fetchone()[0]
+                cursor.execute(f'SELECT last_value FROM {sequence}')
+                if cursor.fetchone()[0] < start:
+                    cursor.execute('SELECT setval(%s, %s, false)', [sequence, start])
+                continue
+            cursor.execute(
+                'INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s '
+                'WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)',
+                [table, start, table],
+            )
+            cursor.execute(
+                'UPDATE sqlite_sequence SET seq = %s WHERE name = %s AND seq < %s',
+                [start, table, start],
+            )
+
+
+# ============= ПЕРЕНОС ПОЛЬЗОВАТЕЛЯ =============
+
+def _restore_dates(model, alias, objects, dates, fields):
+    # bulk_create перезаписывает auto_now/auto_now_add — возвращаем исходные
+    for obj in objects:
+        for field, value in zip(fields, dates[obj.pk]):
+            setattr(obj, field, value)
+    model.objects.using(alias).bulk_update(objects, fields)
+
+
+def _copy_user(user_id, source, target, batch_size):
+    from .models import ArchivedNote, Attachment, Note, NoteFingerprint, Tag
+
+    through = Note.tags.through
+    notes = Note.objects.using(source).filter(author_id=user_id).order_by('pk')
+    copied = 0
+    last = 0
+    while True:
+        batch = list(notes.filter(pk__gt=last)[:batch_size])
+        if not batch:
+            break
+        last = batch[-1].pk
+        ids = [note.pk for note in batch]
+        dates = {note.pk: (note.created_at, note.updated_at) for note in batch}
+        links = list(
+            through.objects.using(source).filter(note_id__in=ids)
+            .values_list('note_id', 'tag__name')
+        )
+        prints = list(NoteFingerprint.objects.using(source).filter(note_id__in=ids))
+        files = list(Attachment.objects.using(source).filter(note_id__in=ids))
+        file_dates = {item.pk: (item.created_at,) for item in files}
+
+        with transaction.atomic(using=target):
+            Note.objects.using(target).bulk_create(batch)
+            _restore_dates(Note, target, batch, dates, ['created_at', 'updated_at'])
+            names = {name for _, name in links}
+            Tag.objects.using(target).bulk_create(
+                [Tag(name=name) for name in names], ignore_conflicts=True
+            )
+            tag_ids = dict(
+                Tag.objects.using(target).filter(name__in=names).values_list('name', 'pk')
+            )
+            through.objects.using(target).bulk_create([
+                through(note_id=note_id, tag_id=tag_ids[name]) for note_id, name in links
+            ])
+            NoteFingerprint.objects.using(target).bulk_create(prints)
+            Attachment.objects.using(target).bulk_create(files)
+            _restore_dates(Attachment, target, files, file_dates, ['created_at'])
+        with use_db(target):
+            trigrams.reindex(ids)
+        copied += len(batch)
+
+    archived = ArchivedNote.objects.using(source).filter(author_id=user_id).order_by('pk')
+    last = 0
+    while True:
+        batch = list(archived.filter(pk__gt=last)[:batch_size])
+        if not batch:
+            break
+        last = batch[-1].pk
+        dates = {note.pk: (note.archived_at,) for note in batch}
+        with transaction.atomic(using=target):
+            ArchivedNote.objects.using(target).bulk_create(batch)
+            _restore_dates(ArchivedNote, target, batch, dates, ['archived_at'])
+        copied += len(batch)
+    return copied
+
+
+def delete_user_data(user_id, alias, batch_size=BATCH_SIZE):
+    """Удаляет заметки пользователя из базы alias короткими транзакциями"""
+    from .models import ArchivedNote, Note
+
+    for model in (Note, ArchivedNote):
+        rows = model.objects.using(alias).filter(author_id=user_id)
+        while True:
+            ids = list(rows.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            with transaction.atomic(using=alias):
+                model.objects.using(alias).filter(pk__in=ids).delete()
+
+
+def move_user(user_id, target, batch_size=BATCH_SIZE, grace=MOVE_GRACE):
+    """Переносит данные пользователя в базу target без остановки сервиса.
+    На время копирования изменения заметок пользователя запрещены (503),
+    чтение продолжается из старой базы. Возвращает число перенесенных записей."""
+    source, moving_to = placement(user_id)
+    if moving_to:
+        # Прошлый перенос прервался — убираем неполную копию
+        delete_user_data(user_id, moving_to, batch_size)
+    if source == target:
+        assign(user_id, source)
+        return 0
+
+    assign(user_id, source, moving_to=target)
+    time.sleep(grace)
+    try:
+        copied = _copy_user(user_id, source, target, batch_size)
+    except Exception:
+        delete_user_data(user_id, target, batch_size)
+        assign(user_id, source)
+        raise
+    assign(user_id, target)
+    delete_user_data(user_id, source, batch_size)
+    bump_version(NOTES_SCOPE, user_id)
+    return copied
@@ -0,0 +1,161 @@
+"""
+Сигналы приложения notes.
+Поддерживают производные данные (индексы, кэши) в актуальном состоянии.
+"""
+
+from django.contrib.auth.models import Group, User
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_save
+from django.dispatch import receiver
+
+from . import auth_backends, events, fingerprints, markup, metrics, sharding, trigrams
+from .models import Note, Tag
+from .versions import NOTES_SCOPE, bump_version
+
+
+@receiver(pre_save, sender=Note)
+def note_render(sender, instance, raw=False, **kwargs):
+    """Markdown рендерится один раз при сохранении, а не при каждом просмотре"""
+    if not raw:
+        markup.prepare(instance)
+
+
+@receiver(post_save, sender=Note)
+@receiver(post_delete, sender=Note)
+def note_changed(sender, instance, **kwargs):
+    """Заметка создана, изменена или удалена"""
+    bump_version(NOTES_SCOPE, instance.author_id)
+
+
+@receiver(post_save, sender=Note)
+@receiver(post_delete, sender=Note)
+def note_counted(sender, instance, created=None, raw=False, **kwargs):
+    """Счетчик изменений заметок для /metrics"""
+    if not raw:
+        action = 'deleted' if created is None else 'created' if created else 'updated'
+        metrics.NOTE_CHANGES.inc(action)
+
+
+@receiver(post_save, sender=Note)
+def note_saved_event(sender, instance, created, raw=False, **kwargs):
+    """Открытые вкладки автора обновляют карточку заметки"""
+    if not raw:
+        events.publish_note(events.CREATED if created else events.UPDATED, instance)
+
+
+@receiver(post_delete, sender=Note)
+def note_deleted_event(sender, instance, **kwargs):
+    """Открытые вкладки автора убирают карточку заметки"""
+    events.publish_note(events.DELETED, instance)
+
+
+@receiver(post_save, sender=Note)
+def note_saved_fingerprint(sender, instance, raw=False, **kwargs):
+    """Пересчет SimHash-отпечатка для поиска дубликатов"""
+    if not raw:
+        with sharding.use_db(instance._state.db):
+            fingerprints.update_fingerprint(instance)
+
+
+@receiver(post_save, sender=Note)
+def note_saved_trigrams(sender, instance, raw=False, **kwargs):
+    """Триграммы заголовка для нечеткого поиска"""
+    if not raw:
+        with sharding.use_db(instance._state.db):
+            trigrams.update_note(instance)
+
+
+@receiver(m2m_changed, sender=Note.tags.through)
+def note_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Изменился набор тегов заметки"""
+    # Производные данные — в базе заметки или тега, а не в базе текущего запроса
+    with sharding.use_db(instance._state.db):
+        _tags_changed(instance, action, reverse, pk_set)
+
+
+def _tags_changed(instance, action, reverse, pk_set):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            trigrams.update_note(instance)
+            bump_version(NOTES_SCOPE, instance.author_id)
+        return
+
+    # Изменения со стороны тега: затронуты все связанные заметки
+    if action in ('post_add', 'post_remove'):
+        note_ids = list(pk_set)
+    elif action == 'pre_clear':
+        # После очистки связей уже не найти — запоминаем заметки заранее
+        instance._cleared_note_ids = list(instance.notes.values_list('pk', flat=True))
+        return
+    elif action == 'post_clear':
+        note_ids = getattr(instance, '_cleared_note_ids', [])
+    else:
+        return
+    trigrams.reindex(note_ids)
+    notes = Note.objects.filter(pk__in=note_ids)
+    for author_id in notes.order_by().values_list('author_id', flat=True).distinct():
+        bump_version(NOTES_SCOPE, author_id)
+
+
+@receiver(post_save, sender=Tag)
+def tag_renamed(sender, instance, created, raw=False, **kwargs):
+    """Имя тега входит в триграммы его заметок"""
+    if not created and not raw:
+        with sharding.use_db(instance._state.db):
+            trigrams.reindex(instance.notes.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    """Пароль, статус или данные пользователя изменились — сбрасываем кэш"""
+    auth_backends.invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def user_created_shard(sender, instance, created, raw=False, **kwargs):
+    """Новый пользователь получает шард по хешу id"""
+    if created and not raw and sharding.is_enabled():
+        sharding.assign(instance.pk, sharding.hash_shard(instance.pk))
+
+
+@receiver(post_delete, sender=User)
+def user_deleted_shard_data(sender, instance, **kwargs):
+    """Каскад удаления пользователя работает только внутри default: заметки
+    в шардах удаляются после фиксации, чтобы откат не оставил их без данных"""
+    if not sharding.is_enabled():
+        return
+    user_id = instance.pk
+
+    def delete_shard_data():
+        for alias in sharding.shard_aliases():
+            sharding.delete_user_data(user_id, alias)
+
+    transaction.on_commit(delete_shard_data, using=DEFAULT_DB_ALIAS)
+
+
+@receiver(post_migrate)
+def shard_migrated(sender, using, **kwargs):
+    """Диапазон id шарда задается после создания его таблиц"""
+    if sender.name == 'notes':
+        sharding.reserve_id_range(using)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def user_permissions_changed(sender, instance, action, reverse, **kwargs):
+    """Изменились группы или права пользователя"""
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # Изменение со стороны группы или права: затронуто много пользователей
+        auth_backends.invalidate_all()
+    else:
+        auth_backends.invalidate_user(instance.pk)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def group_permissions_changed(sender, action, **kwargs):
+    """Изменились права группы"""
+    if action.startswith('post_'):
+        auth_backends.invalidate_all()
@@ -0,0 +1,109 @@
+"""
+Подсказки для строки поиска.
+Для каждого пользователя в памяти процесса строится отсортированная
+таблица префиксов (слово -> заметка или тег). Поиск по ней — бинарный
+поиск, поэтому ответ не зависит от числа заметок линейно.
+"""
+
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+from .models import Note, Tag
+from .text import WORD_RE, normalize
+from .versions import NOTES_SCOPE, get_version
+
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 20
+MAX_CACHED_INDEXES = 256  # сколько пользователей держим в памяти
+
+
+class PrefixTable:
+    """Отсортированная таблица (ключ, позиция, значение) с поиском по префиксу"""
+
+    def __init__(self, entries):
+        entries = sorted(entries, key=lambda entry: (entry[0], entry[1]))
+        self.keys = [entry[0] for entry in entries]
+        self.values = [entry[2] for entry in entries]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, prefix, limit):
+        """Первые limit различных значений, у ключей которых есть данный префикс"""
+        results = []
+        seen = set()
+        i = bisect_left(self.keys, prefix)
+        while i < len(self.keys) and len(results) < limit:
+            if not self.keys[i].startswith(prefix):
+                break
+            value = self.values[i]
+            if value not in seen:
+                seen.add(value)
+                results.append(value)
+            i += 1
+        return results
+
+
+class PrefixIndex:
+    """Индекс подсказок одного пользователя: заголовки заметок и теги"""
+
+    def __init__(self, notes, tags):
+        """
+        notes — пары (id, заголовок) от новых к старым,
+        tags — названия тегов пользователя.
+        """
+        note_entries = []
+        for rank, (pk, title) in enumerate(notes):
+            value = (pk, title)
+            norm = normalize(title)
+            # Заметку можно найти и по началу заголовка, и по любому его слову
+            for key in {norm, *WORD_RE.findall(norm)}:
+                note_entries.append((key, rank, value))
+        self.notes = PrefixTable(note_entries)
+        self.tags = PrefixTable(
+            (normalize(name), 0, name) for name in tags
+        )
+
+    @classmethod
+    def build(cls, user_id):
+        notes = (
+            Note.objects.filter(author_id=user_id)
+            .order_by('-updated_at')
+            .values_list('pk', 'title')
+        )
+        tags = (
+            Tag.objects.filter(notes__author_id=user_id)
+            .distinct()
+            .values_list('name', flat=True)
+        )
+        return cls(notes.iterator(), tags)
+
+    def suggest(self, query, limit=DEFAULT_LIMIT):
+        prefix = normalize(query.strip())
+        if not prefix:
+            return [], []
+        return self.notes.lookup(prefix, limit), self.tags.lookup(prefix, limit)
+
+
+_indexes = OrderedDict()  # user_id -> (версия, PrefixIndex)
+_lock = threading.Lock()
+
+
+def get_index(user_id):
+    """Индекс пользователя из кэша процесса; перестраивается после изменений заметок"""
+    version = get_version(NOTES_SCOPE, user_id)
+    with _lock:
+        cached = _indexes.get(user_id)
+        if cached is not None and cached[0] == version:
+            _indexes.move_to_end(user_id)
+            return cached[1]
+
+    index = PrefixIndex.build(user_id)
+
+    with _lock:
+        _indexes[user_id] = (version, index)
+        _indexes.move_to_end(user_id)
+        while len(_indexes) > MAX_CACHED_INDEXES:
+            _indexes.popitem(last=False)
+    return index
@@ -0,0 +1,167 @@
+"""
+Фоновые задачи приложения notes (выполняются воркерами run_jobs).
+"""
+
+import json
+import os
+from pathlib import Path
+
+from django.conf import settings
+
+from . import bulk, events, fingerprints, purge, sharding, trigrams
+from .jobs import set_progress, task
+from .models import Note, Tag
+from .versions import NOTES_SCOPE, bump_version, get_version
+
+BATCH_SIZE = 500
+EXPORT_DIR = 'exports'
+IMPORT_DIR = 'imports'
+
+
+def media_path(relative):
+    return Path(settings.MEDIA_ROOT) / relative
+
+
+def _percent(done, total):
+    return 100 * done // total if total else 100
+
+
+@task('export_notes')
+def export_notes(job, user_id):
+    """Выгружает заметки пользователя в JSON-файл"""
+    notes = Note.objects.filter(author_id=user_id).order_by('pk')
+    total = notes.count()
+    relative = f'{EXPORT_DIR}/{job.pk}.json'
+    path = media_path(relative)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    done = 0
+    with open(path, 'w', encoding='utf-8') as output:
+        output.write('{"version": 1, "notes": [')
+        for note in notes.prefetch_related('tags').iterator(chunk_size=BATCH_SIZE):
+            if done:
+                output.write(',')
+            json.dump({
+                'title': note.title,
+                'content': note.content,
+                'tags': [tag.name for tag in note.tags.all()],
+                'created_at': note.created_at.isoformat(),
+                'updated_at': note.updated_at.isoformat(),
+            }, output, ensure_ascii=False)
+            done += 1
+            if done % BATCH_SIZE == 0:
+                set_progress(job, _percent(done, total), f'Выгружено {done} из {total}')
+        output.write(']}')
+    return {'file': relative, 'count': done}
+
+
+class ImportFormatError(ValueError):
+    """Файл импорта не соответствует формату экспорта"""
+
+
+def _import_items(data):
+    """Заметки из файла импорта. Записи без заголовка или текста пропускаются,
+    неверные теги — ошибка всего импорта (до записи в БД)."""
+    items = data.get('notes', []) if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        raise ImportFormatError('Нет списка заметок "notes"')
+    items = [
+        item for item in items
+        if isinstance(item, dict) and item.get('title') and item.get('content')
+    ]
+    for number, item in enumerate(items, 1):
+        tags = item.setdefault('tags', [])
+        if not isinstance(tags, list) or not all(isinstance(name, str) for name in tags):
+            raise ImportFormatError(f'Заметка {number}: теги должны быть списком строк')
+    return items
+
+
+def _tags_by_name(names):
+    names = set(names)
+    Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True)
+    return dict(Tag.objects.filter(name__in=names).values_list('name', 'pk'))
+
+
+@task('import_notes')
+def import_notes(job, user_id, file):
+    """Загружает заметки из JSON-файла (формат экспорта) пачками"""
+    path = media_path(file)
+    try:
+        with open(path, encoding='utf-8') as source:
+            items = _import_items(json.load(source))
+    except (ValueError, UnicodeDecodeError) as error:
+        # Повтор не поможет: сообщение видно на странице задачи
+        os.remove(path)
+        message = str(error) if isinstance(error, ImportFormatError) else 'Файл не является JSON'
+        set_progress(job, 0, f'Ошибка импорта: {message}')
+        raise
+    total = len(items)
+    through = Note.tags.through
+
+    created = 0
+    for start in range(0, total, BATCH_SIZE):
+        batch = items[start:start + BATCH_SIZE]
+        with sharding.atomic():
+            notes = Note.objects.bulk_create([
+                Note(
+                    title=str(item['title'])[:200],
+                    content=str(item['content']),
+                    author_id=user_id,
+                )
+                for item in batch
+            ])
+            tag_ids = _tags_by_name(
+                name[:50] for item in batch for name in item['tags']
+            )
+            through.objects.bulk_create([
+                through(note_id=note.pk, tag_id=tag_ids[name[:50]])
+                for note, item in zip(notes, batch)
+                for name in item['tags']
+            ], ignore_conflicts=True)
+        # bulk_create не отправляет сигналы — триграммы считаем сами
+        trigrams.reindex(note.pk for note in notes)
+        created += len(notes)
+        set_progress(job, _percent(created, total), f'Загружено {created} из {total}')
+
+    fingerprints.backfill(Note.objects.filter(author_id=user_id))
+    bump_version(NOTES_SCOPE, user_id)
+    events.publish_reload(user_id)
+    os.remove(path)
+    return {'count': created}
+
+
+@task(fingerprints.JOB_KIND)
+def fingerprint_notes(job, user_id):
+    """Пересчитывает отпечатки и группы дубликатов. Группы сохраняются в
+    результате вместе с версией заметок, по которой они посчитаны."""
+    version = get_version(NOTES_SCOPE, user_id)
+    created = fingerprints.backfill(
+        Note.objects.filter(author_id=user_id),
+        progress=lambda done: set_progress(job, 0, f'Создано отпечатков: {done}'),
+    )
+    set_progress(job, 50, 'Поиск дубликатов')
+    groups = fingerprints.duplicate_groups(user_id)
+    return {
+        'created': created,
+        'version': version,
+        'groups': groups[:fingerprints.MAX_STORED_GROUPS],
+    }
+
+
+@task('bulk_notes')
+def bulk_notes(job, user_id, action, ids, tag_id=None):
+    """Массовое действие над большой выборкой заметок, пачками"""
+    def progress(done, total):
+        set_progress(job, _percent(done, total), f'Обработано {done} из {total}')
+
+    count = bulk.apply_in_chunks(action, user_id, ids, tag_id, progress)
+    return {'count': count}
+
+
+@task('delete_account')
+def delete_account(job, user_id):
+    """Удаляет аккаунт: заметки небольшими транзакциями, затем пользователя"""
+    def progress(done, total):
+        set_progress(job, _percent(done, total), f'Удалено заметок: {done} из {total}')
+
+    return {'deleted_notes': purge.delete_account(user_id, progress)}
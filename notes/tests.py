@@ -1,17 +1,44 @@
 """
 Тесты для приложения notes.
-Запуск тестов: python manage.py test notes
+Запуск тестов: python manage.py test notes --settings=config.test_settings
+С шардированием: NOTES_SHARDS=2 python manage.py test notes --settings=config.test_settings
+Без config.test_settings тесты переноса между шардами пропускаются.
 """
 
-from django.test import TestCase, Client
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.db import connection, connections
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.contrib.auth.models import User
-from .models import Note
+from . import sharding
+from .models import Note, Tag
 from .forms import NoteForm
+from .attachments import HAS_PILLOW
+
+TEST_SHARD = 'shard_1'
+# Базы шардов создает config.test_settings
+HAS_SHARD_DATABASES = TEST_SHARD in settings.DATABASES
+
+
+@override_settings(NOTES_VERSION_LOCAL_TTL=0)
+class NotesTestCase(TestCase):
+    """Тесты работают и с шардами: пользователи тестов получают один шард
+    (не default), а данные, созданные в тесте напрямую, пишутся в него же.
+    Версии данных читаются из таблицы каждый раз: она откатывается после теста"""
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        if sharding.is_enabled():
+            cls.enterClassContext(mock.patch.object(sharding, 'hash_shard', return_value=TEST_SHARD))
+            cls.enterClassContext(sharding.use_db(TEST_SHARD))
 
 # ==================== МОДЕЛИ ====================
 
-class NoteModelTest(TestCase):
+class NoteModelTest(NotesTestCase):
     """Тестирование модели Note"""
 
     def setUp(self):
@@ -80,7 +107,7 @@ class NoteModelTest(TestCase):
 
 # ==================== ФОРМЫ ====================
 
-class NoteFormTest(TestCase):
+class NoteFormTest(NotesTestCase):
     """Тестирование форм"""
 
     def test_valid_form(self):
@@ -143,7 +170,8 @@ class NoteFormTest(TestCase):
 
 # ==================== ПРЕДСТАВЛЕНИЯ ====================
 
-class ViewTests(TestCase):
+@override_settings(NOTES_PROCESS_WORKERS=0)
+class ViewTests(NotesTestCase):
     """Тестирование представлений"""
 
     def setUp(self):
@@ -366,7 +394,7 @@ class ViewTests(TestCase):
 
 # ==================== ИНТЕГРАЦИОННЫЕ ТЕСТЫ ====================
 
-class IntegrationTests(TestCase):
+class IntegrationTests(NotesTestCase):
     """Интеграционные тесты (сквозные сценарии)"""
 
     def setUp(self):
@@ -443,7 +471,7 @@ class IntegrationTests(TestCase):
 
 # ==================== API ТЕСТЫ (если будет API) ====================
 
-class APITests(TestCase):
+class APITests(NotesTestCase):
     """Тесты для API (если будет добавлено)"""
 
     def setUp(self):
@@ -466,7 +494,8 @@ class APITests(TestCase):
 
 # ==================== ТЕСТЫ БЕЗОПАСНОСТИ ====================
 
-class SecurityTests(TestCase):
+@override_settings(NOTES_PROCESS_WORKERS=0)
+class SecurityTests(NotesTestCase):
     """Тесты безопасности"""
 
     def setUp(self):
@@ -527,7 +556,7 @@ class SecurityTests(TestCase):
 
 # ==================== ТЕСТЫ ПРОИЗВОДИТЕЛЬНОСТИ ====================
 
-class PerformanceTests(TestCase):
+class PerformanceTests(NotesTestCase):
     """Тесты производительности (базовые)"""
 
     def setUp(self):
@@ -562,6 +591,2355 @@ class PerformanceTests(TestCase):
         print(f"Время выполнения списка 100 заметок: {execution_time:.3f} сек")
 
 
+# ==================== ПОДСКАЗКИ ПОИСКА ====================
+
+class SuggestTests(NotesTestCase):
+    """Тесты подсказок для строки поиска"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='suggestuser',
+            password='suggestpass123'
+        )
+        self.other_user = User.objects.create_user(
+            username='otheruser',
+            password='otherpass123'
+        )
+        self.note = Note.objects.create(
+            title='Ёлка на праздник',
+            content='Купить игрушки',
+            author=self.user
+        )
+        Note.objects.create(
+            title='Елки-палки чужие',
+            content='Чужое содержание',
+            author=self.other_user
+        )
+        self.client.login(username='suggestuser', password='suggestpass123')
+
+    def test_suggest_by_title_prefix(self):
+        """Подсказка по началу заголовка и по слову внутри него"""
+        response = self.client.get(reverse('note_suggest'), {'q': 'елк'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(
+            data['notes'],
+            [{'title': 'Ёлка на праздник', 'url': self.note.get_absolute_url()}]
+        )
+
+        response = self.client.get(reverse('note_suggest'), {'q': 'праз'})
+        self.assertEqual(len(response.json()['notes']), 1)
+
+    def test_suggest_tags(self):
+        """Подсказки по тегам заметок пользователя"""
+        tag = Tag.objects.create(name='праздники')
+        self.note.tags.add(tag)
+
+        response = self.client.get(reverse('note_suggest'), {'q': 'праз'})
+        self.assertEqual([t['name'] for t in response.json()['tags']], ['праздники'])
+
+    def test_suggest_index_invalidated_on_save(self):
+        """Индекс перестраивается после изменения заметок"""
+        self.client.get(reverse('note_suggest'), {'q': 'нов'})
+        Note.objects.create(title='Новая идея', content='Содержание идеи', author=self.user)
+
+        response = self.client.get(reverse('note_suggest'), {'q': 'нов'})
+        self.assertEqual([n['title'] for n in response.json()['notes']], ['Новая идея'])
+
+    def test_versions_shared_without_shared_cache(self):
+        """С кэшем в памяти процесса версии хранятся в БД и видны другим процессам"""
+        from django.core.cache import cache
+        from .models import DataVersion
+        from .versions import NOTES_SCOPE, bump_version, get_version
+
+        version = get_version(NOTES_SCOPE, self.user.pk)
+        bump_version(NOTES_SCOPE, self.user.pk)
+        cache.clear()  # кэш другого процесса этой версии не видел
+        self.assertEqual(get_version(NOTES_SCOPE, self.user.pk), version + 1)
+        self.assertTrue(DataVersion.objects.filter(key__endswith=f':{self.user.pk}').exists())
+
+    @override_settings(NOTES_VERSION_LOCAL_TTL=60)
+    def test_version_remembered_by_process(self):
+        """Версию из таблицы процесс помнит NOTES_VERSION_LOCAL_TTL секунд,
+        свои изменения видит сразу"""
+        from django.db.models import F
+        from .models import DataVersion
+        from .versions import NOTES_SCOPE, _local_versions, bump_version, get_version
+
+        self.addCleanup(_local_versions.clear)
+        version = get_version(NOTES_SCOPE, self.user.pk)
+        with self.assertNumQueries(0, using='default'):
+            self.assertEqual(get_version(NOTES_SCOPE, self.user.pk), version)
+
+        # Другой процесс увеличил версию: здесь это видно после TTL
+        DataVersion.objects.filter(key__endswith=f':{self.user.pk}').update(version=F('version') + 1)
+        self.assertEqual(get_version(NOTES_SCOPE, self.user.pk), version)
+        with self.settings(NOTES_VERSION_LOCAL_TTL=0):
+            self.assertEqual(get_version(NOTES_SCOPE, self.user.pk), version + 1)
+
+        bump_version(NOTES_SCOPE, self.user.pk)
+        self.assertEqual(get_version(NOTES_SCOPE, self.user.pk), version + 2)
+
+    def test_suggest_empty_query(self):
+        """Пустой запрос не возвращает подсказок"""
+        response = self.client.get(reverse('note_suggest'), {'q': '  '})
+        self.assertEqual(response.json()['notes'], [])
+        self.assertEqual(response.json()['tags'], [])
+
+    def test_prefix_index_lookup_speed(self):
+        """Поиск по префиксу на 100 000 заметок укладывается в миллисекунды"""
+        import time
+        from .suggest import PrefixIndex
+
+        index = PrefixIndex(
+            ((i, f'Заметка номер {i} про проект {i % 1000}') for i in range(100000)),
+            [f'тег{i}' for i in range(1000)],
+        )
+
+        prefixes = ('з', 'заме', 'про', 'проект', '99', 'тег1')
+        start_time = time.perf_counter()
+        results = [index.suggest(prefix) for prefix in prefixes]
+        execution_time = (time.perf_counter() - start_time) / len(prefixes)
+
+        self.assertEqual(len(results[1][0]), 8)
+        self.assertEqual(len(results[-1][1]), 8)
+        self.assertLess(execution_time, 0.005)
+        print(f"Подсказка на 100000 заметок: {execution_time * 1000:.3f} мс")
+
+
+# ==================== ПОХОЖИЕ ЗАМЕТКИ ====================
+
+@override_settings(NOTES_PROCESS_WORKERS=0)
+class RelatedNotesTests(NotesTestCase):
+    """Тесты рекомендаций похожих заметок"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='relateduser',
+            password='relatedpass123'
+        )
+        self.other_user = User.objects.create_user(
+            username='otheruser',
+            password='otherpass123'
+        )
+        self.python_note = Note.objects.create(
+            title='Изучение Python',
+            content='Списки, словари и генераторы в Python',
+            author=self.user
+        )
+        self.python_note2 = Note.objects.create(
+            title='Python генераторы',
+            content='Генераторы и итераторы в Python подробно',
+            author=self.user
+        )
+        self.recipe = Note.objects.create(
+            title='Рецепт борща',
+            content='Свекла, капуста, картофель и морковь',
+            author=self.user
+        )
+        self.foreign = Note.objects.create(
+            title='Python чужой',
+            content='Генераторы Python другого пользователя',
+            author=self.other_user
+        )
+        self.client.login(username='relateduser', password='relatedpass123')
+
+    def test_related_notes_on_detail(self):
+        """На странице заметки показываются похожие заметки только автора"""
+        response = self.client.get(reverse('note_detail', args=[self.python_note.pk]))
+
+        self.assertEqual(response.status_code, 200)
+        related = response.context['related_notes']
+        self.assertEqual(related, [self.python_note2])
+        self.assertContains(response, 'Похожие заметки')
+
+    def test_related_index_updated_after_save(self):
+        """После сохранения заметки индекс перестраивается"""
+        self.client.get(reverse('note_detail', args=[self.recipe.pk]))
+        Note.objects.create(
+            title='Борщ постный',
+            content='Свекла и капуста без мяса',
+            author=self.user
+        )
+
+        response = self.client.get(reverse('note_detail', args=[self.recipe.pk]))
+        titles = [note.title for note in response.context['related_notes']]
+        self.assertEqual(titles, ['Борщ постный'])
+
+    def test_related_index_updated_incrementally(self):
+        """Изменение и удаление заметки заменяют только ее строку индекса"""
+        from . import related
+
+        related._indexes.pop(self.user.pk, None)  # id пользователей повторяются между тестами
+        related.get_index(self.user.pk)
+        self.recipe.content = 'Генераторы и словари в Python'
+        self.recipe.save()
+        self.python_note.delete()
+
+        with mock.patch.object(related, 'REBUILD_RATIO', 1), \
+                mock.patch.object(related.RelatedIndex, 'build', side_effect=AssertionError):
+            index = related.get_index(self.user.pk)
+        self.assertEqual(sorted(index.positions), sorted([self.python_note2.pk, self.recipe.pk]))
+        self.assertEqual([pk for pk, score in index.similar(self.recipe.pk)], [self.python_note2.pk])
+
+    def test_similarity_scores(self):
+        """Косинусная близость: идентичные тексты ближе непохожих"""
+        from .related import RelatedIndex
+
+        index = RelatedIndex.build([
+            (1, 'кошки и собаки дома'),
+            (2, 'кошки и собаки дома'),
+            (3, 'квантовая механика частиц'),
+        ])
+        results = index.similar(1)
+
+        self.assertEqual(results[0][0], 2)
+        self.assertAlmostEqual(results[0][1], 1.0, places=5)
+        self.assertNotIn(3, [pk for pk, score in results])
+        self.assertEqual(index.similar(404), [])
+
+    def test_related_index_speed(self):
+        """Поиск похожих среди 20 000 заметок — один векторный проход"""
+        import time
+        import random
+        from .related import RelatedIndex
+
+        rng = random.Random(42)
+        vocabulary = [f'слово{i}' for i in range(5000)]
+        documents = [
+            (i, ' '.join(rng.choice(vocabulary) for _ in range(60)))
+            for i in range(20000)
+        ]
+        index = RelatedIndex.build(documents)
+
+        start_time = time.perf_counter()
+        for pk in range(10):
+            index.similar(pk)
+        execution_time = (time.perf_counter() - start_time) / 10
+
+        self.assertLess(execution_time, 0.1)
+        print(f"Похожие заметки среди 20000: {execution_time * 1000:.2f} мс")
+
+
+# ==================== ДУБЛИКАТЫ ====================
+
+class DuplicateTests(NotesTestCase):
+    """Тесты поиска и объединения почти-дубликатов"""
+
+    TEXT = ('Список покупок на неделю: молоко, хлеб, сыр, яблоки, '
+            'гречка, курица, помидоры, огурцы и зеленый чай')
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='dupuser',
+            password='duppass123'
+        )
+        self.note = Note.objects.create(title='Покупки', content=self.TEXT, author=self.user)
+        self.copy = Note.objects.create(title='Покупки', content=self.TEXT + '!', author=self.user)
+        self.other = Note.objects.create(
+            title='Отпуск',
+            content='Забронировать отель у моря и купить билеты на поезд',
+            author=self.user
+        )
+        self.client.login(username='dupuser', password='duppass123')
+
+    def test_fingerprint_created_on_save(self):
+        """Отпечаток создается и обновляется при сохранении заметки"""
+        from .models import NoteFingerprint
+        from . import fingerprints
+
+        fingerprint = NoteFingerprint.objects.get(note=self.note)
+        self.assertEqual(
+            fingerprints.to_unsigned(fingerprint.simhash),
+            fingerprints.simhash(fingerprints.note_text(self.note.title, self.note.content))
+        )
+
+        self.note.content = 'Совсем другой текст заметки'
+        self.note.save()
+        fingerprint.refresh_from_db()
+        self.assertEqual(
+            fingerprints.bands(fingerprints.to_unsigned(fingerprint.simhash)),
+            [fingerprint.band_0, fingerprint.band_1, fingerprint.band_2, fingerprint.band_3]
+        )
+
+    def test_duplicate_groups(self):
+        """Почти одинаковые заметки попадают в одну группу"""
+        from . import fingerprints
+
+        groups = fingerprints.duplicate_groups(self.user.pk)
+        self.assertEqual(groups, [sorted([self.note.pk, self.copy.pk])])
+        self.assertEqual(fingerprints.find_duplicates(self.note), [self.copy.pk])
+
+    def test_large_buckets_compared(self):
+        """Большие корзины сравниваются блоками и дают те же группы"""
+        from . import fingerprints
+
+        expected = fingerprints.duplicate_groups(self.user.pk)
+        with mock.patch.object(fingerprints, 'MAX_BUCKET_SIZE', 1):
+            self.assertEqual(fingerprints.duplicate_groups(self.user.pk), expected)
+
+    def test_many_identical_notes_grouped(self):
+        """Точные копии сверх MAX_BUCKET_SIZE (например, после импорта) — одна группа"""
+        from . import fingerprints
+
+        count = fingerprints.MAX_BUCKET_SIZE + 50
+        copies = Note.objects.bulk_create([
+            Note(title='Отпуск', content='Забронировать отель у моря и купить билеты на поезд',
+                 author=self.user)
+            for _ in range(count)
+        ])
+        fingerprints.backfill(Note.objects.filter(author=self.user))
+
+        groups = fingerprints.duplicate_groups(self.user.pk)
+        self.assertEqual(len(groups), 2)
+        self.assertIn(sorted([self.other.pk] + [note.pk for note in copies]), groups)
+
+    def test_disjoint_set_long_chain(self):
+        """Длинная цепочка объединений не упирается в глубину рекурсии"""
+        from .fingerprints import _DisjointSet
+
+        groups = _DisjointSet()
+        for item in range(10000):
+            groups.union(item, item + 1)
+        self.assertEqual(groups.find(0), groups.find(10000))
+
+    def test_duplicates_view(self):
+        """Страница показывает группы, посчитанные в фоне, а не считает их сама"""
+        from . import jobs
+
+        with mock.patch('notes.fingerprints.duplicate_groups') as compute:
+            response = self.client.get(reverse('note_duplicates'))
+        compute.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'notes/note_duplicates.html')
+        self.assertEqual(response.context['duplicate_groups'], [])
+        self.assertFalse(response.context['groups_current'])
+
+        # Повторный заход не ставит задачу второй раз
+        self.client.get(reverse('note_duplicates'))
+        self.assertEqual(jobs.run_pending(), 1)
+
+        response = self.client.get(reverse('note_duplicates'))
+        self.assertTrue(response.context['groups_current'])
+        self.assertEqual(len(response.context['duplicate_groups']), 1)
+        self.assertNotContains(response, 'Отпуск')
+
+    def test_merge_all_requires_current_groups(self):
+        """Устаревшие группы не объединяются целиком"""
+        from . import jobs
+
+        self.client.get(reverse('note_duplicates'))
+        jobs.run_pending()
+        self.note.save()
+
+        self.client.post(reverse('note_duplicates_merge'), {'merge_all': '1'})
+        self.assertEqual(Note.objects.filter(author=self.user).count(), 3)
+
+    def test_merge_duplicates(self):
+        """Объединение: теги переносятся, дубликат удаляется"""
+        tag = Tag.objects.create(name='покупки')
+        self.copy.tags.add(tag)
+
+        response = self.client.post(reverse('note_duplicates_merge'), {
+            'keep': self.note.pk,
+            'merge': [self.note.pk, self.copy.pk],
+        })
+
+        self.assertRedirects(response, reverse('note_duplicates'))
+        self.assertFalse(Note.objects.filter(pk=self.copy.pk).exists())
+        self.assertEqual(list(self.note.tags.all()), [tag])
+
+    def test_merge_counts_only_notes(self):
+        """Число объединенных — заметки, без каскадных строк тегов и индексов"""
+        from . import fingerprints, trigrams
+        from .models import NoteFingerprint, TrigramPosting
+
+        tag = Tag.objects.create(name='покупки')
+        third = Note.objects.create(title='Покупки', content=self.TEXT + '?', author=self.user)
+        for note in (self.copy, third):
+            note.tags.add(tag)
+        trigrams.reindex([self.copy.pk, third.pk])
+        self.assertTrue(TrigramPosting.objects.filter(note=third).exists())
+        self.assertTrue(NoteFingerprint.objects.filter(note=third).exists())
+
+        self.assertEqual(fingerprints.merge_notes(self.note, [self.copy, third]), 2)
+
+    def test_merge_all_and_foreign_notes(self):
+        """Объединение всех групп не затрагивает чужие заметки"""
+        from . import fingerprints, jobs
+
+        other_user = User.objects.create_user(username='otheruser', password='otherpass123')
+        foreign = Note.objects.create(title='Покупки', content=self.TEXT, author=other_user)
+        jobs.enqueue(fingerprints.JOB_KIND, user=self.user, user_id=self.user.pk)
+        jobs.run_pending()
+
+        self.client.post(reverse('note_duplicates_merge'), {'merge_all': '1'})
+
+        self.assertEqual(Note.objects.filter(author=self.user).count(), 2)
+        self.assertTrue(Note.objects.filter(pk=foreign.pk).exists())
+
+
+# ==================== ФОНОВЫЕ ЗАДАЧИ ====================
+
+class JobQueueTests(NotesTestCase):
+    """Тесты очереди фоновых задач"""
+
+    def setUp(self):
+        import tempfile
+        self.media_dir = tempfile.TemporaryDirectory()
+        self.media_override = override_settings(MEDIA_ROOT=self.media_dir.name)
+        self.media_override.enable()
+
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='jobuser',
+            password='jobpass123'
+        )
+        self.note = Note.objects.create(
+            title='Заметка для экспорта',
+            content='Содержание для экспорта',
+            author=self.user
+        )
+        self.note.tags.add(Tag.objects.create(name='экспорт'))
+        self.client.login(username='jobuser', password='jobpass123')
+
+    def tearDown(self):
+        self.media_override.disable()
+        self.media_dir.cleanup()
+
+    def test_priority_and_retries(self):
+        """Задачи берутся по приоритету, упавшая задача повторяется"""
+        from . import jobs
+        from .models import Job
+
+        calls = []
+
+        self.addCleanup(jobs.TASKS.pop, 'test_flaky')
+
+        @jobs.task('test_flaky')
+        def flaky(job, name):
+            calls.append(name)
+            if job.attempts < 2:
+                raise RuntimeError('сбой')
+            return {'name': name}
+
+        low = jobs.enqueue('test_flaky', name='low')
+        high = jobs.enqueue('test_flaky', priority=5, name='high')
+
+        with override_settings(NOTES_JOBS_RETRY_DELAY=0):
+            jobs.run_pending()
+
+        self.assertEqual(calls[0], 'high')
+        high.refresh_from_db()
+        low.refresh_from_db()
+        self.assertEqual(high.status, Job.STATUS_DONE)
+        self.assertEqual(high.attempts, 2)
+        self.assertEqual(high.result, {'name': 'high'})
+        self.assertEqual(low.status, Job.STATUS_DONE)
+
+    def test_failed_after_max_attempts(self):
+        """После исчерпания попыток задача помечается как ошибочная"""
+        from . import jobs
+        from .models import Job
+
+        self.addCleanup(jobs.TASKS.pop, 'test_broken')
+
+        @jobs.task('test_broken')
+        def broken(job):
+            raise RuntimeError('всегда сбой')
+
+        job = jobs.enqueue('test_broken', max_attempts=1)
+        jobs.run_pending()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_FAILED)
+        self.assertIn('всегда сбой', job.error)
+
+    def test_export_and_import(self):
+        """Экспорт в файл и импорт из него через очередь"""
+        import json
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from . import jobs
+        from .models import Job
+
+        response = self.client.post(reverse('note_export'))
+        job = Job.objects.get(kind='export_notes')
+        self.assertRedirects(response, job.get_absolute_url())
+
+        jobs.run_pending()
+        response = self.client.get(reverse('job_download', args=[job.pk]))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data['notes'][0]['tags'], ['экспорт'])
+
+        upload = SimpleUploadedFile('notes.json', json.dumps(data).encode('utf-8'))
+        self.client.post(reverse('note_import'), {'file': upload})
+        jobs.run_pending()
+
+        self.assertEqual(Note.objects.filter(title='Заметка для экспорта').count(), 2)
+        imported = Note.objects.filter(title='Заметка для экспорта').latest('pk')
+        self.assertEqual([tag.name for tag in imported.tags.all()], ['экспорт'])
+        self.assertTrue(hasattr(imported, 'fingerprint'))
+
+    def test_import_rejects_invalid_tags(self):
+        """Теги не строками — ошибка импорта, заметки не создаются"""
+        import json
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from . import jobs
+        from .models import Job
+
+        data = {'notes': [
+            {'title': 'Первая', 'content': 'Текст', 'tags': ['ок']},
+            {'title': 'Вторая', 'content': 'Текст', 'tags': [1, None]},
+        ]}
+        upload = SimpleUploadedFile('notes.json', json.dumps(data).encode('utf-8'))
+        self.client.post(reverse('note_import'), {'file': upload})
+        jobs.run_pending()
+
+        job = Job.objects.get(kind='import_notes')
+        self.assertEqual(job.status, Job.STATUS_FAILED)
+        self.assertIn('Заметка 2: теги должны быть списком строк', job.message)
+        self.assertFalse(Note.objects.filter(title='Первая').exists())
+
+    def test_stale_jobs_requeued_by_heartbeat(self):
+        """Задачи без пульса возвращаются в очередь, исчерпавшие попытки — ошибка"""
+        from datetime import timedelta
+        from django.utils import timezone
+        from . import jobs
+        from .models import Job
+
+        silent, exhausted, alive = (
+            jobs.enqueue('export_notes', user_id=self.user.pk, max_attempts=max_attempts)
+            for max_attempts in (3, 1, 3)
+        )
+        for _ in range(3):
+            jobs.claim('worker')
+        long_ago = timezone.now() - timedelta(seconds=jobs.stale_timeout() + 1)
+        Job.objects.filter(pk__in=[silent.pk, exhausted.pk]).update(locked_at=long_ago)
+        alive.locked_by = 'worker'
+        jobs.set_progress(alive, 10)
+
+        self.assertEqual(jobs.requeue_stale(), (1, 1))
+        statuses = dict(Job.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[silent.pk], Job.STATUS_PENDING)
+        self.assertEqual(statuses[exhausted.pk], Job.STATUS_FAILED)
+        self.assertEqual(statuses[alive.pk], Job.STATUS_RUNNING)
+
+    def test_requeued_job_not_finished_by_old_worker(self):
+        """Воркер, у которого задачу отобрали, не перезаписывает ее"""
+        from . import jobs
+        from .models import Job
+
+        self.addCleanup(jobs.TASKS.pop, 'test_slow')
+
+        @jobs.task('test_slow')
+        def slow(job):
+            jobs.requeue_stale(timeout=-1)  # пульс пропал, пока задача работала
+            jobs.set_progress(job, 50)
+            return {'done': True}
+
+        job = jobs.enqueue('test_slow')
+        jobs.run(jobs.claim('worker'))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_PENDING)
+        self.assertIsNone(job.result)
+
+    def test_job_status_page(self):
+        """Страница статуса доступна только владельцу задачи"""
+        from . import jobs
+
+        job = jobs.enqueue('export_notes', user=self.user, user_id=self.user.pk)
+        response = self.client.get(reverse('job_detail', args=[job.pk]), {'format': 'json'})
+        self.assertEqual(response.json()['status'], 'pending')
+
+        User.objects.create_user(username='otheruser', password='otherpass123')
+        self.client.login(username='otheruser', password='otherpass123')
+        response = self.client.get(reverse('job_detail', args=[job.pk]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_account_delete(self):
+        """Удаление аккаунта: пользователь блокируется, данные удаляются воркером"""
+        from . import jobs
+
+        response = self.client.post(reverse('account_delete'))
+        self.assertRedirects(response, reverse('login'))
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+
+        jobs.run_pending()
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(Note.objects.filter(pk=self.note.pk).exists())
+
+
+# ==================== МАССОВЫЕ ДЕЙСТВИЯ ====================
+
+class BulkActionTests(NotesTestCase):
+    """Тесты массовых действий над заметками"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='bulkuser',
+            password='bulkpass123'
+        )
+        self.other_user = User.objects.create_user(
+            username='otheruser',
+            password='otherpass123'
+        )
+        self.notes = [
+            Note.objects.create(title=f'Заметка {i}', content=f'Текст {i}', author=self.user)
+            for i in range(5)
+        ]
+        self.python_note = Note.objects.create(
+            title='Про Python', content='Python и Django', author=self.user
+        )
+        self.foreign = Note.objects.create(
+            title='Чужая заметка', content='Python чужой', author=self.other_user
+        )
+        self.client.login(username='bulkuser', password='bulkpass123')
+
+    def post(self, **data):
+        data.setdefault('next', reverse('note_list'))
+        return self.client.post(reverse('note_bulk'), data)
+
+    def test_bulk_delete_selected(self):
+        """Удаление выбранных заметок; чужие id игнорируются"""
+        ids = [self.notes[0].pk, self.notes[1].pk, self.foreign.pk]
+        response = self.post(action='delete', ids=ids)
+
+        self.assertRedirects(response, reverse('note_list'))
+        self.assertEqual(Note.objects.filter(author=self.user).count(), 4)
+        self.assertTrue(Note.objects.filter(pk=self.foreign.pk).exists())
+
+    def test_bulk_add_and_remove_tag(self):
+        """Добавление и удаление тега у выбранных заметок"""
+        ids = [note.pk for note in self.notes[:3]]
+        self.post(action='add_tag', ids=ids, tag='важное')
+
+        tag = Tag.objects.get(name='важное')
+        self.assertEqual(tag.notes.count(), 3)
+
+        self.post(action='remove_tag', ids=ids[:2], tag='важное')
+        self.assertEqual(list(tag.notes.all()), [self.notes[2]])
+
+    def test_bulk_archive_hides_notes(self):
+        """Заметки в архиве не показываются в списке"""
+        from .models import ArchivedNote
+
+        self.post(action='archive', ids=[self.python_note.pk])
+
+        self.assertFalse(Note.objects.filter(pk=self.python_note.pk).exists())
+        self.assertTrue(ArchivedNote.objects.filter(pk=self.python_note.pk).exists())
+        response = self.client.get(reverse('note_list'))
+        self.assertNotContains(response, 'Про Python')
+
+    def test_bulk_select_all_matching_query(self):
+        """«Все найденные» применяется ко всем результатам поиска"""
+        self.post(action='delete', select_all='1', q='Python')
+
+        self.assertFalse(Note.objects.filter(pk=self.python_note.pk).exists())
+        self.assertEqual(Note.objects.filter(author=self.user).count(), 5)
+        self.assertTrue(Note.objects.filter(pk=self.foreign.pk).exists())
+
+    def test_bulk_tag_is_set_based(self):
+        """Число запросов не зависит от числа выбранных заметок"""
+        from . import bulk
+
+        tag = Tag.objects.create(name='пакет')
+        ids = [note.pk for note in self.notes]
+        # 4 запроса на само действие и 6 на пересчет триграмм тегов
+        with mock.patch.object(bulk, 'bump_version') as bump_version, \
+                self.assertNumQueries(10, using=sharding.current_db()):
+            bulk.apply(bulk.ACTION_ADD_TAG, self.user.pk, ids, tag.pk)
+        bump_version.assert_called_once()
+        self.assertEqual(tag.notes.count(), 5)
+
+    def test_large_selection_goes_to_background(self):
+        """Большая выборка обрабатывается фоновой задачей пачками"""
+        from unittest import mock
+        from . import bulk, jobs
+        from .models import Job
+
+        with mock.patch.object(bulk, 'SYNC_LIMIT', 2), mock.patch.object(bulk, 'CHUNK_SIZE', 2):
+            response = self.post(action='archive', select_all='1')
+            job = Job.objects.get(kind='bulk_notes')
+            self.assertRedirects(response, job.get_absolute_url())
+            jobs.run_pending()
+
+        job.refresh_from_db()
+        self.assertEqual(job.result, {'count': 6})
+        self.assertEqual(Note.objects.filter(author=self.user).count(), 0)
+
+
+# ==================== АРХИВ ====================
+
+@override_settings(NOTES_PROCESS_WORKERS=0)
+class ArchiveTests(NotesTestCase):
+    """Перенос старых заметок в архив и восстановление при открытии"""
+
+    def setUp(self):
+        from datetime import timedelta
+        from django.utils import timezone
+
+        self.client = Client()
+        self.user = User.objects.create_user(username='archiver', password='pass12345')
+        self.client.login(username='archiver', password='pass12345')
+        self.tag = Tag.objects.create(name='старое')
+
+        long_ago = timezone.now() - timedelta(days=400)
+        self.old_note = Note.objects.create(
+            title='Старая заметка', content='Очень давний текст ' * 50, author=self.user
+        )
+        self.old_note.tags.add(self.tag)
+        self.viewed_note = Note.objects.create(
+            title='Давняя, но открытая', content='Текст', author=self.user
+        )
+        self.fresh_note = Note.objects.create(
+            title='Свежая заметка', content='Текст', author=self.user
+        )
+        Note.objects.filter(pk__in=[self.old_note.pk, self.viewed_note.pk]).update(
+            created_at=long_ago, updated_at=long_ago
+        )
+        Note.objects.filter(pk=self.viewed_note.pk).update(last_viewed_at=timezone.now())
+
+    def test_archive_stale_notes(self):
+        """Архивируются только давно не открытые и не измененные заметки"""
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import ArchivedNote
+
+        call_command('archive_notes', months=6, stdout=StringIO())
+
+        self.assertFalse(Note.objects.filter(pk=self.old_note.pk).exists())
+        self.assertTrue(Note.objects.filter(pk=self.viewed_note.pk).exists())
+        self.assertTrue(Note.objects.filter(pk=self.fresh_note.pk).exists())
+
+        archived = ArchivedNote.objects.get(pk=self.old_note.pk)
+        self.assertEqual(archived.tag_names, ['старое'])
+        self.assertLess(len(archived.content_compressed), len(self.old_note.content))
+
+    def test_archived_notes_leave_working_set(self):
+        """Архивные заметки не попадают в список и поиск, но видны в архиве"""
+        from . import archive
+
+        archive.archive_notes(archive.stale_notes(6))
+
+        response = self.client.get(reverse('note_list'))
+        self.assertNotContains(response, 'Старая заметка')
+        response = self.client.get(reverse('note_search'), {'q': 'давний'})
+        self.assertNotContains(response, 'Старая заметка')
+
+        response = self.client.get(reverse('archive_list'))
+        self.assertContains(response, 'Старая заметка')
+        self.assertNotContains(response, 'Свежая заметка')
+
+    def test_open_restores_note(self):
+        """Открытие архивной заметки возвращает ее с тем же id, тегами и датами"""
+        from . import archive
+        from .models import ArchivedNote
+
+        archive.archive_notes(archive.stale_notes(6))
+        response = self.client.get(reverse('note_detail', args=[self.old_note.pk]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Очень давний текст')
+        self.assertFalse(ArchivedNote.objects.exists())
+        note = Note.objects.get(pk=self.old_note.pk)
+        self.assertEqual(list(note.tags.all()), [self.tag])
+        self.assertEqual(note.created_at, Note.objects.get(pk=self.viewed_note.pk).created_at)
+        self.assertIsNotNone(note.last_viewed_at)
+
+    def test_other_user_cannot_restore(self):
+        """Чужую архивную заметку нельзя открыть"""
+        from . import archive
+        from .models import ArchivedNote
+
+        archive.archive_notes(archive.stale_notes(6))
+        User.objects.create_user(username='stranger', password='pass12345')
+        self.client.login(username='stranger', password='pass12345')
+
+        response = self.client.get(reverse('note_detail', args=[self.old_note.pk]))
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(ArchivedNote.objects.filter(pk=self.old_note.pk).exists())
+
+
+# ==================== MARKDOWN ====================
+
+@override_settings(NOTES_PROCESS_WORKERS=0)
+class MarkdownTests(NotesTestCase):
+    """Markdown рендерится один раз и хранится вместе с хешем текста"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='mduser', password='pass12345')
+        self.client.login(username='mduser', password='pass12345')
+
+    def test_rendered_on_save(self):
+        """HTML готов сразу после сохранения и обновляется при правке"""
+        note = Note.objects.create(title='MD', content='# Заголовок\n\n**жирный**', author=self.user)
+        self.assertIn('<h1>Заголовок</h1>', note.content_html)
+        self.assertIn('<strong>жирный</strong>', note.content_html)
+
+        note.content = '*курсив*'
+        note.save()
+        note.refresh_from_db()
+        self.assertEqual(note.content_html, '<p><em>курсив</em></p>')
+
+    def test_detail_serves_stored_html(self):
+        """Страница отдает сохраненный HTML, не рендеря заново"""
+        from unittest import mock
+        from . import markup
+
+        note = Note.objects.create(title='MD', content='- один\n- два', author=self.user)
+        with mock.patch.object(markup, 'render', side_effect=AssertionError('повторный рендер')):
+            response = self.client.get(reverse('note_detail', args=[note.pk]))
+        self.assertContains(response, '<li>один</li>', html=True)
+
+    def test_lazy_render_for_bulk_created(self):
+        """Заметки, созданные в обход save, рендерятся при первом просмотре"""
+        Note.objects.bulk_create([Note(title='Импорт', content='`код`', author=self.user)])
+        note = Note.objects.get(title='Импорт')
+        self.assertEqual(note.content_hash, '')
+
+        response = self.client.get(reverse('note_detail', args=[note.pk]))
+        self.assertContains(response, '<code>код</code>')
+        note.refresh_from_db()
+        self.assertNotEqual(note.content_hash, '')
+
+    def test_unsafe_markup_is_neutralized(self):
+        """Сырой HTML выводится текстом, опасные ссылки удаляются"""
+        from .markup import render
+
+        html = render('<img src=x onerror=alert(1)> [ссылка](javascript:alert(1))')
+        self.assertNotIn('<img', html)
+        self.assertNotIn('javascript:', html)
+        self.assertIn('&lt;img', html)
+
+    def test_rerender_command(self):
+        """Команда пересчитывает HTML после смены версии рендерера"""
+        from io import StringIO
+        from unittest import mock
+        from django.core.management import call_command
+        from . import markup
+
+        note = Note.objects.create(title='MD', content='**текст**', author=self.user)
+        with mock.patch.object(markup, 'RENDERER_VERSION', markup.RENDERER_VERSION + 1):
+            output = StringIO()
+            call_command('rerender_notes', stdout=output)
+            self.assertIn('Отрендерено заметок: 1', output.getvalue())
+            note.refresh_from_db()
+            self.assertEqual(note.content_hash, markup.content_hash(note.content))
+
+    def test_cached_view_is_fast(self):
+        """Просмотр большой заметки не зависит от стоимости рендеринга"""
+        import time
+        from . import markup
+
+        content = '\n\n'.join(f'## Раздел {i}\n\n* пункт **{i}**\n* `код`' for i in range(2000))
+        note = Note.objects.create(title='Большая', content=content, author=self.user)
+
+        start = time.perf_counter()
+        markup.render(content)
+        render_time = time.perf_counter() - start
+        start = time.perf_counter()
+        markup.rendered_html(note)
+        cached_time = time.perf_counter() - start
+        print(f"Рендеринг Markdown: {render_time * 1000:.1f} мс, из кэша: {cached_time * 1000:.3f} мс")
+        self.assertLess(cached_time, render_time)
+
+
+# ==================== НЕЧЕТКИЙ ПОИСК ====================
+
+class FuzzySearchTests(NotesTestCase):
+    """Поиск с опечатками по триграммам заголовков и тегов"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='typo', password='pass12345')
+        self.client.login(username='typo', password='pass12345')
+        self.borsch = Note.objects.create(title='Рецепт борща', content='Свекла', author=self.user)
+        self.trip = Note.objects.create(title='Планирование отпуска', content='Горы', author=self.user)
+        self.trip.tags.add(Tag.objects.create(name='путешествия'))
+        other = User.objects.create_user(username='other_typo', password='pass12345')
+        Note.objects.create(title='Рецепт борща', content='Чужая', author=other)
+
+    def test_typo_finds_note(self):
+        """Запрос с опечаткой находит заметку, чужие не попадают"""
+        response = self.client.get(reverse('note_search'), {'q': 'рецпет борща'})
+        self.assertContains(response, 'Рецепт борща', count=1)
+        self.assertContains(response, 'показаны похожие заметки')
+        self.assertNotContains(response, 'Чужая')
+
+    def test_tag_typo(self):
+        """Опечатка в имени тега тоже находит заметку"""
+        from .trigrams import search
+
+        self.assertEqual([pk for pk, _ in search(self.user.pk, 'путешествя')], [self.trip.pk])
+
+    def test_index_follows_changes(self):
+        """Индекс обновляется при смене заголовка и тегов и удалении"""
+        from .trigrams import search
+
+        self.borsch.title = 'Рецепт окрошки'
+        self.borsch.save()
+        self.assertEqual(search(self.user.pk, 'борщ'), [])
+        self.assertEqual([pk for pk, _ in search(self.user.pk, 'окрошка')], [self.borsch.pk])
+
+        self.trip.tags.clear()
+        self.assertEqual(search(self.user.pk, 'путешествия'), [])
+
+        self.borsch.delete()
+        self.assertEqual(search(self.user.pk, 'окрошки'), [])
+
+    def test_exact_results_skip_fuzzy(self):
+        """Если точных совпадений достаточно, нечеткий поиск не добавляется"""
+        from . import search
+
+        for i in range(search.FUZZY_MIN_RESULTS):
+            Note.objects.create(title=f'Рецепт {i}', content='Текст', author=self.user)
+        notes, fuzzy_count = search.find_notes(self.user, 'Рецепт')
+        self.assertEqual(fuzzy_count, 0)
+        self.assertEqual(len(notes), search.FUZZY_MIN_RESULTS + 1)
+
+    def test_lookup_speed(self):
+        """Поиск по индексу среди 5000 заметок занимает миллисекунды"""
+        import time
+        from . import trigrams
+
+        Note.objects.bulk_create([
+            Note(title=f'Заметка номер {i} про разное', content='Текст', author=self.user)
+            for i in range(5000)
+        ])
+        trigrams.backfill(Note.objects.filter(author=self.user))
+
+        start = time.perf_counter()
+        results = trigrams.search(self.user.pk, 'рецпет борща')
+        elapsed = time.perf_counter() - start
+        print(f"Нечеткий поиск среди 5000 заметок: {elapsed * 1000:.2f} мс")
+        self.assertEqual(results[0][0], self.borsch.pk)
+        self.assertLess(elapsed, 0.5)
+
+
+# ==================== ВЛОЖЕНИЯ ====================
+
+@override_settings(NOTES_PROCESS_WORKERS=0)
+class AttachmentTests(NotesTestCase):
+    """Загрузка, хранение по хешу и отдача вложений"""
+
+    PNG = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 4
+
+    def setUp(self):
+        import tempfile
+
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.client = Client()
+        self.user = User.objects.create_user(username='uploader', password='pass12345')
+        self.client.login(username='uploader', password='pass12345')
+        self.note = Note.objects.create(title='С файлами', content='Текст', author=self.user)
+
+    def upload(self, *files):
+        return self.client.post(
+            reverse('attachment_upload', args=[self.note.pk]), {'files': list(files)}
+        )
+
+    def file(self, name='picture.png', content=None):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        return SimpleUploadedFile(name, self.PNG if content is None else content)
+
+    def test_upload_is_content_addressed(self):
+        """Одинаковые файлы хранятся один раз, тип определяется по содержимому"""
+        import hashlib
+        from . import attachments
+        from .models import Attachment, Blob
+
+        self.upload(self.file('a.png'), self.file('b.png'))
+        self.assertEqual(Attachment.objects.filter(note=self.note).count(), 2)
+        blob = Blob.objects.get()
+        self.assertEqual(blob.sha256, hashlib.sha256(self.PNG).hexdigest())
+        self.assertEqual(blob.size, len(self.PNG))
+        self.assertEqual(blob.content_type, 'image/png')
+        self.assertEqual(attachments.blob_path(blob.sha256).read_bytes(), self.PNG)
+
+    def test_rejects_unknown_and_large_files(self):
+        """Файлы неизвестного типа и больше предела не сохраняются"""
+        from .models import Attachment
+
+        response = self.upload(self.file('script.png', b'<script>alert(1)</script>'))
+        self.assertRedirects(response, self.note.get_absolute_url())
+        with self.settings(NOTES_ATTACHMENT_MAX_SIZE=100):
+            self.upload(self.file('big.png'))
+        self.assertFalse(Attachment.objects.exists())
+
+    def test_download_supports_ranges(self):
+        """Файл отдается целиком, по диапазону и с ETag"""
+        from .models import Attachment
+
+        self.upload(self.file())
+        url = reverse('attachment_download', args=[Attachment.objects.get().pk])
+
+        response = self.client.get(url)
+        self.assertEqual(b''.join(response.streaming_content), self.PNG)
+        response.close()
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_RANGE='bytes=8-15')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 8-15/{len(self.PNG)}')
+        self.assertEqual(b''.join(response.streaming_content), self.PNG[8:16])
+
+        response = self.client.get(url, HTTP_RANGE='bytes=-4')
+        self.assertEqual(b''.join(response.streaming_content), self.PNG[-4:])
+
+        response = self.client.get(url, HTTP_RANGE=f'bytes={len(self.PNG)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_other_users_cannot_access(self):
+        """Чужие вложения недоступны"""
+        from .models import Attachment
+
+        self.upload(self.file())
+        item = Attachment.objects.get()
+        User.objects.create_user(username='stranger', password='pass12345')
+        self.client.login(username='stranger', password='pass12345')
+        self.assertEqual(self.client.get(reverse('attachment_download', args=[item.pk])).status_code, 404)
+        response = self.client.post(reverse('attachment_upload', args=[self.note.pk]), {})
+        self.assertEqual(response.status_code, 404)
+
+    def test_delete_releases_unused_blob(self):
+        """Файл удаляется с последним вложением, которое на него ссылается"""
+        from datetime import timedelta
+        from django.utils import timezone
+        from . import attachments
+        from .models import Attachment, Blob
+
+        self.upload(self.file('a.png'), self.file('b.png'))
+        first, second = Attachment.objects.all()
+        path = attachments.blob_path(first.blob_id)
+
+        Blob.objects.update(last_used_at=timezone.now() - timedelta(days=1))
+
+        self.client.post(reverse('attachment_delete', args=[first.pk]))
+        self.assertTrue(path.exists())
+        self.client.post(reverse('attachment_delete', args=[second.pk]))
+        self.assertFalse(path.exists())
+        self.assertFalse(Blob.objects.exists())
+
+    def test_deleting_notes_releases_files(self):
+        """Удаление заметки, массовое удаление и объединение освобождают файлы"""
+        from datetime import timedelta
+        from django.utils import timezone
+        from . import attachments, bulk, fingerprints
+        from .models import Blob
+
+        notes = [self.note] + [
+            Note.objects.create(title=f'С файлами {i}', content='Текст', author=self.user)
+            for i in range(3)
+        ]
+        paths = []
+        for index, note in enumerate(notes):
+            self.client.post(reverse('attachment_upload', args=[note.pk]),
+                             {'files': [self.file(content=self.PNG + bytes([index]))]})
+            paths.append(attachments.blob_path(Blob.objects.latest('created_at').sha256))
+        Blob.objects.update(last_used_at=timezone.now() - timedelta(days=1))
+
+        with self.captureOnCommitCallbacks(using=sharding.current_db(), execute=True):
+            self.client.post(reverse('note_delete', args=[notes[0].pk]))
+            bulk.apply(bulk.ACTION_DELETE, self.user.pk, [notes[1].pk])
+            fingerprints.merge_notes(notes[3], [notes[2]])
+        self.assertEqual([path.exists() for path in paths], [False, False, False, True])
+
+    def test_parallel_store_of_same_new_file(self):
+        """Параллельное сохранение одного нового файла не делит временное имя"""
+        import hashlib
+        import os
+        import tempfile
+        from types import SimpleNamespace
+        from . import attachments
+
+        def uploaded():
+            with tempfile.NamedTemporaryFile(delete=False) as temp:
+                temp.write(self.PNG)
+            self.addCleanup(lambda: os.path.exists(temp.name) and os.remove(temp.name))
+            return SimpleNamespace(
+                name='a.png', size=len(self.PNG), sha256=hashlib.sha256(self.PNG).hexdigest(),
+                temporary_file_path=lambda: temp.name,
+            )
+
+        replace = os.replace
+        raced = []
+
+        def replace_after_other_thread(source, target):
+            if not raced:
+                raced.append(source)
+                attachments.store(uploaded())  # другой поток между move и replace
+            return replace(source, target)
+
+        with mock.patch('os.replace', replace_after_other_thread):
+            blob = attachments.store(uploaded())
+        self.assertEqual(attachments.blob_path(blob.sha256).read_bytes(), self.PNG)
+
+    def test_recent_blob_survives_garbage_collection(self):
+        """Сборка мусора между сохранением файла и созданием вложения его не удаляет"""
+        from datetime import timedelta
+        from django.utils import timezone
+        from . import attachments
+        from .models import Attachment, Blob
+
+        self.upload(self.file())
+        Attachment.objects.all().delete()
+        Blob.objects.update(last_used_at=timezone.now() - timedelta(days=1))
+        store = attachments.store
+
+        def store_then_collect(uploaded):
+            blob = store(uploaded)
+            self.assertEqual(attachments.collect_garbage(), 0)
+            return blob
+
+        with mock.patch.object(attachments, 'store', store_then_collect):
+            self.upload(self.file())
+        item = Attachment.objects.get()
+        self.assertEqual(attachments.blob_path(item.blob_id).read_bytes(), self.PNG)
+
+        Attachment.objects.all().delete()
+        self.assertEqual(attachments.collect_garbage(), 0)
+        with self.settings(NOTES_ATTACHMENT_GRACE=0):
+            self.assertEqual(attachments.collect_garbage(), 1)
+        self.assertFalse(attachments.blob_path(item.blob_id).exists())
+
+    def test_detail_page_lists_attachments(self):
+        """Вложения видны на странице заметки"""
+        self.upload(self.file('диаграмма.png'))
+        response = self.client.get(self.note.get_absolute_url())
+        self.assertContains(response, 'диаграмма.png')
+
+    def test_notes_with_attachments_are_not_archived(self):
+        """Архивирование удалило бы вложения, поэтому такие заметки пропускаются"""
+        from . import archive
+
+        self.upload(self.file())
+        self.assertEqual(archive.archive_notes(Note.objects.filter(pk=self.note.pk)), 0)
+        self.assertTrue(Note.objects.filter(pk=self.note.pk).exists())
+
+    def test_parse_range(self):
+        """Разбор заголовка Range"""
+        from .attachments import parse_range
+
+        self.assertIsNone(parse_range('', 100))
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 100))
+        self.assertEqual(parse_range('bytes=10-', 100), (10, 99))
+        self.assertEqual(parse_range('bytes=90-200', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-200', 100), (0, 99))
+        with self.assertRaises(ValueError):
+            parse_range('bytes=20-10', 100)
+
+    @skipUnless(HAS_PILLOW, 'нужен Pillow')
+    def test_thumbnail(self):
+        """Миниатюра картинки создается в фоне и отдается отдельно"""
+        import io
+        from PIL import Image
+        from .models import Attachment
+
+        buffer = io.BytesIO()
+        Image.new('RGB', (1200, 800), 'red').save(buffer, 'PNG')
+        self.upload(self.file('photo.png', buffer.getvalue()))
+        item = Attachment.objects.get()
+        self.assertTrue(item.blob.has_thumbnail)
+        response = self.client.get(reverse('attachment_thumbnail', args=[item.pk]))
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as thumbnail:
+            self.assertLessEqual(max(thumbnail.size), 320)
+
+
+# ==================== СОБЫТИЯ ====================
+
+class RecordingBroker:
+    """Брокер для тестов: запоминает опубликованные события"""
+
+    def __init__(self):
+        self.published = []
+
+    def wants(self, user_id):
+        return True
+
+    def publish(self, user_id, event):
+        self.published.append((user_id, event))
+
+
+@override_settings(NOTES_PROCESS_WORKERS=0, NOTES_EVENTS_BACKEND='notes.tests.RecordingBroker')
+class EventTests(NotesTestCase):
+    """Уведомления открытых вкладок об изменении заметок"""
+
+    def setUp(self):
+        from . import events
+
+        self.user = User.objects.create_user(username='watcher', password='pass12345')
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+        events.get_broker().published.clear()
+
+    def published(self):
+        from . import events
+        return [(user_id, event['type']) for user_id, event in events.get_broker().published]
+
+    def test_changes_are_published_after_commit(self):
+        """Создание, изменение и удаление заметки публикуются после фиксации"""
+        from . import events
+
+        with self.captureOnCommitCallbacks(using=sharding.current_db(), execute=True):
+            note = Note.objects.create(title='Живая', content='Текст', author=self.user)
+        self.assertEqual(self.published(), [(self.user.pk, events.CREATED)])
+        user_id, event = events.get_broker().published[0]
+        self.assertIn(f'data-note-id="{note.pk}"', event['html'])
+        self.assertIn('Живая', event['html'])
+
+        with self.captureOnCommitCallbacks(using=sharding.current_db(), execute=True):
+            note.title = 'Живая заметка'
+            note.save()
+            note.delete()
+        self.assertEqual(self.published()[1:], [
+            (self.user.pk, events.UPDATED), (self.user.pk, events.DELETED),
+        ])
+
+    def test_bulk_action_asks_to_reload(self):
+        """Массовые действия не отправляют сигналов — список просят обновить"""
+        from . import bulk, events
+
+        note = Note.objects.create(title='Одна', content='Текст', author=self.user)
+        tag = Tag.objects.create(name='живое')
+        with self.captureOnCommitCallbacks(using=sharding.current_db(), execute=True):
+            bulk.apply(bulk.ACTION_ADD_TAG, self.user.pk, [note.pk], tag.pk)
+        self.assertEqual(self.published(), [(self.user.pk, events.RELOAD)])
+
+    def test_stream_requires_asgi_and_login(self):
+        """Без входа — 403, под WSGI поток не открывается"""
+        self.assertEqual(self.client.get(reverse('note_events')).status_code, 204)
+        self.assertEqual(Client().get(reverse('note_events')).status_code, 403)
+
+    @override_settings(NOTES_EVENTS_BACKEND='notes.events.LocalBroker')
+    async def test_stream_delivers_events(self):
+        """Опубликованное событие приходит в поток вкладки"""
+        import json
+        from unittest import mock
+        from . import events
+
+        with mock.patch.object(events, 'STREAM_LIFETIME', 0.2):
+            response = await self.async_client.get(reverse('note_events'))
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            chunks = aiter(response.streaming_content)
+            self.assertIn(b'retry:', await anext(chunks))
+
+            events.get_broker().publish(self.user.pk, {'type': events.DELETED, 'id': 7})
+            chunk = (await anext(chunks)).decode()
+            self.assertIn('event: note', chunk)
+            data = json.loads(chunk.split('data: ', 1)[1])
+            self.assertEqual(data, {'type': 'deleted', 'id': 7})
+            async for _ in chunks:
+                pass  # поток закрывается по истечении времени жизни
+        self.assertFalse(events.get_broker().wants(self.user.pk))
+
+    async def test_slow_subscriber_gets_reload(self):
+        """Переполненная очередь заменяется одним событием reload"""
+        from . import events
+
+        broker = events.LocalBroker()
+        async with broker.subscribe(1) as subscription:
+            for number in range(events.QUEUE_SIZE + 5):
+                subscription.put({'type': events.UPDATED, 'id': number})
+            self.assertLess(subscription.queue.qsize(), events.QUEUE_SIZE)
+            last = None
+            while not subscription.queue.empty():
+                last = subscription.queue.get_nowait()
+            self.assertEqual(last['id'], events.QUEUE_SIZE + 4)
+            self.assertIsNone(await subscription.get(0.01))
+
+
+# ==================== АДМИНКА ====================
+
+@override_settings(NOTES_PROCESS_WORKERS=0)
+class AdminTests(NotesTestCase):
+    """Списки админки без полных подсчетов и выпадающих списков"""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('boss', 'boss@example.com', 'pass12345')
+        self.client.force_login(self.admin)
+        self.user = User.objects.create_user(username='writer', password='pass12345')
+        self.tag = Tag.objects.create(name='админ')
+        for number in range(3):
+            note = Note.objects.create(
+                title=f'Заметка {number}', content='Текст', author=self.user
+            )
+            note.tags.add(self.tag)
+
+    def test_changelist_filters_and_search(self):
+        """Фильтр по автору и поиск по заголовку и id"""
+        url = reverse('admin:notes_note_changelist')
+        response = self.client.get(url, {'author': self.user.pk})
+        self.assertContains(response, 'Заметка 2')
+        self.assertContains(response, 'admin-autocomplete')
+        # Выбранный автор показан, остальные пользователи в фильтр не выводятся
+        self.assertContains(response, f'<option value="{self.user.pk}" selected>writer</option>', html=True)
+        self.assertNotContains(response, f'<option value="{self.admin.pk}"')
+
+        response = self.client.get(url, {'author': self.admin.pk})
+        self.assertNotContains(response, 'Заметка 2')
+
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'term': 'wri', 'app_label': 'notes', 'model_name': 'note', 'field_name': 'author',
+        })
+        self.assertEqual(response.json()['results'], [{'id': str(self.user.pk), 'text': 'writer'}])
+
+        note = Note.objects.get(title='Заметка 1')
+        response = self.client.get(url, {'q': str(note.pk)})
+        self.assertContains(response, 'Заметка 1')
+        self.assertNotContains(response, 'Заметка 2')
+
+    def test_capped_and_estimated_count(self):
+        """Отфильтрованная выборка считается до предела, вся таблица — по статистике"""
+        from unittest import mock
+        from . import admin as notes_admin
+
+        with mock.patch.object(notes_admin, 'EXACT_COUNT_LIMIT', 2):
+            paginator = notes_admin.EstimatedCountPaginator(
+                Note.objects.filter(author=self.user).order_by('pk'), 1
+            )
+            self.assertEqual(paginator.count, 2)
+            self.assertEqual(paginator.count_label, '2+')
+            # Страница за пределом доступна
+            self.assertEqual([note.title for note in paginator.page(3)], ['Заметка 2'])
+            self.assertEqual(list(paginator.page(4)), [])
+
+            paginator = notes_admin.EstimatedCountPaginator(
+                Note.objects.filter(author=self.user), 1, count_limit=3
+            )
+            self.assertEqual(paginator.count_label, '3')
+
+        notes_db = connections[sharding.current_db()]
+        if notes_db.vendor == 'sqlite':
+            with notes_db.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            self.assertEqual(notes_admin.estimated_count(Note.objects.all()), 3)
+
+    def test_changelist_pages_past_the_cap(self):
+        """Неточное число помечено, предел растет с номером страницы"""
+        from . import admin as notes_admin
+
+        url = reverse('admin:notes_note_changelist')
+        with mock.patch.object(notes_admin, 'EXACT_COUNT_LIMIT', 1), \
+                mock.patch.object(notes_admin, 'PAGES_AHEAD', 1), \
+                mock.patch.object(notes_admin.NoteAdmin, 'list_per_page', 1):
+            response = self.client.get(url, {'author': self.user.pk})
+            self.assertContains(response, '2+ Заметки')
+            response = self.client.get(url, {'author': self.user.pk, 'p': 2})
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, '3 Заметки')
+
+    def test_tag_changelist_counts_notes_in_one_query(self):
+        """Число заметок у тегов считается в запросе списка"""
+        from .admin import TagAdmin
+        from django.contrib.admin.sites import site
+        from django.test import RequestFactory
+
+        request = RequestFactory().get('/')
+        request.user = self.admin
+        with self.assertNumQueries(1, using=sharding.current_db()):
+            counts = {tag.name: tag.note_count for tag in TagAdmin(Tag, site).get_queryset(request)}
+        self.assertEqual(counts['админ'], 3)
+        # Теги шарда видны в списке выбранной базы
+        response = self.client.get(reverse('admin:notes_tag_changelist'), {'shard': sharding.current_db()})
+        self.assertContains(response, 'админ')
+
+
+# ==================== СТРАНИЦЫ ПОИСКА ====================
+
+@override_settings(NOTES_PROCESS_WORKERS=0)
+class SearchPaginationTests(NotesTestCase):
+    """Результаты поиска постранично и с ограничением числа"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='finder', password='pass12345')
+        self.client.force_login(self.user)
+        Note.objects.bulk_create([
+            Note(title=f'Общее слово {i}', content='Текст', author=self.user) for i in range(25)
+        ])
+
+    def test_results_are_paginated(self):
+        """Страница поиска показывает не больше PAGE_SIZE заметок"""
+        from . import search
+
+        response = self.client.get(reverse('note_search'), {'q': 'Общее'})
+        self.assertEqual(len(response.context['notes']), search.PAGE_SIZE)
+        self.assertEqual(response.context['result_count'], 25)
+        self.assertContains(response, 'найдено: 25)')
+        self.assertContains(response, 'q=%D0%9E%D0%B1%D1%89%D0%B5%D0%B5&amp;page=2')
+
+        response = self.client.get(reverse('note_search'), {'q': 'Общее', 'page': 3})
+        self.assertEqual(len(response.context['notes']), 5)
+        self.assertNotContains(response, 'Показать еще')
+
+    def test_result_count_is_capped(self):
+        """Больше RESULT_LIMIT результатов не считается и не показывается"""
+        from unittest import mock
+        from . import search
+
+        with mock.patch.object(search, 'RESULT_LIMIT', 20):
+            response = self.client.get(reverse('note_search'), {'q': 'Общее', 'page': 5})
+        self.assertTrue(response.context['capped'])
+        self.assertEqual(response.context['page_obj'].number, 2)
+        self.assertEqual(len(response.context['notes']), 10)
+        self.assertContains(response, 'найдено: 20+)')
+
+    def test_load_more_json(self):
+        """«Показать еще» получает следующую порцию карточек в JSON"""
+        response = self.client.get(reverse('note_search'), {'q': 'Общее', 'format': 'json', 'page': 2})
+        data = response.json()
+        self.assertEqual(len(data['notes']), 10)
+        self.assertEqual(data['next_page'], 3)
+        self.assertFalse(data['capped'])
+        self.assertIn('data-note-id', data['notes'][0]['html'])
+
+        data = self.client.get(
+            reverse('note_search'), {'q': 'Общее', 'format': 'json', 'page': 3}
+        ).json()
+        self.assertIsNone(data['next_page'])
+
+
+# ==================== МЕТРИКИ ====================
+
+@override_settings(NOTES_PROCESS_WORKERS=0, NOTES_METRICS_TOKEN='secret-token')
+class MetricsTests(NotesTestCase):
+    """Метрики Prometheus по запросам, БД, кэшам и очереди"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='observer', password='pass12345')
+        self.staff = User.objects.create_user(username='ops', password='pass12345', is_staff=True)
+
+    def test_endpoint_requires_staff_or_token(self):
+        """Без прав — 403, персоналу и по токену — текст метрик"""
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(
+            Client().get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403
+        )
+        response = Client().get(url, HTTP_AUTHORIZATION='Bearer secret-token')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+    def test_requests_queries_and_changes_are_counted(self):
+        """Запрос к списку попадает в гистограмму, запросы к БД — в счетчик"""
+        from . import metrics
+
+        before = metrics.NOTE_CHANGES.values[('created',)]
+        Note.objects.create(title='Метрика', content='Текст', author=self.user)
+        self.assertEqual(metrics.NOTE_CHANGES.values[('created',)], before + 1)
+
+        self.client.force_login(self.user)
+        queries = metrics.DB_QUERIES.values[('note_list',)]
+        self.client.get(reverse('note_list'))
+        self.assertGreater(metrics.DB_QUERIES.values[('note_list',)], queries)
+
+        self.client.force_login(self.staff)
+        text = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('# TYPE notes_http_request_duration_seconds histogram', text)
+        self.assertIn('notes_http_request_duration_seconds_bucket{view="note_list",method="GET",le="+Inf"}', text)
+        self.assertIn('notes_http_requests_total{view="note_list",method="GET",status="200"}', text)
+        self.assertIn('notes_job_queue_depth{status="pending"} 0', text)
+        self.assertIn('# TYPE notes_cache_requests_total counter', text)
+
+    def test_histogram_format(self):
+        """Корзины гистограммы накопительные, +Inf равна количеству"""
+        from . import metrics
+
+        histogram = metrics.Histogram('notes_test_seconds', 'Тест', ('kind',), buckets=(0.1, 1))
+        try:
+            for value in (0.05, 0.5, 5):
+                histogram.observe(value, 'a')
+            lines = [line for line in metrics.render().splitlines() if 'notes_test_seconds' in line]
+        finally:
+            del metrics._registry['notes_test_seconds']
+        self.assertIn('notes_test_seconds_bucket{kind="a",le="0.1"} 1', lines)
+        self.assertIn('notes_test_seconds_bucket{kind="a",le="1"} 2', lines)
+        self.assertIn('notes_test_seconds_bucket{kind="a",le="+Inf"} 3', lines)
+        self.assertIn('notes_test_seconds_count{kind="a"} 3', lines)
+
+    def test_processes_are_aggregated(self):
+        """В многопроцессном режиме счетчики всех процессов складываются"""
+        import json
+        import tempfile
+        from pathlib import Path
+        from . import metrics
+
+        with tempfile.TemporaryDirectory() as directory:
+            other = {'notes_note_changes_total': [[['deleted'], 5]]}
+            Path(directory, 'metrics_999999_1.json').write_text(json.dumps(other))
+            own = metrics.NOTE_CHANGES.values[('deleted',)]
+            with self.settings(NOTES_METRICS_DIR=directory):
+                text = metrics.render()
+                self.assertTrue(Path(directory, metrics._file_name).exists())
+        self.assertIn(f'notes_note_changes_total{{action="deleted"}} {int(own) + 5}', text)
+
+    def test_finished_processes_archived(self):
+        """Срезы завершившихся процессов сводятся в архив, суммы не убывают"""
+        import json
+        import tempfile
+        from pathlib import Path
+        from . import metrics
+
+        with tempfile.TemporaryDirectory() as directory:
+            # Два процесса с одним pid (pid переиспользован) и гистограмма
+            for start, deleted in ((1, 5), (2, 3)):
+                Path(directory, f'metrics_999999_{start}.json').write_text(json.dumps({
+                    'notes_note_changes_total': [[['deleted'], deleted]],
+                    'notes_job_duration_seconds': [[['test'], [1] + [0] * 9 + [0.2, 1]]],
+                }))
+            own = metrics.NOTE_CHANGES.values[('deleted',)]
+            with self.settings(NOTES_METRICS_DIR=directory):
+                before = metrics.render()
+                self.assertEqual(metrics.archive_process(999999), 2)
+                self.assertEqual(metrics.archive_process(999999), 0)
+                after = metrics.render()
+            self.assertEqual(
+                sorted(path.name for path in Path(directory).glob('metrics_*.json')),
+                [metrics._file_name],
+            )
+        self.assertIn(f'notes_note_changes_total{{action="deleted"}} {int(own) + 8}', after)
+        self.assertIn('notes_job_duration_seconds_count{kind="test"} 2', after)
+        self.assertEqual(before, after)
+
+
+# ==================== УДАЛЕНИЕ ДАННЫХ ====================
+
+@override_settings(NOTES_PROCESS_WORKERS=0, NOTES_PURGE_CHUNK_SIZE=2, NOTES_PURGE_PAUSE=0,
+                   NOTES_JOBS_RETRY_DELAY=0)
+class PurgeTests(NotesTestCase):
+    """Удаление аккаунтов пачками и очистка данных по сроку хранения"""
+
+    def setUp(self):
+        import tempfile
+
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.user = User.objects.create_user(username='leaving', password='pass12345')
+        self.other = User.objects.create_user(username='staying', password='pass12345')
+        tag = Tag.objects.create(name='уходит')
+        self.notes = [
+            Note.objects.create(title=f'Заметка {i}', content='Текст', author=self.user)
+            for i in range(5)
+        ]
+        for note in self.notes:
+            note.tags.add(tag)
+        self.kept = Note.objects.create(title='Чужая', content='Текст', author=self.other)
+
+    def attach_file(self, note, data=b'%PDF-1.4 test'):
+        import hashlib
+        from datetime import timedelta
+        from django.utils import timezone
+        from . import attachments
+        from .models import Attachment, Blob
+
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = attachments.blob_path(sha256)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        blob, _ = Blob.objects.get_or_create(
+            sha256=sha256, defaults={
+                'size': len(data), 'content_type': 'application/pdf',
+                'last_used_at': timezone.now() - timedelta(days=1),
+            },
+        )
+        Attachment.objects.create(note=note, author=note.author, blob=blob, filename='a.pdf')
+        return path
+
+    def test_account_deleted_in_chunks(self):
+        """Заметки и производные данные удаляются пачками, затем пользователь"""
+        from . import purge
+        from .models import ArchivedNote, Job, NoteFingerprint, TrigramPosting
+
+        ArchivedNote.objects.create(
+            id=10 ** 9, author=self.user, title='Архив', content_compressed=b'',
+            created_at=self.kept.created_at, updated_at=self.kept.updated_at,
+        )
+        own_file = self.attach_file(self.notes[0])
+        shared_file = self.attach_file(self.notes[1], b'%PDF-1.4 shared')
+        self.attach_file(self.kept, b'%PDF-1.4 shared')
+
+        calls = []
+        deleted = purge.delete_account(self.user.pk, lambda done, total: calls.append((done, total)))
+
+        self.assertEqual(deleted, 6)
+        self.assertEqual(calls, [(2, 6), (4, 6), (5, 6), (6, 6)])
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertEqual(list(Note.objects.all()), [self.kept])
+        self.assertFalse(ArchivedNote.objects.exists())
+        self.assertFalse(Note.tags.through.objects.exclude(note=self.kept).exists())
+        self.assertFalse(TrigramPosting.objects.exclude(note=self.kept).exists())
+        self.assertFalse(NoteFingerprint.objects.exclude(note=self.kept).exists())
+        self.assertFalse(own_file.exists())
+        self.assertTrue(shared_file.exists())
+        self.assertFalse(Job.objects.filter(user_id=self.user.pk).exists())
+
+    def test_interrupted_deletion_resumes(self):
+        """Прерванное удаление продолжается с оставшихся заметок"""
+        from io import StringIO
+        from unittest import mock
+        from django.core.management import call_command
+        from . import jobs, purge
+        from .models import Job
+
+        job = purge.schedule_account_deletion(self.user)
+        self.assertEqual(purge.schedule_account_deletion(self.user), job)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+
+        original = purge._delete_notes_chunk
+        calls = []
+
+        def crash_after_first(ids):
+            calls.append(ids)
+            if len(calls) > 1:
+                raise RuntimeError('сбой')
+            original(ids)
+
+        with mock.patch.object(purge, '_delete_notes_chunk', crash_after_first):
+            jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_FAILED)
+        self.assertEqual(Note.objects.filter(author=self.user).count(), 3)
+
+        out = StringIO()
+        call_command('purge_data', stdout=out)
+        self.assertIn('Возобновлено удалений: 1', out.getvalue())
+        self.assertIn('Удалено аккаунтов: 1', out.getvalue())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_DONE)
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertEqual(list(Note.objects.all()), [self.kept])
+
+    def test_admin_schedules_deletion(self):
+        """В админке аккаунт удаляется действием в фоне, а не каскадом"""
+        from .models import Job
+
+        admin_user = User.objects.create_superuser('root', 'root@example.com', 'pass12345')
+        self.client.force_login(admin_user)
+        url = reverse('admin:auth_user_changelist')
+
+        response = self.client.get(url)
+        self.assertContains(response, 'schedule_deletion')
+        self.assertNotContains(response, 'delete_selected')
+        self.assertEqual(
+            self.client.get(reverse('admin:auth_user_delete', args=[self.user.pk])).status_code,
+            403,
+        )
+
+        response = self.client.post(url, {
+            'action': 'schedule_deletion',
+            '_selected_action': [self.user.pk, admin_user.pk],
+        })
+        self.assertRedirects(response, url)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertEqual(Job.objects.get(kind='delete_account').payload, {'user_id': self.user.pk})
+        admin_user.refresh_from_db()
+        self.assertTrue(admin_user.is_active)
+
+    def test_retention_purge(self):
+        """Старые завершенные задачи и архив удаляются, свежие остаются"""
+        from datetime import timedelta
+        from io import StringIO
+        from django.core.management import call_command
+        from django.utils import timezone
+        from . import purge
+        from .models import ArchivedNote, Job
+        from .tasks import media_path
+
+        old = timezone.now() - timedelta(days=400)
+        for pk in (1, 2, 3):
+            ArchivedNote.objects.create(
+                id=10 ** 9 + pk, author=self.user, title='Архив', content_compressed=b'',
+                created_at=old, updated_at=old,
+            )
+        ArchivedNote.objects.exclude(pk=10 ** 9 + 3).update(archived_at=old)
+        finished = [
+            Job.objects.create(
+                kind='export_notes', status=Job.STATUS_DONE, result={'file': 'exports/1.json'}
+            ),
+            Job.objects.create(kind='bulk_notes', status=Job.STATUS_FAILED),
+            Job.objects.create(kind='bulk_notes', status=Job.STATUS_DONE),
+        ]
+        export = media_path('exports/1.json')
+        export.parent.mkdir(parents=True)
+        export.write_text('{}')
+        Job.objects.filter(pk__in=[job.pk for job in finished[:2]]).update(updated_at=old)
+        pending = Job.objects.create(kind='bulk_notes')
+        Job.objects.filter(pk=pending.pk).update(updated_at=old)
+
+        self.assertEqual(purge.purge_expired(), {'archived_notes': 0, 'jobs': 2, 'rate_limits': 0})
+        self.assertEqual(
+            set(Job.objects.values_list('pk', flat=True)), {finished[2].pk, pending.pk}
+        )
+        self.assertFalse(export.exists())
+
+        out = StringIO()
+        call_command('purge_data', '--retention', '--archive-days', '365', stdout=out)
+        self.assertIn('Удалено архивных заметок: 2', out.getvalue())
+        self.assertEqual(list(ArchivedNote.objects.values_list('pk', flat=True)), [10 ** 9 + 3])
+
+
+# ==================== ПРОГРЕВ ====================
+
+class WarmupTests(NotesTestCase):
+    """Прогрев процесса до первого запроса"""
+
+    def test_warm_up_stages(self):
+        """Прогрев разбирает URLconf и шаблоны; БД — только если разрешено"""
+        from django.template import engines
+        from . import warmup
+
+        timings = warmup.warm_up(connect_db=False)
+        self.assertEqual(list(timings), ['imports', 'urls', 'templates', 'process'])
+        self.assertGreater(warmup.compile_urls(), 0)
+        self.assertGreater(warmup.load_templates(), 5)
+        self.assertIn('database', warmup.warm_up())
+        # Шаблон уже в кэше загрузчика
+        loader = engines['django'].engine.template_loaders[0]
+        self.assertIn('notes/note_list.html', {key.split('-')[0] for key in loader.get_template_cache})
+
+    def test_gunicorn_master_does_not_connect(self):
+        """В мастере gunicorn соединения не открываются: они не переживут fork"""
+        from unittest import mock
+        from . import warmup
+
+        with mock.patch.object(warmup, 'warm_up') as warm_up:
+            warmup.on_load()
+            warm_up.assert_not_called()
+            with self.settings(NOTES_WARMUP=True):
+                warmup.on_load()
+                warm_up.assert_called_with(connect_db=True)
+                with mock.patch.object(warmup, 'FORKING', True):
+                    warmup.on_load()
+                warm_up.assert_called_with(connect_db=False)
+
+    def test_gunicorn_config_marks_master(self):
+        """gunicorn загружает приложение до on_starting: флаг выставляется
+        при чтении конфигурации, а прогрев остается выключенным"""
+        import os
+        import runpy
+        from django.conf import settings
+        from . import warmup
+
+        self.addCleanup(setattr, warmup, 'FORKING', warmup.FORKING)
+        with mock.patch.dict(os.environ):
+            os.environ.pop('NOTES_WARMUP', None)
+            config = runpy.run_path(str(settings.BASE_DIR / 'gunicorn.conf.py'))
+            self.assertNotIn('NOTES_WARMUP', os.environ)
+        self.assertTrue(warmup.FORKING)
+        self.assertTrue(config['preload_app'])
+        self.assertNotIn('on_starting', config)
+
+    def test_benchmark_command(self):
+        """Бенчмарк запускает новые процессы и сравнивает старт с прогревом и без"""
+        from io import StringIO
+        from django.core.management import call_command
+
+        out = StringIO()
+        call_command('benchmark_startup', runs=1, stdout=out)
+        self.assertIn('Без прогрева (/login/, ответ 200 OK)', out.getvalue())
+        self.assertIn('С прогревом', out.getvalue())
+        self.assertEqual(out.getvalue().count('до первого ответа'), 2)
+
+
+# ==================== СЖАТИЕ ОТВЕТОВ ====================
+
+@override_settings(NOTES_PROCESS_WORKERS=0)
+class CompressionTests(NotesTestCase):
+    """Сжатие ответов и облегченная разметка списка заметок"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='pass12345')
+        for i in range(10):
+            Note.objects.create(title=f'Заметка {i}', content='Текст заметки ' * 20, author=self.user)
+        self.client.force_login(self.user)
+
+    def test_list_is_gzipped(self):
+        """Список заметок сжимается gzip, заголовки учитывают кодировку"""
+        import gzip
+
+        plain = self.client.get(reverse('note_list'))
+        response = self.client.get(reverse('note_list'), HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertLess(len(response.content), len(plain.content) / 3)
+        html = gzip.decompress(response.content).decode()
+        self.assertEqual(html.count('data-note-id'), 10)
+        self.assertFalse(plain.has_header('Content-Encoding'))
+
+    def test_pages_with_query_compressed(self):
+        """Поиск и вторая страница списка сжимаются: CSRF-токен маскируется в каждом ответе"""
+        import gzip
+        import re
+
+        for i in range(10, 15):
+            Note.objects.create(title=f'Заметка {i}', content='Текст заметки ' * 20, author=self.user)
+        tokens = []
+        for _ in range(2):
+            response = self.client.get(
+                reverse('note_search'), {'q': 'Заметка'}, HTTP_ACCEPT_ENCODING='gzip'
+            )
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            html = gzip.decompress(response.content).decode()
+            tokens.append(re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', html).group(1))
+        self.assertNotEqual(tokens[0], tokens[1])
+
+        response = self.client.get(reverse('note_list'), {'page': 2}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content).decode().count('data-note-id'), 5)
+
+        response = self.client.get(
+            reverse('note_search'), {'q': 'Заметка', 'format': 'json'}, HTTP_ACCEPT_ENCODING='gzip'
+        )
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_no_transform_and_small_responses_not_compressed(self):
+        """Ответ с Cache-Control: no-transform и короткие ответы — без сжатия"""
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from .middleware import CompressionMiddleware
+
+        body = 'секрет и отраженный ввод ' * 100
+        page = HttpResponse(body, content_type='text/html; charset=utf-8')
+        page['Cache-Control'] = 'no-transform'
+        request = RequestFactory().get('/', {'q': 'x'}, HTTP_ACCEPT_ENCODING='gzip')
+        response = CompressionMiddleware(lambda request: page)(request)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content.decode(), body)
+
+        response = self.client.get(reverse('note_suggest'), {'q': 'За'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_markup_without_indentation_and_inline_styles(self):
+        """Шаблоны без отступов и встроенных стилей; <pre> и <textarea> не меняются"""
+        from .loaders import collapse_whitespace
+
+        html = self.client.get(reverse('note_list')).content.decode()
+        self.assertNotIn('\n  ', html.split('<body', 1)[1])
+        self.assertNotIn('<style>', html)
+        card = html[html.index('data-note-id'):html.index('card-footer')]
+        self.assertNotIn('style=', card)
+
+        source = '<div>\n    <pre>\n  код\n</pre>\n  <textarea>\n  текст</textarea>\n</div>'
+        self.assertEqual(
+            collapse_whitespace(source),
+            '<div>\n<pre>\n  код\n</pre>\n<textarea>\n  текст</textarea>\n</div>',
+        )
+
+    def test_benchmark_command(self):
+        """Бенчмарк размера страницы откатывает созданные данные"""
+        from io import StringIO
+        from django.core.management import call_command
+
+        out = StringIO()
+        call_command('benchmark_payload', cards=[10, 20], repeat=1, stdout=out)
+        self.assertIn('  10 карточек: HTML', out.getvalue())
+        self.assertIn('  20 карточек: HTML', out.getvalue())
+        self.assertIn('  20 карточек, стр. 2: HTML', out.getvalue())
+        self.assertIn('поиск, стр. 2: HTML', out.getvalue())
+        self.assertFalse(User.objects.filter(username='payload-benchmark').exists())
+
+
+# ==================== POSTGRESQL ====================
+
+@skipUnless(connection.vendor == 'postgresql', 'нужен PostgreSQL: NOTES_DB_ENGINE=postgresql')
+class PostgresSearchTests(NotesTestCase):
+    """Полнотекстовый и нечеткий поиск на PostgreSQL"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='pguser', password='pass12345')
+        self.client.login(username='pguser', password='pass12345')
+        Note.objects.create(title='Планирование отпуска', content='Купить билеты в горы', author=self.user)
+        Note.objects.create(title='Рецепт борща', content='Свекла, капуста, картофель', author=self.user)
+
+    def test_indexes_created(self):
+        """Миграция создала GIN-индексы поиска"""
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = 'notes_note'")
+            indexes = {row[0] for row in cursor.fetchall()}
+        self.assertIn('notes_note_search_idx', indexes)
+        self.assertIn('notes_note_title_trgm_idx', indexes)
+
+    def test_full_text_uses_stemming(self):
+        """Поиск находит другие словоформы"""
+        from .search import search_notes
+
+        titles = [note.title for note in search_notes(self.user, 'билет')]
+        self.assertEqual(titles, ['Планирование отпуска'])
+
+    def test_fuzzy_title_match(self):
+        """Опечатка в заголовке не мешает найти заметку"""
+        response = self.client.get(reverse('note_search'), {'q': 'боршь'})
+        self.assertContains(response, 'Рецепт борща')
+
+
+# ==================== ШАРДИРОВАНИЕ ====================
+
+@skipUnless(HAS_SHARD_DATABASES, 'нужны базы шардов: --settings=config.test_settings')
+class ShardingTests(TestCase):
+    """Выбор шарда, роутер и заморозка записи при переносе"""
+    databases = '__all__'
+
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='sharded', password='pass12345')
+        self.client.login(username='sharded', password='pass12345')
+
+    @override_settings(NOTES_SHARDS=4)
+    def test_hash_is_stable_and_balanced(self):
+        """Пользователи распределяются по шардам равномерно и всегда одинаково"""
+        from collections import Counter
+        from . import sharding
+
+        placement = [sharding.hash_shard(user_id) for user_id in range(1, 4001)]
+        self.assertEqual(placement, [sharding.hash_shard(user_id) for user_id in range(1, 4001)])
+        counts = Counter(placement)
+        self.assertEqual(set(counts), {'shard_0', 'shard_1', 'shard_2', 'shard_3'})
+        for count in counts.values():
+            self.assertGreater(count, 800)
+
+    @override_settings(NOTES_SHARDS=2)
+    def test_router(self):
+        """Заметки идут в шард пользователя, остальные модели — в default"""
+        from .models import Job
+        from . import sharding
+
+        router = sharding.ShardRouter()
+        sharding.assign(self.user.pk, 'shard_1')
+
+        self.assertEqual(router.db_for_read(Job), 'default')
+        self.assertEqual(router.db_for_read(User), 'default')
+        self.assertEqual(router.db_for_write(Note, instance=Note(author_id=self.user.pk)), 'shard_1')
+        self.assertEqual(router.db_for_read(Note, instance=self.user), 'shard_1')
+        with sharding.use_db('shard_0'):
+            self.assertEqual(router.db_for_read(Tag), 'shard_0')
+        self.assertEqual(router.db_for_read(Tag), 'default')
+
+        self.assertTrue(router.allow_migrate('shard_0', 'notes', 'note'))
+        self.assertFalse(router.allow_migrate('shard_0', 'notes', 'job'))
+        self.assertFalse(router.allow_migrate('shard_0', 'auth', 'user'))
+        self.assertIsNone(router.allow_migrate('default', 'auth', 'user'))
+
+    @override_settings(NOTES_SHARDS=2)
+    def test_new_user_gets_shard(self):
+        """Новый пользователь сразу получает шард, старые остаются в default"""
+        from django.core.cache import cache
+        from . import sharding
+        from .models import ShardAssignment
+
+        # Пользователь без назначения — создан до включения шардов
+        ShardAssignment.objects.all().delete()
+        cache.clear()
+        self.assertEqual(sharding.db_for_user(self.user.pk), 'default')
+        user = User.objects.create_user(username='newcomer', password='pass12345')
+        self.assertEqual(sharding.db_for_user(user.pk), sharding.hash_shard(user.pk))
+
+    @override_settings(NOTES_SHARDS=2)
+    def test_writes_frozen_while_moving(self):
+        """Во время переноса изменения запрещены, чтение работает"""
+        from . import sharding
+
+        sharding.assign(self.user.pk, 'default', moving_to='shard_1')
+
+        response = self.client.post(reverse('note_create'), {'title': 'T', 'content': 'C'})
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(Note.objects.exists())
+        self.assertEqual(self.client.get(reverse('note_list')).status_code, 200)
+
+    @override_settings(NOTES_SHARDS=2, DATABASE_ROUTERS=['notes.sharding.ShardRouter'])
+    def test_signals_write_to_note_database(self):
+        """Триграммы и отпечаток пишутся в базу заметки, а не в базу текущего запроса"""
+        from . import sharding
+        from .models import NoteFingerprint, TrigramPosting
+        from .trigrams import note_trigrams
+
+        sharding.assign(self.user.pk, 'shard_1')
+        with sharding.for_user(self.user.pk):
+            note = Note.objects.create(title='Отчет', content='Текст', author=self.user)
+        with sharding.use_db('shard_0'):
+            note.title = 'Квартальный отчет'
+            note.save()
+            note.tags.add(Tag.objects.using('shard_1').create(name='квартал'))
+
+        postings = TrigramPosting.objects.using('shard_1').filter(note_id=note.pk)
+        self.assertEqual(postings.count(), len(note_trigrams('Квартальный отчет', ['квартал'])))
+        self.assertTrue(NoteFingerprint.objects.using('shard_1').filter(note_id=note.pk).exists())
+        self.assertFalse(TrigramPosting.objects.using('shard_0').exists())
+        self.assertFalse(NoteFingerprint.objects.using('shard_0').exists())
+
+    @override_settings(NOTES_SHARDS=2, DATABASE_ROUTERS=['notes.sharding.ShardRouter'])
+    def test_admin_chooses_database(self):
+        """Админка показывает выбранную базу, а не шард сотрудника"""
+        from . import sharding
+
+        staff = User.objects.create_superuser('boss', 'boss@example.com', 'pass12345')
+        sharding.assign(staff.pk, 'shard_0')
+        sharding.assign(self.user.pk, 'shard_1')
+        with sharding.for_user(self.user.pk):
+            note = Note.objects.create(title='Заметка в шарде', content='Текст', author=self.user)
+        self.client.force_login(staff)
+
+        url = reverse('admin:notes_note_changelist')
+        response = self.client.get(url)
+        self.assertNotContains(response, 'Заметка в шарде')
+        self.assertContains(response, '?shard=shard_1')
+        for params in ({'shard': 'shard_1'}, {'author': self.user.pk}, {'q': note.pk}):
+            self.assertContains(self.client.get(url, params), 'Заметка в шарде')
+
+        response = self.client.get(reverse('admin:notes_note_change', args=[note.pk]))
+        self.assertContains(response, 'Заметка в шарде')
+        response = self.client.post(reverse('admin:notes_note_delete', args=[note.pk]), {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Note.objects.using('shard_1').filter(pk=note.pk).exists())
+
+    @override_settings(NOTES_SHARDS=2)
+    def test_jobs_deferred_while_moving(self):
+        """Задача пользователя в переносе откладывается без траты попытки"""
+        from . import jobs, sharding
+        from .models import Job
+
+        sharding.assign(self.user.pk, 'default', moving_to='shard_1')
+        job = jobs.enqueue('fingerprint_notes', user=self.user, user_id=self.user.pk)
+        jobs.run_pending()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_PENDING)
+        self.assertEqual(job.attempts, 0)
+
+
+@skipUnless(HAS_SHARD_DATABASES, 'нужны базы шардов: --settings=config.test_settings')
+@override_settings(
+    NOTES_PROCESS_WORKERS=0, NOTES_SHARDS=2, DATABASE_ROUTERS=['notes.sharding.ShardRouter'],
+)
+class ShardMoveTests(TestCase):
+    """Перенос пользователя между шардами"""
+    databases = '__all__'
+
+    def test_move_user_keeps_ids_and_tags(self):
+        from . import sharding
+        from .models import ArchivedNote
+
+        user = User.objects.create_user(username='mover', password='pass12345')
+        source = sharding.db_for_user(user.pk)
+        target = next(alias for alias in sharding.shard_aliases() if alias != source)
+
+        with sharding.for_user(user.pk):
+            tag = Tag.objects.create(name='перенос')
+            notes = [
+                Note.objects.create(title=f'Заметка {i}', content='Текст', author=user)
+                for i in range(5)
+            ]
+            notes[0].tags.add(tag)
+            created_at = Note.objects.get(pk=notes[0].pk).created_at
+
+        # У каждого шарда свой диапазон id — при переносе id не конфликтуют
+        self.assertGreater(notes[0].pk, sharding.ID_RANGE)
+        moved = sharding.move_user(user.pk, target, batch_size=2, grace=0)
+
+        self.assertEqual(moved, 5)
+        self.assertEqual(sharding.db_for_user(user.pk), target)
+        self.assertFalse(Note.objects.using(source).filter(author=user).exists())
+        moved_note = Note.objects.using(target).get(pk=notes[0].pk)
+        self.assertEqual(moved_note.created_at, created_at)
+        self.assertEqual([t.name for t in moved_note.tags.all()], ['перенос'])
+        self.assertFalse(ArchivedNote.objects.using(source).exists())
+
+        client = Client()
+        client.login(username='mover', password='pass12345')
+        response = client.get(reverse('note_detail', args=[notes[1].pk]))
+        self.assertContains(response, 'Заметка 1')
+
+    def test_rebalance_requires_shared_cache(self):
+        """Без общего кэша воркеры не увидят заморозку — перенос не запускается"""
+        from django.core.management import CommandError, call_command
+
+        with self.assertRaisesMessage(CommandError, 'NOTES_CACHE_LOCATION'):
+            call_command('rebalance_shards', dry_run=True)
+
+    def test_deleting_user_removes_shard_data(self):
+        """Каскад из default не доходит до шарда — данные удаляет сигнал"""
+        user = User.objects.create_user(username='leaver', password='pass12345')
+        alias = sharding.db_for_user(user.pk)
+        with sharding.for_user(user.pk):
+            Note.objects.create(title='Останется?', content='Текст', author=user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user.delete()
+        self.assertNotEqual(alias, 'default')
+        self.assertFalse(Note.objects.using(alias).filter(author_id=user.pk).exists())
+
+
+@skipUnless(HAS_SHARD_DATABASES, 'нужны базы шардов: --settings=config.test_settings')
+@override_settings(NOTES_SHARDS=2, DATABASE_ROUTERS=['notes.sharding.ShardRouter'])
+class ShardedViewTests(ViewTests):
+    """Тесты представлений с заметками в базе шарда"""
+
+
+# ==================== СЕССИИ И КЭШ ПОЛЬЗОВАТЕЛЕЙ ====================
+
+def shared_cache_settings():
+    """Файловый кэш: общий для процессов, как при NOTES_CACHE_LOCATION"""
+    import os
+    import tempfile
+
+    return {'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'notes-test-cache'),
+    }}
+
+
+@override_settings(CACHES=shared_cache_settings(), NOTES_USER_CACHE_TIMEOUT=300)
+class SessionAuthCacheTests(NotesTestCase):
+    """Сессия и пользователь не запрашиваются из БД на повторных просмотрах"""
+
+    AUTH_TABLES = ('django_session', 'auth_user')
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='sessionuser',
+            password='sessionpass123'
+        )
+        Note.objects.create(title='Заметка сессии', content='Содержание', author=self.user)
+
+    def auth_queries(self, url):
+        """Запросы к таблицам сессий и пользователей при просмотре страницы"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [
+            query['sql'] for query in context.captured_queries
+            if any(table in query['sql'] for table in self.AUTH_TABLES)
+        ]
+
+    def test_cached_page_view_has_no_auth_queries(self):
+        """cached_db: повторный просмотр списка не обращается к сессиям и пользователям"""
+        import time
+
+        self.client.login(username='sessionuser', password='sessionpass123')
+        self.client.get(reverse('note_list'))  # прогрев кэша
+
+        start_time = time.perf_counter()
+        queries = self.auth_queries(reverse('note_list'))
+        execution_time = time.perf_counter() - start_time
+
+        self.assertEqual(queries, [])
+        print(f"Список заметок без запросов сессии/пользователя: {execution_time * 1000:.2f} мс")
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.db')
+    def test_db_sessions_baseline(self):
+        """Для сравнения: сессии в БД читаются на каждом запросе"""
+        self.client.login(username='sessionuser', password='sessionpass123')
+        self.client.get(reverse('note_list'))
+
+        queries = self.auth_queries(reverse('note_list'))
+        self.assertTrue(any('django_session' in sql for sql in queries))
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_signed_cookie_sessions(self):
+        """Сессия в подписанной cookie работает без таблицы сессий"""
+        response = self.client.post(reverse('login'), {
+            'username': 'sessionuser',
+            'password': 'sessionpass123'
+        })
+        self.assertRedirects(response, reverse('note_list'))
+        self.assertEqual(self.auth_queries(reverse('note_list')), [])
+
+    def test_password_change_invalidates_cache(self):
+        """После смены пароля закэшированный пользователь не используется"""
+        self.client.login(username='sessionuser', password='sessionpass123')
+        self.client.get(reverse('note_list'))
+
+        self.user.set_password('newsessionpass123')
+        self.user.save()
+
+        # Старая сессия больше не действительна — редирект на вход
+        response = self.client.get(reverse('note_list'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_permission_change_invalidates_cache(self):
+        """Изменение прав пользователя сбрасывает кэш"""
+        from django.contrib.auth.models import Permission
+        from .auth_backends import CachedModelBackend
+
+        backend = CachedModelBackend()
+        cached = backend.get_user(self.user.pk)
+        self.assertFalse(cached.has_perm('notes.delete_note'))
+
+        self.user.user_permissions.add(Permission.objects.get(codename='delete_note'))
+        self.assertTrue(backend.get_user(self.user.pk).has_perm('notes.delete_note'))
+
+    def test_user_cache_requires_shared_cache(self):
+        """С кэшем в памяти процесса пользователь не кэшируется, а настройка
+        NOTES_USER_CACHE_TIMEOUT считается ошибкой конфигурации"""
+        from .auth_backends import CachedModelBackend, get_cached_user
+        from .checks import check_user_cache
+
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with self.settings(CACHES=locmem):
+            CachedModelBackend().get_user(self.user.pk)
+            self.assertIsNone(get_cached_user(self.user.pk))
+            self.assertEqual([e.id for e in check_user_cache(None)], ['notes.E001'])
+            with self.settings(NOTES_USER_CACHE_TIMEOUT=0):
+                self.assertEqual(check_user_cache(None), [])
+        self.assertEqual(check_user_cache(None), [])
+
+    def test_shards_warn_without_shared_cache(self):
+        """Шарды без общего кэша — предупреждение: все версии пишутся в default"""
+        from .checks import check_shard_versions
+
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        filebased = {'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/tmp/notes-check',
+        }}
+        with self.settings(CACHES=locmem, NOTES_SHARDS=2):
+            self.assertEqual([e.id for e in check_shard_versions(None)], ['notes.W002'])
+        with self.settings(CACHES=locmem, NOTES_SHARDS=0):
+            self.assertEqual(check_shard_versions(None), [])
+        with self.settings(CACHES=filebased, NOTES_SHARDS=2):
+            self.assertEqual(check_shard_versions(None), [])
+
+
+# ==================== ЗАЩИТА ВХОДА ====================
+
+class AuthThrottleTests(NotesTestCase):
+    """Тесты ограничения попыток и пула хеширования паролей"""
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='throttleuser',
+            password='throttlepass123'
+        )
+
+    def login(self, password, username='throttleuser'):
+        return self.client.post(reverse('login'), {
+            'username': username,
+            'password': password
+        })
+
+    def test_failed_logins_limited_per_username(self):
+        """После 5 неудачных попыток вход блокируется даже с верным паролем"""
+        for _ in range(5):
+            self.assertEqual(self.login('wrongpass').status_code, 200)
+
+        response = self.login('throttlepass123')
+        self.assertEqual(response.status_code, 429)
+        self.assertContains(response, 'Слишком много попыток входа', status_code=429)
+
+    def test_successful_logins_not_limited(self):
+        """Удачные входы не расходуют попытки"""
+        for _ in range(6):
+            response = self.login('throttlepass123')
+            self.assertRedirects(response, reverse('note_list'))
+            self.client.logout()
+
+    @override_settings(NOTES_RATE_LIMITS={'register_ip': (1, 3600)})
+    def test_registration_limited_per_ip(self):
+        """Регистрации с одного адреса ограничены"""
+        data = {'password1': 'regpass12345', 'password2': 'regpass12345'}
+        response = self.client.post(reverse('register'), {'username': 'first', **data})
+        self.assertRedirects(response, reverse('note_list'))
+
+        response = self.client.post(reverse('register'), {'username': 'second', **data})
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(User.objects.filter(username='second').exists())
+
+    def test_token_bucket_refills_evenly(self):
+        """Корзина пополняется равномерно: на границе периода нет двойного всплеска"""
+        from .ratelimit import TokenBucket
+
+        bucket = TokenBucket('test_refill', 3, 60)
+        with mock.patch('notes.ratelimit.time.time', return_value=1000.0):
+            self.assertEqual([bucket.hit('1.2.3.4') for _ in range(4)], [True, True, True, False])
+        # Через 20 секунд восстановилась одна попытка, а не весь лимит
+        with mock.patch('notes.ratelimit.time.time', return_value=1020.0):
+            self.assertEqual([bucket.hit('1.2.3.4') for _ in range(2)], [True, False])
+            bucket.undo('1.2.3.4')
+            self.assertTrue(bucket.hit('1.2.3.4'))
+        with mock.patch('notes.ratelimit.time.time', return_value=1200.0):
+            self.assertEqual([bucket.hit('1.2.3.4') for _ in range(4)], [True, True, True, False])
+
+    def test_token_bucket_consumed_by_single_update(self):
+        """Попытка расходуется одним условным UPDATE: без окна между проверкой и записью"""
+        from .models import RateLimitBucket
+        from .ratelimit import TokenBucket
+
+        bucket = TokenBucket('test_atomic', 1, 60)
+        bucket.hit('key')
+        with self.assertNumQueries(2):  # get_or_create находит корзину, UPDATE ничего не меняет
+            self.assertFalse(bucket.hit('key'))
+        self.assertLess(RateLimitBucket.objects.get(key='test_atomic:key').tokens, 1)
+
+    def test_hashing_runs_in_pool(self):
+        """Проверка пароля выполняется не в потоке запроса"""
+        import threading
+        from . import hashing
+
+        self.assertNotEqual(
+            hashing.run(lambda: threading.current_thread().name),
+            threading.current_thread().name
+        )
+
+    def test_overloaded_pool_rejects_login(self):
+        """При переполненной очереди вход сразу получает 503"""
+        import threading
+        from unittest import mock
+        from . import hashing
+
+        executor, _ = hashing._pool()
+        exhausted = threading.BoundedSemaphore(1)
+        exhausted.acquire()
+        with mock.patch.object(hashing, '_pool', return_value=(executor, exhausted)):
+            response = self.login('throttlepass123')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertContains(response, 'Сервер перегружен', status_code=503)
+
+    @override_settings(
+        PASSWORD_HASHERS=['notes.hashers.TunedPBKDF2PasswordHasher'],
+        NOTES_PBKDF2_ITERATIONS=1000,
+    )
+    def test_tuned_hasher_rehashes_on_login(self):
+        """Профиль tuned пересчитывает хеш с новым числом итераций"""
+        self.assertRedirects(self.login('throttlepass123'), reverse('note_list'))
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1000$'))
+
+
 # ==================== ЗАПУСК ТЕСТОВ ====================
 
 if __name__ == '__main__':
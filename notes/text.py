@@ -0,0 +1,29 @@
+"""
+Общие функции обработки текста заметок.
+Модуль не зависит от Django, поэтому его можно импортировать в дочерних
+процессах пула.
+"""
+
+import re
+
+WORD_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Приводит строку к виду для сравнения: нижний регистр, ё -> е"""
+    return text.lower().replace('ё', 'е')
+
+
+def words(text):
+    """Слова нормализованного текста"""
+    return WORD_RE.findall(normalize(text))
+
+
+def trigrams(text):
+    """Множество триграмм слов текста, как в pg_trgm: слово дополняется
+    двумя пробелами слева и одним справа («кот» -> «  к», « ко», «кот», «от »)"""
+    result = set()
+    for word in words(text):
+        padded = f'  {word} '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
@@ -0,0 +1,80 @@
+"""
+Нечеткий поиск по заголовкам и тегам.
+Для каждой заметки хранятся триграммы ее заголовка и тегов (TrigramPosting).
+Запрос разбивается на триграммы, и по индексу (автор, триграмма) считается,
+сколько из них есть у каждой заметки. Так опечатка портит лишь пару
+триграмм, а заметка все равно находится. Работает на любой СУБД.
+"""
+
+import math
+
+from django.db.models import Count, Max
+
+from . import sharding
+from .models import Note, TrigramPosting
+from .text import trigrams
+
+MIN_SIMILARITY = 0.5  # доля триграмм запроса, которые должны найтись у заметки
+DEFAULT_LIMIT = 20
+BATCH_SIZE = 500
+
+
+def note_trigrams(title, tag_names):
+    return trigrams(' '.join([title, *tag_names]))
+
+
+def _postings(note_id, author_id, grams):
+    return [
+        TrigramPosting(note_id=note_id, author_id=author_id, trigram=gram, size=len(grams))
+        for gram in grams
+    ]
+
+
+def reindex(note_ids):
+    """Пересчитывает триграммы заметок (после изменения заголовков или тегов)"""
+    note_ids = list(note_ids)
+    if not note_ids:
+        return
+    through = Note.tags.through
+    notes = Note.objects.filter(pk__in=note_ids).order_by().values_list('pk', 'author_id', 'title')
+    tags = {}
+    for note_id, name in through.objects.filter(note_id__in=note_ids).values_list('note_id', 'tag__name'):
+        tags.setdefault(note_id, []).append(name)
+
+    postings = []
+    for note_id, author_id, title in notes:
+        postings.extend(_postings(note_id, author_id, note_trigrams(title, tags.get(note_id, []))))
+    with sharding.atomic():
+        TrigramPosting.objects.filter(note_id__in=note_ids).delete()
+        TrigramPosting.objects.bulk_create(postings, batch_size=BATCH_SIZE)
+
+
+def update_note(note):
+    reindex([note.pk])
+
+
+def backfill(queryset=None, batch_size=BATCH_SIZE):
+    """Пересчитывает триграммы заметок queryset пачками. Возвращает их число."""
+    if queryset is None:
+        queryset = Note.objects.all()
+    ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(ids), batch_size):
+        reindex(ids[start:start + batch_size])
+    return len(ids)
+
+
+def search(user_id, query, limit=DEFAULT_LIMIT, min_similarity=MIN_SIMILARITY):
+    """Пары (id заметки, сходство) по убыванию сходства.
+    Сходство — доля триграмм запроса, найденных у заметки; при равенстве
+    выше заметки с меньшим числом триграмм (короче и точнее)."""
+    grams = trigrams(query)
+    if not grams:
+        return []
+    rows = (
+        TrigramPosting.objects.filter(author_id=user_id, trigram__in=grams)
+        .values('note_id')
+        .annotate(shared=Count('note_id'), size=Max('size'))
+        .filter(shared__gte=math.ceil(min_similarity * len(grams)))
+        .order_by('-shared', 'size', '-note_id')[:limit]
+    )
+    return [(row['note_id'], row['shared'] / len(grams)) for row in rows]
@@ -11,12 +11,34 @@ urlpatterns = [
     path('login/', CustomLoginView.as_view(), name='login'),
     path('logout/', views.custom_logout, name='logout'),
     path('register/', views.register, name='register'),
+    path('account/delete/', views.account_delete, name='account_delete'),
 
     # Заметки
     path('', NoteListView.as_view(), name='note_list'),
     path('search/', views.note_search, name='note_search'),
+    path('search/suggest/', views.note_suggest, name='note_suggest'),
+    path('bulk/', views.note_bulk, name='note_bulk'),
+    path('events/', views.note_events, name='note_events'),
     path('note/new/', NoteCreateView.as_view(), name='note_create'),
     path('note/<int:pk>/', NoteDetailView.as_view(), name='note_detail'),
     path('note/<int:pk>/edit/', NoteUpdateView.as_view(), name='note_update'),
     path('note/<int:pk>/delete/', NoteDeleteView.as_view(), name='note_delete'),
+    path('note/<int:pk>/attachments/', views.attachment_upload, name='attachment_upload'),
+    path('attachment/<int:pk>/', views.attachment_download, name='attachment_download'),
+    path('attachment/<int:pk>/thumbnail/', views.attachment_thumbnail, name='attachment_thumbnail'),
+    path('attachment/<int:pk>/delete/', views.attachment_delete, name='attachment_delete'),
+    path('archive/', views.archive_list, name='archive_list'),
+    path('duplicates/', views.note_duplicates, name='note_duplicates'),
+    path('duplicates/merge/', views.note_duplicates_merge, name='note_duplicates_merge'),
+    path('duplicates/rebuild/', views.note_duplicates_rebuild, name='note_duplicates_rebuild'),
+
+    # Метрики (Prometheus)
+    path('metrics', views.metrics_view, name='metrics'),
+
+    # Фоновые задачи
+    path('jobs/', views.job_list, name='job_list'),
+    path('jobs/<int:pk>/', views.job_detail, name='job_detail'),
+    path('jobs/<int:pk>/download/', views.job_download, name='job_download'),
+    path('export/', views.note_export, name='note_export'),
+    path('import/', views.note_import, name='note_import'),
 ]
\ No newline at end of file
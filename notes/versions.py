@@ -0,0 +1,95 @@
+"""
+Версии пользовательских данных.
+Счетчик меняется при каждом изменении заметок пользователя, по нему кэши
+в памяти процесса понимают, что устарели. Счетчики должны быть видны всем
+процессам (воркерам gunicorn, run_jobs): они хранятся в кэше Django, если
+он общий, иначе — в таблице DataVersion. Прочитанную из таблицы версию процесс
+помнит NOTES_VERSION_LOCAL_TTL секунд: свои изменения он видит сразу,
+чужие — с этой задержкой.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import F
+
+VERSION_TIMEOUT = None  # версии храним без срока
+VERSION_LOCAL_TTL = 2  # секунд, сколько процесс помнит версию из таблицы
+
+# Области версионирования
+NOTES_SCOPE = 'notes'
+USER_SCOPE = 'user'
+
+# Бэкенды, данные которых не видны другим процессам
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def cache_is_shared():
+    """Общий ли кэш default для всех процессов (файловый, memcached, redis, БД)"""
+    return settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES
+
+
+def _initial_version():
+    # Начальное значение зависит от времени: если ключ вытеснят из кэша,
+    # новая версия не совпадет ни с одной из уже выданных.
+    return int(time.time() * 1000)
+
+
+def _version_key(scope, user_id):
+    return f'notes:version:{scope}:{user_id}'
+
+
+# Версии из таблицы, прочитанные этим процессом: ключ -> (версия, когда прочитана)
+_local_versions = {}
+
+
+def _local_ttl():
+    return getattr(settings, 'NOTES_VERSION_LOCAL_TTL', VERSION_LOCAL_TTL)
+
+
+def _versions():
+    from .models import DataVersion
+
+    return DataVersion.objects.using(DEFAULT_DB_ALIAS)
+
+
+def get_version(scope, user_id):
+    """Текущая версия данных пользователя в заданной области"""
+    key = _version_key(scope, user_id)
+    if not cache_is_shared():
+        now = time.monotonic()
+        remembered = _local_versions.get(key)
+        if remembered and now - remembered[1] < _local_ttl():
+            return remembered[0]
+        version = _versions().filter(key=key).values_list('version', flat=True).first()
+        if version is None:
+            row, _ = _versions().get_or_create(key=key, defaults={'version': _initial_version()})
+            version = row.version
+        _local_versions[key] = (version, now)
+        return version
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), VERSION_TIMEOUT)
+        version = cache.get(key, 0)
+    return version
+
+
+def bump_version(scope, user_id):
+    """Увеличивает версию, сбрасывая все кэши этой области"""
+    key = _version_key(scope, user_id)
+    if not cache_is_shared():
+        if not _versions().filter(key=key).update(version=F('version') + 1):
+            row, created = _versions().get_or_create(key=key, defaults={'version': _initial_version()})
+            if not created:
+                _versions().filter(key=key).update(version=F('version') + 1)
+        _local_versions.pop(key, None)
+        return
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _initial_version(), VERSION_TIMEOUT)
@@ -1,35 +1,72 @@
+import hmac
+import uuid
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import require_POST
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login, logout
 from django.contrib import messages
 from django.contrib.auth.views import LoginView
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.db.models import Q
-from .models import Note
-from .forms import NoteForm
+from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIRequest
+from django.core.paginator import Paginator
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from .models import ArchivedNote, Attachment, Job, Note
+from .forms import NoteForm, NoteImportForm, RateLimitedAuthenticationForm, RegistrationForm
+from . import (
+    archive, attachments, bulk, events, fingerprints, markup, hashing, jobs, metrics, purge,
+    related, suggest,
+)
+from .ratelimit import TokenBucket, client_ip
+from .search import find_note_ids, search_page, user_notes
+from .tasks import IMPORT_DIR, media_path
 
 # ============= АУТЕНТИФИКАЦИЯ =============
 
 def register(request):
     """Регистрация нового пользователя"""
+    status = 200
     if request.method == 'POST':
-        form = UserCreationForm(request.POST)
-        if form.is_valid():
-            user = form.save()
-            login(request, user)
-            messages.success(request, 'Регистрация успешна! Добро пожаловать!')
-            return redirect('note_list')
+        form = RegistrationForm(request.POST)
+        if not TokenBucket.named('register_ip').hit(client_ip(request)):
+            form.add_error(None, 'Слишком много регистраций с вашего адреса. Попробуйте позже.')
+            status = 429
+        elif form.is_valid():
+            try:
+                user = form.save()
+            except hashing.AuthOverloaded:
+                form.add_error(None, 'Сервер перегружен, попробуйте через минуту.')
+                status = 503
+            else:
+                login(request, user, backend='notes.auth_backends.CachedModelBackend')
+                messages.success(request, 'Регистрация успешна! Добро пожаловать!')
+                return redirect('note_list')
     else:
-        form = UserCreationForm()
-    return render(request, 'notes/register.html', {'form': form})
+        form = RegistrationForm()
+    return render(request, 'notes/register.html', {'form': form}, status=status)
 
 
 class CustomLoginView(LoginView):
     """Кастомная страница входа"""
     template_name = 'notes/login.html'
+    authentication_form = RateLimitedAuthenticationForm
+
+    def form_invalid(self, form):
+        """429 при превышении лимита попыток, 503 при перегрузке"""
+        response = super().form_invalid(form)
+        if form.has_error('__all__', 'rate_limited'):
+            response.status_code = 429
+        elif form.has_error('__all__', 'overloaded'):
+            response.status_code = 503
+        return response
 
     def get_success_url(self):
         messages.success(self.request, f'Добро пожаловать, {self.request.user.username}!')
@@ -43,6 +80,19 @@ def custom_logout(request):
     return redirect('login')
 
 
+@login_required
+def account_delete(request):
+    """Удаление аккаунта: выполняется в фоне, аккаунт сразу блокируется"""
+    if request.method == 'POST':
+        purge.schedule_account_deletion(request.user)
+        logout(request)
+        messages.info(request, 'Аккаунт будет удален в ближайшее время.')
+        return redirect('login')
+    return render(request, 'notes/account_confirm_delete.html', {
+        'notes_count': request.user.notes.count(),
+    })
+
+
 # ============= ЗАМЕТКИ =============
 
 class NoteListView(LoginRequiredMixin, ListView):
@@ -54,25 +104,112 @@ class NoteListView(LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         """Возвращает только заметки текущего пользователя"""
-        return Note.objects.filter(author=self.request.user).order_by('-updated_at')
+        return user_notes(self.request.user).order_by('-updated_at')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['bulk_actions'] = bulk.ACTIONS
+        context['live_prepend'] = context['page_obj'].number == 1
+        return context
 
 
 @login_required
 def note_search(request):
-    """Поиск заметок"""
+    """Поиск заметок постранично (с ?format=json — следующая порция для «Показать еще»)"""
     query = request.GET.get('q', '')
-    notes = Note.objects.filter(author=request.user)
+    page_obj, fuzzy_count, capped = search_page(request.user, query, request.GET.get('page'))
+    next_page = page_obj.next_page_number() if page_obj.has_next() else None
 
-    if query:
-        notes = notes.filter(
-            Q(title__icontains=query) |
-            Q(content__icontains=query)
-        )
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'notes': [
+                {'id': note.pk, 'html': render_to_string('notes/_note_card.html', {'note': note})}
+                for note in page_obj.object_list
+            ],
+            'next_page': next_page,
+            'count': page_obj.paginator.count,
+            'capped': capped,
+        })
 
     return render(request, 'notes/note_list.html', {
-        'notes': notes,
+        'notes': page_obj.object_list,
+        'page_obj': page_obj,
+        'is_paginated': page_obj.has_other_pages(),
+        'next_page': next_page,
+        'result_count': page_obj.paginator.count,
+        'capped': capped,
+        'fuzzy_count': fuzzy_count,
         'query': query,
-        'is_search': True
+        'is_search': True,
+        'bulk_actions': bulk.ACTIONS,
+    })
+
+
+@login_required
+@require_POST
+def note_bulk(request):
+    """Массовые действия над выбранными заметками или над всеми найденными"""
+    action = request.POST.get('action', '')
+    next_url = request.POST.get('next', '')
+    if not next_url.startswith('/') or next_url.startswith('//'):
+        next_url = reverse('note_list')
+
+    if action not in bulk.ACTIONS:
+        messages.error(request, 'Выберите действие.')
+        return redirect(next_url)
+
+    if request.POST.get('select_all'):
+        ids = find_note_ids(request.user, request.POST.get('q', ''))
+    else:
+        notes = user_notes(request.user).filter(pk__in=[
+            pk for pk in request.POST.getlist('ids') if pk.isdigit()
+        ])
+        ids = list(notes.order_by('pk').values_list('pk', flat=True))
+    if not ids:
+        messages.info(request, 'Не выбрано ни одной заметки.')
+        return redirect(next_url)
+
+    try:
+        tag_id = bulk.resolve_tag(action, request.POST.get('tag', ''))
+    except ValueError as error:
+        messages.error(request, str(error))
+        return redirect(next_url)
+
+    if len(ids) > bulk.SYNC_LIMIT:
+        job = jobs.enqueue(
+            'bulk_notes', user=request.user, priority=1,
+            user_id=request.user.pk, action=action, ids=ids, tag_id=tag_id,
+        )
+        messages.info(request, f'Выбрано заметок: {len(ids)}. Обработка идет в фоне.')
+        return redirect(job)
+
+    count = bulk.apply(action, request.user.pk, ids, tag_id)
+    messages.success(request, f'{bulk.ACTIONS[action]}: {count} зам.')
+    return redirect(next_url)
+
+
+@login_required
+def note_suggest(request):
+    """Подсказки для строки поиска (JSON, вызывается при каждом нажатии клавиши)"""
+    query = request.GET.get('q', '')
+    try:
+        limit = int(request.GET.get('limit', suggest.DEFAULT_LIMIT))
+    except ValueError:
+        limit = suggest.DEFAULT_LIMIT
+    limit = max(1, min(limit, suggest.MAX_LIMIT))
+
+    notes, tags = suggest.get_index(request.user.pk).suggest(query, limit)
+    search_url = reverse('note_search')
+    return JsonResponse({
+        'query': query,
+        'notes': [
+            {'title': title, 'url': reverse('note_detail', kwargs={'pk': pk})}
+            for pk, title in notes
+        ],
+        'tags': [
+            {'name': name, 'url': f'{search_url}?{urlencode({"q": name})}'}
+            for name in tags
+        ],
     })
 
 
@@ -86,6 +223,28 @@ class NoteDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
         note = self.get_object()
         return self.request.user == note.author
 
+    def get_object(self, queryset=None):
+        """Заметка из архива восстанавливается при открытии"""
+        try:
+            return super().get_object(queryset)
+        except Http404:
+            note = archive.restore(self.kwargs['pk'], self.request.user)
+            if note is None:
+                raise
+            return note
+
+    def get_context_data(self, **kwargs):
+        """Добавляет готовый HTML текста, вложения и похожие заметки пользователя"""
+        archive.mark_viewed(self.object)
+        context = super().get_context_data(**kwargs)
+        context['content_html'] = markup.rendered_html(self.object)
+        # Blob в другой базе — join невозможен, поэтому prefetch
+        context['attachments'] = self.object.attachments.prefetch_related('blob')
+        ids = related.related_note_ids(self.object)
+        notes = Note.objects.filter(pk__in=ids, author=self.request.user).in_bulk()
+        context['related_notes'] = [notes[pk] for pk in ids if pk in notes]
+        return context
+
 
 class NoteCreateView(LoginRequiredMixin, CreateView):
     """Создание новой заметки"""
@@ -136,4 +295,268 @@ class NoteDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     def delete(self, request, *args, **kwargs):
         """Сообщение об успешном удалении"""
         messages.success(self.request, 'Заметка успешно удалена!')
-        return super().delete(request, *args, **kwargs)
\ No newline at end of file
+        return super().delete(request, *args, **kwargs)
+
+    def form_valid(self, form):
+        """Файлы вложений освобождаются после удаления заметки"""
+        hashes = attachments.note_blobs([self.object])
+        response = super().form_valid(form)
+        attachments.release_on_commit(hashes)
+        return response
+
+
+async def note_events(request):
+    """Поток изменений заметок пользователя (Server-Sent Events).
+    Держать соединение открытым может только ASGI-сервер; под WSGI отвечаем
+    204 — браузер не переподключается, страница работает как раньше."""
+    user_id = await sync_to_async(lambda: request.user.pk)()
+    if user_id is None:
+        return HttpResponse(status=403)
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    return StreamingHttpResponse(
+        events.stream(user_id),
+        content_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+# ============= ДУБЛИКАТЫ =============
+
+@login_required
+def note_duplicates(request):
+    """Группы возможных дубликатов — результат последнего расчета в фоне"""
+    groups, current = fingerprints.latest_groups(request.user)
+    notes = Note.objects.filter(
+        pk__in=[pk for group in groups for pk in group],
+        author=request.user,
+    ).in_bulk()
+    duplicate_groups = []
+    for group in groups:
+        group_notes = sorted(
+            (notes[pk] for pk in group if pk in notes),
+            key=lambda note: note.updated_at,
+            reverse=True,
+        )
+        if len(group_notes) > 1:
+            duplicate_groups.append(group_notes)
+    return render(request, 'notes/note_duplicates.html', {
+        'duplicate_groups': duplicate_groups,
+        'groups_current': current,
+    })
+
+
+@login_required
+@require_POST
+def note_duplicates_merge(request):
+    """Объединение дубликатов: выбранная заметка остается, остальные удаляются.
+    С merge_all объединяются все группы, остается самая свежая заметка —
+    только если группы посчитаны по текущим заметкам."""
+    own_notes = Note.objects.filter(author=request.user)
+    merged = 0
+
+    if request.POST.get('merge_all'):
+        groups, current = fingerprints.latest_groups(request.user)
+        if not current:
+            messages.info(request, 'Дубликаты пересчитываются, повторите через минуту.')
+            return redirect('note_duplicates')
+        for group in groups:
+            group_notes = list(own_notes.filter(pk__in=group).order_by('-updated_at'))
+            if len(group_notes) > 1:
+                merged += fingerprints.merge_notes(group_notes[0], group_notes[1:])
+    else:
+        keep = get_object_or_404(own_notes, pk=request.POST.get('keep'))
+        others = own_notes.filter(pk__in=request.POST.getlist('merge')).exclude(pk=keep.pk)
+        merged = fingerprints.merge_notes(keep, others)
+
+    if merged:
+        messages.success(request, f'Объединено дубликатов: {merged}')
+    else:
+        messages.info(request, 'Нет заметок для объединения.')
+    return redirect('note_duplicates')
+
+
+@login_required
+@require_POST
+def note_duplicates_rebuild(request):
+    """Пересчет отпечатков заметок в фоне"""
+    job = jobs.enqueue(fingerprints.JOB_KIND, user=request.user, user_id=request.user.pk)
+    return redirect(job)
+
+
+# ============= АРХИВ =============
+
+@login_required
+def archive_list(request):
+    """Архив: давно не открытые заметки. Поиск только по заголовку."""
+    query = request.GET.get('q', '').strip()
+    notes = ArchivedNote.objects.filter(author=request.user).only(
+        'id', 'title', 'tag_names', 'updated_at', 'archived_at'
+    )
+    if query:
+        notes = notes.filter(title__icontains=query)
+    page_obj = Paginator(notes, 20).get_page(request.GET.get('page'))
+    return render(request, 'notes/archive_list.html', {
+        'page_obj': page_obj,
+        'notes': page_obj.object_list,
+        'query': query,
+        'archive_after_months': archive.archive_after_months(),
+    })
+
+
+# ============= ВЛОЖЕНИЯ =============
+
+@csrf_exempt
+@login_required
+@require_POST
+def attachment_upload(request, pk):
+    """Загрузка вложений. Обработчик задается до чтения тела запроса:
+    файлы пишутся на диск кусками, хеш считается по ходу."""
+    request.upload_handlers = [attachments.HashingFileUploadHandler(request)]
+    # CSRF проверяется после замены обработчиков (проверка читает тело)
+    return _attachment_upload(request, pk)
+
+
+@csrf_protect
+def _attachment_upload(request, pk):
+    note = get_object_or_404(Note, pk=pk, author=request.user)
+    files = request.FILES.getlist('files')
+    limit = attachments.max_size() // (1024 * 1024)
+    for name in request.upload_handlers[0].too_large:
+        messages.error(request, f'{name}: файл больше {limit} МБ')
+
+    added = 0
+    for uploaded in files:
+        try:
+            attachments.attach(note, uploaded)
+            added += 1
+        except attachments.UploadError as error:
+            messages.error(request, str(error))
+    if added:
+        messages.success(request, f'Добавлено вложений: {added}')
+    return redirect(note)
+
+
+@login_required
+def attachment_download(request, pk):
+    """Скачивание вложения (с поддержкой Range)"""
+    item = get_object_or_404(Attachment, pk=pk, author=request.user)
+    blob = item.blob
+    path = attachments.blob_path(blob.sha256)
+    if not path.exists():
+        raise Http404('Файл не найден')
+    return attachments.file_response(
+        request, path, blob.content_type, item.filename, blob.sha256, inline=blob.is_image
+    )
+
+
+@login_required
+def attachment_thumbnail(request, pk):
+    """Миниатюра картинки"""
+    item = get_object_or_404(Attachment, pk=pk, author=request.user)
+    path = attachments.thumbnail_path(item.blob_id)
+    if not path.exists():
+        raise Http404('Миниатюры нет')
+    return attachments.file_response(
+        request, path, 'image/jpeg', f'{item.filename}.jpg', f'{item.blob_id}-thumb', inline=True
+    )
+
+
+@login_required
+@require_POST
+def attachment_delete(request, pk):
+    """Удаление вложения; файл удаляется, если больше нигде не используется"""
+    item = get_object_or_404(Attachment, pk=pk, author=request.user)
+    note_id = item.note_id
+    item.delete()
+    attachments.release(item.blob_id)
+    messages.success(request, 'Вложение удалено.')
+    return redirect('note_detail', pk=note_id)
+
+
+# ============= ФОНОВЫЕ ЗАДАЧИ =============
+
+@login_required
+def job_list(request):
+    """Фоновые задачи пользователя, экспорт и импорт"""
+    return render(request, 'notes/job_list.html', {
+        'jobs': Job.objects.filter(user=request.user)[:50],
+        'import_form': NoteImportForm(),
+    })
+
+
+@login_required
+def job_detail(request, pk):
+    """Статус фоновой задачи (с ?format=json — для опроса со страницы)"""
+    job = get_object_or_404(Job, pk=pk, user=request.user)
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'id': job.pk,
+            'status': job.status,
+            'status_display': job.get_status_display(),
+            'progress': job.progress,
+            'message': job.message,
+            'finished': job.is_finished,
+        })
+    return render(request, 'notes/job_detail.html', {'job': job})
+
+
+@login_required
+def job_download(request, pk):
+    """Скачивание результата экспорта"""
+    job = get_object_or_404(
+        Job, pk=pk, user=request.user, kind='export_notes', status=Job.STATUS_DONE
+    )
+    path = media_path(job.result['file'])
+    if not path.exists():
+        raise Http404('Файл экспорта не найден')
+    return FileResponse(
+        open(path, 'rb'),
+        as_attachment=True,
+        filename=f'notes-{job.pk}.json',
+        content_type='application/json',
+    )
+
+
+@login_required
+@require_POST
+def note_export(request):
+    """Постановка экспорта заметок в очередь"""
+    job = jobs.enqueue('export_notes', user=request.user, user_id=request.user.pk)
+    messages.success(request, 'Экспорт поставлен в очередь.')
+    return redirect(job)
+
+
+@login_required
+@require_POST
+def note_import(request):
+    """Загрузка файла и постановка импорта в очередь"""
+    form = NoteImportForm(request.POST, request.FILES)
+    if not form.is_valid():
+        for error in form.errors.get('file', []):
+            messages.error(request, error)
+        return redirect('job_list')
+
+    name = default_storage.save(f'{IMPORT_DIR}/{uuid.uuid4().hex}.json', form.cleaned_data['file'])
+    # Повтор после частичного импорта создал бы дубликаты, поэтому одна попытка
+    job = jobs.enqueue(
+        'import_notes', user=request.user, max_attempts=1,
+        user_id=request.user.pk, file=name,
+    )
+    messages.success(request, 'Импорт поставлен в очередь.')
+    return redirect(job)
+
+
+# ============= МЕТРИКИ =============
+
+def metrics_view(request):
+    """Метрики для Prometheus: для персонала или по токену NOTES_METRICS_TOKEN
+    (заголовок Authorization: Bearer <токен>)"""
+    token = getattr(settings, 'NOTES_METRICS_TOKEN', '')
+    header = request.headers.get('Authorization', '')
+    authorized = request.user.is_staff or (
+        token and hmac.compare_digest(header.encode(), f'Bearer {token}'.encode())
+    )
+    if not authorized:
+        return HttpResponse(status=403)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,142 @@
+"""
+Прогрев процесса перед первыми запросами (NOTES_WARMUP).
+Без прогрева первый запрос каждого воркера после деплоя или перезапуска
+(max_requests) платит за импорт представлений, компиляцию URLconf,
+разбор шаблонов и подключение к БД. warm_up делает это при загрузке
+приложения (config/wsgi.py, config/asgi.py).
+
+С gunicorn preload_app (gunicorn.conf.py) приложение загружается и
+прогревается один раз в мастере, воркеры получают его через fork.
+Соединения с БД и пулы не наследуются: мастер закрывает их перед fork
+(before_fork), каждый воркер открывает свои (after_fork). gc.freeze()
+убирает прогретые объекты из обхода сборщика мусора, поэтому их страницы
+памяти остаются общими с мастером, а не копируются в каждый воркер.
+"""
+
+import gc
+import logging
+import time
+from contextlib import contextmanager
+from importlib import import_module
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Модули, которые иначе импортируются только первым запросом
+MODULES = (
+    'notes.views', 'notes.admin', 'notes.forms', 'notes.search', 'notes.events',
+    'django.contrib.admin.views.main', 'django.contrib.auth.views',
+)
+FORKING = False  # gunicorn.conf.py: соединения открываются после fork, в воркере
+
+
+def is_enabled():
+    return getattr(settings, 'NOTES_WARMUP', False)
+
+
+@contextmanager
+def _stage(timings, name):
+    start = time.perf_counter()
+    yield
+    timings[name] = time.perf_counter() - start
+
+
+def import_modules():
+    for name in MODULES:
+        import_module(name)
+
+
+def compile_urls():
+    """Разбор URLconf и компиляция регулярных выражений всех маршрутов"""
+    from django.urls import get_resolver
+
+    resolver = get_resolver()
+    resolver.reverse_dict  # noqa: B018 — заполняет индексы resolve и reverse
+    return len(resolver.url_patterns)
+
+
+def load_templates():
+    """Шаблоны проекта разбираются и попадают в кэширующий загрузчик"""
+    from django.template import TemplateSyntaxError, engines
+
+    count = 0
+    for engine in engines.all():
+        for directory in getattr(engine, 'engine', engine).dirs:
+            directory = Path(directory)
+            for path in sorted(directory.rglob('*.html')):
+                name = path.relative_to(directory).as_posix()
+                try:
+                    engine.get_template(name)
+                except TemplateSyntaxError:
+                    logger.exception('Шаблон %s не разобран при прогреве', name)
+                else:
+                    count += 1
+    return count
+
+
+def prime_process():
+    """Объекты, которые создаются лениво при первом обращении"""
+    from django.contrib.auth.hashers import get_hashers
+
+    from . import markup
+
+    get_hashers()
+    markup.render('**прогрев**')
+
+
+def connect():
+    """Соединения с БД и кэш типов содержимого (права, админка).
+    Вызывается в каждом процессе, обслуживающем запросы."""
+    from django.apps import apps
+    from django.contrib.contenttypes.models import ContentType
+
+    for connection in connections.all():
+        connection.ensure_connection()
+    ContentType.objects.get_for_models(*apps.get_models())
+
+
+def warm_up(connect_db=True):
+    """Прогревает процесс. Возвращает время этапов в секундах."""
+    timings = {}
+    with _stage(timings, 'imports'):
+        import_modules()
+    with _stage(timings, 'urls'):
+        compile_urls()
+    with _stage(timings, 'templates'):
+        load_templates()
+    with _stage(timings, 'process'):
+        prime_process()
+    if connect_db:
+        with _stage(timings, 'database'):
+            connect()
+    logger.info(
+        'Прогрев: %s', ', '.join(f'{name} {value * 1000:.0f} мс' for name, value in timings.items())
+    )
+    return timings
+
+
+def on_load(connect_db=True):
+    """Вызывается точкой входа после создания приложения"""
+    if is_enabled():
+        # В мастере gunicorn соединения не открываем: они не переживут fork
+        warm_up(connect_db=connect_db and not FORKING)
+
+
+# ============= GUNICORN =============
+
+def before_fork():
+    """В мастере перед созданием воркера"""
+    from . import background
+
+    connections.close_all()
+    background.shutdown()
+    gc.freeze()
+
+
+def after_fork():
+    """В воркере сразу после fork"""
+    if is_enabled():
+        connect()
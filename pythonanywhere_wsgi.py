@@ -7,8 +7,7 @@ if path not in sys.path:
     sys.path.append(path)
 
 # Указываем Django, какой файл настроек использовать
-os.environ['DJANGO_SETTINGS_MODULE'] = 'notes_project.settings'
+os.environ['DJANGO_SETTINGS_MODULE'] = 'config.settings'
 
-# Импортируем WSGI приложение Django
-from django.core.wsgi import get_wsgi_application
-application = get_wsgi_application()
\ No newline at end of file
+# Импортируем WSGI приложение проекта (с прогревом при NOTES_WARMUP=1)
+from config.wsgi import application  # noqa: E402,F401
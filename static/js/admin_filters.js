@@ -0,0 +1,16 @@
+// Фильтр по автору в админке: выбор в поле с автодополнением применяет фильтр
+'use strict';
+{
+    const $ = django.jQuery;
+
+    $(document).on('change', '.author-filter select', function() {
+        const filter = this.closest('.author-filter');
+        const base = filter.dataset.base;
+        if (!this.value) {
+            window.location.search = base;
+            return;
+        }
+        const separator = base.length > 1 ? '&' : '';
+        window.location.search = base + separator + filter.dataset.parameter + '=' + encodeURIComponent(this.value);
+    });
+}
@@ -3,7 +3,7 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // Автоматическое скрытие сообщений через 5 секунд
     setTimeout(function() {
-        const alerts = document.querySelectorAll('.alert');
+        const alerts = document.querySelectorAll('.alert:not(.live-hint)');
         alerts.forEach(function(alert) {
             const bsAlert = new bootstrap.Alert(alert);
             bsAlert.close();
@@ -40,6 +40,34 @@ document.addEventListener('DOMContentLoaded', function() {
         searchInput.addEventListener('blur', function() {
             this.parentElement.classList.remove('focused');
         });
+
+        if (searchInput.dataset.suggestUrl) {
+            initSearchSuggest(searchInput);
+        }
+    }
+
+    // Массовые действия над заметками
+    const bulkForm = document.getElementById('bulk-form');
+    if (bulkForm) {
+        initBulkActions(bulkForm);
+    }
+
+    // Подгрузка следующих результатов поиска
+    const moreButton = document.querySelector('.search-more');
+    if (moreButton) {
+        initSearchMore(moreButton);
+    }
+
+    // Изменения заметок из других вкладок и устройств
+    const liveRoot = document.querySelector('[data-events-url]');
+    if (liveRoot) {
+        initLiveUpdates(liveRoot);
+    }
+
+    // Обновление статуса фоновой задачи
+    const jobCard = document.querySelector('[data-job-status-url]');
+    if (jobCard) {
+        pollJobStatus(jobCard);
     }
 
     // Подсчет символов в текстовом поле
@@ -85,4 +113,243 @@ function formatDate(dateString) {
         hour: '2-digit',
         minute: '2-digit'
     });
-}
\ No newline at end of file
+}
+
+// Подсказки при вводе поискового запроса
+function initSearchSuggest(input) {
+    const box = input.form.querySelector('.search-suggest');
+    const DEBOUNCE_MS = 150;
+    let timer = null;
+    let controller = null;
+
+    function hide() {
+        box.classList.add('d-none');
+        box.replaceChildren();
+    }
+
+    function addItem(text, url, icon) {
+        const link = document.createElement('a');
+        link.className = 'list-group-item list-group-item-action text-truncate';
+        link.href = url;
+        const i = document.createElement('i');
+        i.className = 'bi ' + icon + ' me-2';
+        link.appendChild(i);
+        link.appendChild(document.createTextNode(text));
+        box.appendChild(link);
+    }
+
+    function render(data) {
+        box.replaceChildren();
+        data.notes.forEach(function(note) {
+            addItem(note.title, note.url, 'bi-journal-text');
+        });
+        data.tags.forEach(function(tag) {
+            addItem(tag.name, tag.url, 'bi-tag');
+        });
+        box.classList.toggle('d-none', !box.children.length);
+    }
+
+    function fetchSuggestions(query) {
+        // Отменяем предыдущий запрос: его ответ уже не нужен
+        if (controller) {
+            controller.abort();
+        }
+        controller = new AbortController();
+
+        const url = input.dataset.suggestUrl + '?q=' + encodeURIComponent(query);
+        fetch(url, {
+            signal: controller.signal,
+            headers: {'Accept': 'application/json'},
+            credentials: 'same-origin'
+        })
+            .then(function(response) {
+                return response.ok ? response.json() : null;
+            })
+            .then(function(data) {
+                if (data && data.query === input.value.trim()) {
+                    render(data);
+                }
+            })
+            .catch(function(err) {
+                if (err.name !== 'AbortError') {
+                    console.error('Ошибка подсказок: ', err);
+                }
+            });
+    }
+
+    input.addEventListener('input', function() {
+        clearTimeout(timer);
+        const query = input.value.trim();
+        if (!query) {
+            if (controller) {
+                controller.abort();
+            }
+            hide();
+            return;
+        }
+        timer = setTimeout(function() {
+            fetchSuggestions(query);
+        }, DEBOUNCE_MS);
+    });
+
+    input.addEventListener('keydown', function(e) {
+        if (e.key === 'Escape') {
+            hide();
+        }
+    });
+
+    document.addEventListener('click', function(e) {
+        if (!input.form.contains(e.target)) {
+            hide();
+        }
+    });
+}
+
+// Опрос статуса фоновой задачи, пока она не завершится
+function pollJobStatus(card) {
+    const url = card.dataset.jobStatusUrl;
+    const bar = card.querySelector('.job-progress');
+
+    function poll() {
+        fetch(url, {headers: {'Accept': 'application/json'}, credentials: 'same-origin'})
+            .then(function(response) {
+                return response.json();
+            })
+            .then(function(job) {
+                if (job.finished) {
+                    window.location.reload();
+                    return;
+                }
+                card.querySelector('.job-status').textContent = job.status_display;
+                card.querySelector('.job-message').textContent = job.message;
+                bar.style.width = job.progress + '%';
+                bar.textContent = job.progress + '%';
+                setTimeout(poll, 2000);
+            })
+            .catch(function(err) {
+                console.error('Ошибка статуса задачи: ', err);
+            });
+    }
+
+    setTimeout(poll, 1000);
+}
+
+// Панель массовых действий на списке заметок
+function initBulkActions(form) {
+    const selectPage = form.querySelector('#bulk-select-page');
+    const selectAll = form.querySelector('#bulk-select-all');
+    const action = form.querySelector('select[name="action"]');
+    const tagInput = form.querySelector('.bulk-tag');
+    const checkboxes = document.querySelectorAll('.bulk-select');
+
+    selectPage.addEventListener('change', function() {
+        checkboxes.forEach(function(checkbox) {
+            checkbox.checked = selectPage.checked;
+        });
+    });
+
+    action.addEventListener('change', function() {
+        const needsTag = action.value === 'add_tag' || action.value === 'remove_tag';
+        tagInput.classList.toggle('d-none', !needsTag);
+        tagInput.required = needsTag;
+    });
+
+    form.addEventListener('submit', function(e) {
+        const selected = document.querySelectorAll('.bulk-select:checked').length;
+        if (!selectAll.checked && !selected) {
+            e.preventDefault();
+            alert('Выберите заметки');
+            return;
+        }
+        if (action.value === 'delete') {
+            const what = selectAll.checked ? 'все выбранные запросом' : selected;
+            if (!confirm('Удалить заметки (' + what + ')? Это действие нельзя отменить.')) {
+                e.preventDefault();
+            }
+        }
+    });
+}
+
+// Список заметок обновляется по событиям сервера (SSE), без перезагрузки
+function initLiveUpdates(root) {
+    if (!window.EventSource) {
+        return;
+    }
+    const hint = root.querySelector('.live-hint');
+    const limit = parseInt(root.dataset.livePrepend || '0', 10);
+    const source = new EventSource(root.dataset.eventsUrl);
+
+    function fromHtml(html) {
+        const template = document.createElement('template');
+        template.innerHTML = html.trim();
+        return template.content.firstElementChild;
+    }
+
+    source.addEventListener('note', function(e) {
+        const event = JSON.parse(e.data);
+        const grid = root.querySelector('.notes-grid');
+        const card = event.id ? root.querySelector('[data-note-id="' + event.id + '"]') : null;
+
+        if (event.type === 'deleted') {
+            if (card) {
+                card.remove();
+            }
+            return;
+        }
+        if (event.type === 'created' || event.type === 'updated') {
+            // Первая страница отсортирована по дате изменения — карточка наверх
+            if (limit && grid) {
+                if (card) {
+                    card.remove();
+                }
+                grid.prepend(fromHtml(event.html));
+                while (grid.children.length > limit) {
+                    grid.lastElementChild.remove();
+                }
+                return;
+            }
+            if (card && event.type === 'updated') {
+                card.replaceWith(fromHtml(event.html));
+                return;
+            }
+        }
+        hint.classList.remove('d-none');
+    });
+}
+
+// «Показать еще» в результатах поиска: следующая страница в формате JSON
+function initSearchMore(button) {
+    const grid = document.querySelector('.notes-grid');
+    const pagination = document.querySelector('.pagination');
+
+    button.addEventListener('click', function() {
+        button.disabled = true;
+        fetch(button.dataset.moreUrl, {headers: {'Accept': 'application/json'}, credentials: 'same-origin'})
+            .then(function(response) {
+                return response.json();
+            })
+            .then(function(data) {
+                data.notes.forEach(function(note) {
+                    const template = document.createElement('template');
+                    template.innerHTML = note.html.trim();
+                    grid.appendChild(template.content.firstElementChild);
+                });
+                // Номера страниц после подгрузки уже не соответствуют списку
+                if (pagination) {
+                    pagination.closest('nav').remove();
+                }
+                if (data.next_page) {
+                    const url = new URL(button.dataset.moreUrl, window.location.href);
+                    url.searchParams.set('page', data.next_page);
+                    button.dataset.moreUrl = url.toString();
+                    button.disabled = false;
+                } else {
+                    button.remove();
+                }
+            })
+            .catch(function(err) {
+                button.disabled = false;
+                console.error('Ошибка загрузки результатов: ', err);
+            });
+    });
+}